@@ -0,0 +1,519 @@
+"""
+Append-only journal of annotation edits.
+
+Every edit of a dataset image is appended to the dataset's journal as a
+small JSON line: add, move, delete or relabel a box. Boxes are addressed by
+their position in the image's box list, which is also their line in the YOLO
+label file. The first edit of an image in a journal segment is preceded by a
+'base' record with the image's boxes at that point, so each segment can be
+replayed on its own.
+
+An image's version is the sequence number of its last edit (0 if it was
+never edited). patch() applies a client's delta (added, changed and removed
+boxes) only if the client's version is still current, so an edit made in
+another tab in between is reported as a VersionConflict instead of being
+overwritten.
+
+The current boxes of edited images are kept in memory (the YOLO label files
+plus the journal tail). Compaction periodically writes those images back to
+their label files through the LabelWriter, records the last compacted
+sequence number and starts a new segment. Old segments are kept, up to
+RETAIN_SEGMENTS, so history() and boxes_at() can show an image at any
+recorded point.
+
+On disk, under <journal dir>/<dataset>/:
+  segment-<first seq>.jsonl   journal records {"seq", "t", "split", "image", "op", ...}
+  state.json                  {"compacted_seq", "versions": {"<split>/<image>": last seq}}
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from label_arrays import parse_label_data
+
+JOURNAL_OPS = ('add', 'move', 'delete', 'relabel')
+COMPACT_OPS = 10000  # journal records that trigger a compaction
+COMPACT_AGE = 30.0  # seconds after which edits are compacted anyway
+SYNC_INTERVAL = 1.0  # seconds between fsyncs of journals with new records
+MAX_RETRY_DELAY = 3600.0  # longest wait between background compactions that keep failing
+RETAIN_SEGMENTS = 100
+DECIMALS = 6
+
+
+def read_label_boxes(label_path):
+    """Boxes of a YOLO label file as [class_id, x_center, y_center, width, height] lists"""
+    try:
+        with open(label_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    _, class_ids, coords = parse_label_data(data + b'\n', dtype=float)
+    return [[class_id] + [round(v, DECIMALS) for v in box] for class_id, box in zip(class_ids.tolist(), coords.tolist())]
+
+
+def format_label_boxes(boxes):
+    return ''.join(f"{box[0]} " + ' '.join(f"{v:.{DECIMALS}f}" for v in box[1:]) + '\n' for box in boxes)
+
+
+def apply_op(boxes, record):
+    """Apply one journal record to a box list in place"""
+    op = record['op']
+    if op == 'base':
+        boxes[:] = [list(box) for box in record['boxes']]
+    elif op == 'add':
+        boxes.append([record['class']] + list(record['box']))
+    elif op == 'move':
+        boxes[record['index']][1:] = list(record['box'])
+    elif op == 'delete':
+        del boxes[record['index']]
+    elif op == 'relabel':
+        boxes[record['index']][0] = record['class']
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+
+
+def validate_op(boxes, op):
+    """Check an edit against the current boxes; raises ValueError"""
+    kind = op.get('op')
+    if kind not in JOURNAL_OPS:
+        raise ValueError(f"Unknown operation: {kind}")
+    if kind != 'add':
+        index = op.get('index')
+        if not isinstance(index, int) or not 0 <= index < len(boxes):
+            raise ValueError(f"Box index out of range: {index}")
+    if kind in ('add', 'relabel') and (not isinstance(op.get('class'), int) or op['class'] < 0):
+        raise ValueError(f"Invalid class id: {op.get('class')}")
+    if kind in ('add', 'move'):
+        box = op.get('box')
+        if not isinstance(box, (list, tuple)) or len(box) != 4:
+            raise ValueError(f"Invalid box: {box}")
+
+
+def diff_boxes(old, new):
+    """Journal operations turning box list `old` into `new` (matched by position)"""
+    ops = []
+    for index, (before, after) in enumerate(zip(old, new)):
+        if before[0] != after[0]:
+            ops.append({'op': 'relabel', 'index': index, 'class': after[0]})
+        if before[1:] != after[1:]:
+            ops.append({'op': 'move', 'index': index, 'box': after[1:]})
+    for index in range(len(old) - 1, len(new) - 1, -1):
+        ops.append({'op': 'delete', 'index': index})
+    for box in new[len(old):]:
+        ops.append({'op': 'add', 'class': box[0], 'box': box[1:]})
+    return ops
+
+
+class VersionConflict(Exception):
+    """An edit was based on an older version of the image's boxes"""
+
+    def __init__(self, version):
+        super().__init__(f"Boxes changed since this edit's base version (now at version {version})")
+        self.version = version
+
+
+def _key(split, image):
+    return f'{split}/{image}'
+
+
+class AnnotationJournal:
+    """Journal and in-memory label state of one dataset"""
+
+    def __init__(self, journal_dir, dataset_name, label_path, label_writer):
+        self.dir = Path(journal_dir)
+        self.dataset_name = dataset_name
+        self.label_path = label_path  # label_path(split, image) -> path of the image's label file
+        self.label_writer = label_writer
+        self.images = {}  # key -> {'split', 'image', 'boxes'} for images edited since the last compaction
+        self.versions = {}  # key -> seq of the image's last edit
+        self.compacted_seq = 0
+        self.seq = 0
+        self.tail_records = 0
+        self.tail_started = None
+        self._based = set()  # keys with a base record in the current segment
+        self._file = None
+        self._dirty = False
+        self.failures = 0  # compactions failed in a row; the background retry backs off exponentially
+        self.retry_at = None
+        self.discarded = False
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()  # a second compaction waits until the label files are written
+        self._load()
+
+    # --- Files ---
+    def _segments(self):
+        """(first seq, path) of every segment, oldest first"""
+        segments = []
+        if not self.dir.is_dir():
+            return segments
+        for path in self.dir.glob('segment-*.jsonl'):
+            try:
+                segments.append((int(path.stem.split('-', 1)[1]), path))
+            except ValueError:
+                continue
+        return sorted(segments)
+
+    @staticmethod
+    def _records(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash: the edit never got acknowledged
+                    continue
+
+    def _load(self):
+        try:
+            with open(self.dir / 'state.json', 'r') as f:
+                state = json.load(f)
+            self.compacted_seq = state['compacted_seq']
+            self.versions = state['versions']
+        except (OSError, ValueError, KeyError):
+            pass
+        self.seq = self.compacted_seq
+        for _, path in self._segments():
+            for record in self._records(path):
+                self.seq = max(self.seq, record['seq'])
+                if record['seq'] <= self.compacted_seq:
+                    continue
+                key = _key(record['split'], record['image'])
+                entry = self.images.setdefault(key, {'split': record['split'], 'image': record['image'], 'boxes': []})
+                apply_op(entry['boxes'], record)
+                self.versions[key] = record['seq']
+                self.tail_records += 1
+        if self.tail_records:
+            self.tail_started = time.time()
+            print(f"Replayed {self.tail_records} journal records of {self.dataset_name}")
+        self._open_segment()
+
+    def _open_segment(self):
+        """Start a new segment with the next record (the file is created by the first append)"""
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._based = set()
+
+    def _segment_file(self):
+        if self._file is None:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            path = self.dir / f'segment-{self.seq + 1:012d}.jsonl'
+            torn = path.exists() and path.stat().st_size and path.read_bytes()[-1:] != b'\n'
+            self._file = open(path, 'a', encoding='utf-8')
+            if torn:
+                self._file.write('\n')  # end a torn record left by a crash, so it stays one bad line
+        return self._file
+
+    def _append(self, record):
+        f = self._segment_file()
+        self.seq += 1
+        record = {'seq': self.seq, 't': round(time.time(), 3), **record}
+        f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._dirty = True
+        self.tail_records += 1
+        if self.tail_started is None:
+            self.tail_started = time.time()
+        return record
+
+    def sync(self):
+        """fsync the journal if records were appended since the last sync"""
+        with self._lock:
+            if self._dirty and self._file:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    # --- Edits and reads ---
+    def _current(self, split, image):
+        """Current boxes of an image (not copied)"""
+        entry = self.images.get(_key(split, image))
+        return entry['boxes'] if entry else read_label_boxes(self.label_path(split, image))
+
+    def apply(self, split, image, ops, base_version=None):
+        """Append edits of one image; returns (version, boxes). All ops are checked first.
+
+        With base_version, raises VersionConflict unless that is still the image's version.
+        """
+        with self._lock:
+            if self.discarded:
+                raise ValueError(f"Annotations of {self.dataset_name} were discarded with the dataset")
+            key = _key(split, image)
+            if base_version is not None and base_version != self.versions.get(key, 0):
+                raise VersionConflict(self.versions.get(key, 0))
+            current = self._current(split, image)
+            boxes = [list(box) for box in current]
+            records = []
+            for op in ops:
+                validate_op(boxes, op)
+                record = {'split': split, 'image': image, 'op': op['op']}
+                record.update((name, op[name]) for name in ('index', 'class') if name in op)
+                if 'box' in op:
+                    try:
+                        record['box'] = [round(float(v), DECIMALS) for v in op['box']]
+                    except (TypeError, ValueError):
+                        raise ValueError(f"Invalid box: {op['box']}")
+                apply_op(boxes, record)
+                records.append(record)
+            if not records:
+                return self.versions.get(key, 0), boxes
+
+            if key not in self._based:
+                self._append({'split': split, 'image': image, 'op': 'base', 'boxes': current})
+                self._based.add(key)
+            for record in records:
+                self._append(record)
+            self._file.flush()  # in the OS before the edit is acknowledged; fsync follows within SYNC_INTERVAL
+            self.images[key] = {'split': split, 'image': image, 'boxes': boxes}
+            self.versions[key] = self.seq
+            return self.seq, boxes
+
+    def replace(self, split, image, boxes):
+        """Journal the edits that turn an image's boxes into `boxes`; returns (version, boxes)"""
+        with self._lock:
+            new = [[int(box[0])] + [round(float(v), DECIMALS) for v in box[1:5]] for box in boxes]
+            return self.apply(split, image, diff_boxes(self._current(split, image), new))
+
+    def patch(self, split, image, base_version, added=(), changed=None, removed=()):
+        """Apply a client's delta to the boxes of version base_version; returns (version, boxes).
+
+        changed maps box index -> new [class_id, x_center, y_center, width,
+        height] row, removed lists box indices and added holds new rows.
+        Indices refer to the boxes of base_version; the kept boxes stay in
+        order and added ones are appended. Raises VersionConflict if another
+        edit came first.
+        """
+        with self._lock:
+            if base_version != self.version(split, image):
+                raise VersionConflict(self.version(split, image))
+            current = self._current(split, image)
+            removed = set(removed)
+            ops = []
+            for index, row in sorted((changed or {}).items()):
+                if not isinstance(index, int) or not 0 <= index < len(current):
+                    raise ValueError(f"Box index out of range: {index}")
+                if index in removed:
+                    continue
+                row = [int(row[0])] + [round(float(v), DECIMALS) for v in row[1:5]]
+                if row[0] != current[index][0]:
+                    ops.append({'op': 'relabel', 'index': index, 'class': row[0]})
+                if row[1:] != current[index][1:]:
+                    ops.append({'op': 'move', 'index': index, 'box': row[1:]})
+            ops.extend({'op': 'delete', 'index': index} for index in sorted(removed, reverse=True))
+            ops.extend({'op': 'add', 'class': int(row[0]), 'box': row[1:5]} for row in added)
+            return self.apply(split, image, ops, base_version)
+
+    def boxes(self, split, image):
+        """(version, boxes) of an image: from memory if edited since the last compaction, else None"""
+        with self._lock:
+            key = _key(split, image)
+            entry = self.images.get(key)
+            return self.versions.get(key, 0), ([list(box) for box in entry['boxes']] if entry else None)
+
+    def version(self, split, image):
+        with self._lock:
+            return self.versions.get(_key(split, image), 0)
+
+    def history(self, split, image, limit=1000):
+        """The image's journal records, newest first (base records omitted)"""
+        records = []
+        for _, path in reversed(self._segments()):
+            segment = [r for r in self._records(path)
+                       if r['split'] == split and r['image'] == image and r['op'] != 'base']
+            records.extend(reversed(segment))
+            if len(records) >= limit:
+                break
+        return records[:limit]
+
+    def boxes_at(self, split, image, seq):
+        """An image's boxes right after journal record `seq`, or None if that's before the kept history"""
+        segments = self._segments()
+        if not segments or seq < segments[0][0] - 1:
+            return None
+        boxes = None
+        for _, path in segments:
+            for record in self._records(path):
+                if record['split'] != split or record['image'] != image:
+                    continue
+                if record['seq'] > seq:
+                    # The image's first record of a segment is a base: its state before later edits
+                    return boxes if boxes is not None else record['boxes']
+                boxes = boxes if boxes is not None else []
+                apply_op(boxes, record)
+        if boxes is not None:
+            return boxes
+        _, boxes = self.boxes(split, image)
+        return boxes if boxes is not None else read_label_boxes(self.label_path(split, image))
+
+    # --- Compaction ---
+    def needs_compaction(self):
+        if self.retry_at is not None and time.time() < self.retry_at:
+            return False
+        return self.tail_records >= COMPACT_OPS or (
+            self.tail_records > 0 and time.time() - self.tail_started >= COMPACT_AGE)
+
+    def compact(self):
+        """Write edited images back to their label files and start a new segment.
+
+        After a failure (e.g. an edited image's split is no longer known, so
+        its label path can't be resolved) the edits stay journaled, and
+        needs_compaction() waits exponentially longer before the next try.
+        """
+        try:
+            compacted = self._compact()
+        except Exception:
+            with self._lock:
+                self.failures += 1
+                delay = min(COMPACT_AGE * 2 ** self.failures, MAX_RETRY_DELAY)
+                self.retry_at = time.time() + delay
+            print(f"Compaction of {self.dataset_name} failed {self.failures} time(s) in a row, "
+                  f"retrying in {delay:.0f}s")
+            raise
+        with self._lock:
+            self.failures = 0
+            self.retry_at = None
+        return compacted
+
+    def _compact(self):
+        with self._compact_lock:
+            with self._lock:
+                if not self.tail_records:
+                    return 0
+                entries = list(self.images.items())
+                # Resolve every label path first, so a failure leaves the tail to be compacted later
+                writes = [(self.label_path(entry['split'], entry['image']), format_label_boxes(entry['boxes']), entry)
+                          for _, entry in entries]
+                self.sync()
+                compacted_seq = self.seq
+                self._open_segment()
+                self.tail_records = 0
+                self.tail_started = None
+
+            errors = self.label_writer.error_count()
+            for label_path, text, entry in writes:
+                self.label_writer.save(label_path, text, dataset=self.dataset_name, image=entry['image'],
+                                       split=entry['split'])
+            self.label_writer.flush()  # waits for a batch the writer thread may have picked up already
+            if self.label_writer.error_count() > errors:
+                with self._lock:
+                    # Keep the edits in memory and the journal uncompacted; try again after COMPACT_AGE
+                    self.tail_records = max(self.tail_records, 1)
+                    self.tail_started = self.tail_started or time.time()
+                raise RuntimeError(f"Some label files of {self.dataset_name} could not be written")
+
+            with self._lock:
+                if self.discarded:
+                    return 0
+                state_file = self.dir / 'state.json'
+                tmp_file = state_file.with_suffix('.tmp')
+                with open(tmp_file, 'w') as f:
+                    json.dump({'compacted_seq': compacted_seq, 'versions': self.versions}, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, state_file)
+                self.compacted_seq = compacted_seq
+                # Images not edited since the snapshot are served from their label files again
+                for key, entry in entries:
+                    if self.versions.get(key, 0) <= compacted_seq and self.images.get(key) is entry:
+                        del self.images[key]
+                for _, path in self._segments()[:-RETAIN_SEGMENTS]:
+                    path.unlink()
+            print(f"Compacted {len(entries)} edited images of {self.dataset_name} into label files")
+            return len(entries)
+
+    def close(self):
+        self.compact()
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def discard(self):
+        """Close the journal without compacting it and delete its files, uncompacted edits included.
+
+        Doesn't wait for a running compaction (its label writes may be what
+        triggered the removal); that compaction stops before recording its
+        state, and later edits are refused.
+        """
+        with self._lock:
+            self.discarded = True
+            if self._file:
+                self._file.close()
+                self._file = None
+            self.images.clear()
+            self.versions.clear()
+            self._based.clear()
+            self.tail_records = 0
+            self.tail_started = None
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class AnnotationJournals:
+    """Journals of all datasets, with a background thread for syncing and compaction"""
+
+    def __init__(self, journal_dir, label_path, label_writer):
+        self.journal_dir = Path(journal_dir)
+        self.label_path = label_path  # label_path(dataset, split, image)
+        self.label_writer = label_writer
+        self.journals = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def get(self, dataset_name):
+        with self._lock:
+            journal = self.journals.get(dataset_name)
+            if journal is None:
+                journal = AnnotationJournal(
+                    self.journal_dir / dataset_name, dataset_name,
+                    lambda split, image: self.label_path(dataset_name, split, image), self.label_writer)
+                self.journals[dataset_name] = journal
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='annotation-journal', daemon=True)
+                self._thread.start()
+            return journal
+
+    def open_existing(self):
+        """Open the journals left on disk, so edits that weren't compacted before a restart are replayed"""
+        if self.journal_dir.is_dir():
+            for path in self.journal_dir.iterdir():
+                if path.is_dir() and any(path.glob('segment-*.jsonl')):
+                    self.get(path.name)
+
+    def drop(self, dataset_name):
+        """Forget a dataset's journal and delete it (the dataset was replaced or removed)"""
+        # Under the lock get() takes, so no request opens the journal again while its files are deleted
+        with self._lock:
+            journal = self.journals.pop(dataset_name, None)
+            if journal:
+                journal.discard()
+            else:
+                shutil.rmtree(self.journal_dir / dataset_name, ignore_errors=True)
+
+    def compact(self, dataset_name):
+        with self._lock:
+            journal = self.journals.get(dataset_name)
+        if journal:
+            journal.compact()
+
+    def _run(self):
+        while not self._stop.wait(SYNC_INTERVAL):
+            with self._lock:
+                journals = list(self.journals.values())
+            for journal in journals:
+                try:
+                    journal.sync()
+                    if journal.needs_compaction():
+                        journal.compact()
+                except Exception as e:
+                    print(f"Error maintaining journal of {journal.dataset_name}: {e}")
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            journals = list(self.journals.values())
+        for journal in journals:
+            journal.close()
@@ -10,12 +10,33 @@ from PIL import Image
 from ultralytics import YOLO
 from werkzeug.utils import secure_filename
 import glob
+import threading
+import atexit
 from pathlib import Path
+import numpy as np
 
 # Import the YOLOE module itself, and specific functions/vars if needed elsewhere
 import yoloe_label
 # Use the modified load function name directly
 from yoloe_label import load_yoloe_model as load_yoloe_model_with_labels, predict_yoloe
+from dataset_index import DatasetIndex
+from dataset_watch import DatasetWatcher
+from dataset_catalog import DatasetCatalog
+from image_probe import probe_image, oriented_size
+from dataset_analysis import analyze_dataset, refine_classes, AnalysisPool
+from dataset_scan import labels_dir_for
+from dataset_stats import DatasetStats
+from dataset_validate import ValidationJobs
+from dataset_audit import AuditJobs
+from thumbnails import ThumbnailCache, THUMBNAIL_SIZES, fallback_key
+from image_hash import group_near_duplicates, MAX_DISTANCE as MAX_DUPLICATE_DISTANCE
+from label_bulk import LabelStream, encode_json, encode_binary
+from label_arrays import LabelCache, parse_label_data
+from label_writer import LabelWriter
+from annotation_journal import AnnotationJournals, VersionConflict, read_label_boxes
+from dataset_export import DatasetExport
+from coco_format import convert_coco_dataset
+from box_merge import merge_predictions, MATCH_IOU
 
 import torch
 
@@ -23,13 +44,25 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
+app.config['CACHE_FOLDER'] = 'cache'  # Dataset index and other derived data
+# How to notice files dropped into the uploads folder: 'auto' (inotify, polling fallback), 'inotify', 'poll' or 'off'
+app.config['UPLOAD_WATCHER'] = os.environ.get('LAIBEL_UPLOAD_WATCHER', 'auto')
+# Worker processes used for dataset analysis and validation (defaults to the CPU count)
+app.config['INDEX_WORKERS'] = int(os.environ.get('LAIBEL_INDEX_WORKERS', 0)) or os.cpu_count()
+# Seconds annotation saves are collected (and coalesced per image) before being written to disk
+app.config['LABEL_FLUSH_INTERVAL'] = float(os.environ.get('LAIBEL_LABEL_FLUSH_INTERVAL', 0.5))
+# Disk space for cached image thumbnails, least recently used evicted first
+app.config['THUMBNAIL_CACHE_MB'] = int(os.environ.get('LAIBEL_THUMBNAIL_CACHE_MB', 1024))
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['CACHE_FOLDER'], exist_ok=True)
 
 # --- AI Model State (Global) ---
 YOLO_MODEL_PATH = 'models/dome.pt'
 yolo_model = None
 yolo_model_load_error = None
 is_model_loading = False
+# Ultralytics predictors aren't thread-safe: every predict call (assist endpoints, audits) holds this
+model_lock = threading.Lock()
 
 # --- YOLOE Model State ---
 is_yoloe_loading = False
@@ -38,278 +71,159 @@ is_yoloe_loading = False
 
 # --- Dataset Management Functions ---
 def scan_datasets():
-    """Scan the uploads directory for YOLO datasets"""
-    datasets = []
-    uploads_path = Path(app.config['UPLOAD_FOLDER'])
-    
-    print(f"Scanning for datasets in: {uploads_path}")
-    
-    if not uploads_path.exists():
-        print("Uploads folder doesn't exist, creating it...")
-        uploads_path.mkdir(parents=True, exist_ok=True)
-        return datasets
-    
-    # Look for directories in uploads folder
-    for item in uploads_path.iterdir():
-        if item.is_dir():
-            print(f"Found directory: {item.name}")
-            dataset_info = analyze_dataset(item)
-            if dataset_info:
-                datasets.append(dataset_info)
-                print(f"Valid dataset found: {item.name} with {dataset_info['total_images']} images")
-            else:
-                print(f"Invalid dataset: {item.name}")
-    
+    """Return the valid YOLO datasets in the uploads directory.
+
+    Reads from the persistent dataset index; only datasets whose directories
+    changed since they were last indexed are analyzed again.
+    """
+    datasets = dataset_index.datasets()
     print(f"Total valid datasets found: {len(datasets)}")
     return datasets
 
-def analyze_dataset(dataset_path):
-    """Analyze a directory to determine if it's a valid YOLO dataset"""
-    dataset_path = Path(dataset_path)
-    dataset_name = dataset_path.name
-    
-    print(f"\
-Analyzing dataset: {dataset_name}")
-    print(f"Dataset path: {dataset_path}")
-    
-    # Look for data.yaml or similar configuration file
-    yaml_files = list(dataset_path.glob('*.yaml')) + list(dataset_path.glob('*.yml'))
-    
-    dataset_info = {
-        'name': dataset_name,
-        'path': str(dataset_path),
-        'yaml_file': None,
-        'classes': [],
-        'splits': {},
-        'total_images': 0,
-        'total_labels': 0,
-        'valid': False
-    }
-    
-    # Parse YAML file if exists
-    if yaml_files:
-        yaml_file = yaml_files[0]  # Use the first YAML file found
-        dataset_info['yaml_file'] = str(yaml_file)
-        print(f"Found YAML file: {yaml_file}")
-        
-        try:
-            with open(yaml_file, 'r') as f:
-                yaml_data = yaml.safe_load(f)
-            
-            print(f"YAML contents: {yaml_data}")
-            
-            # Extract classes
-            if 'names' in yaml_data:
-                if isinstance(yaml_data['names'], dict):
-                    dataset_info['classes'] = list(yaml_data['names'].values())
-                elif isinstance(yaml_data['names'], list):
-                    dataset_info['classes'] = yaml_data['names']
-                print(f"Classes from YAML: {dataset_info['classes']}")
-            
-            # Extract split information
-            for split in ['train', 'val', 'test', 'valid']:
-                if split in yaml_data:
-                    split_path = yaml_data[split]
-                    if isinstance(split_path, str):
-                        # Handle relative paths
-                        if not os.path.isabs(split_path):
-                            if split_path.endswith('/images') or split_path.endswith('\\\\images'):
-                                # Path points to images directory
-                                full_split_path = dataset_path / split_path
-                                images_dir = full_split_path
-                                labels_dir = full_split_path.parent / 'labels'
-                            else:
-                                # Path points to split directory, look for images/labels subdirs
-                                full_split_path = dataset_path / split_path
-                                images_dir = full_split_path / 'images' if (full_split_path / 'images').exists() else full_split_path
-                                labels_dir = full_split_path / 'labels' if (full_split_path / 'labels').exists() else None
-                        else:
-                            split_path = Path(split_path)
-                            images_dir = split_path / 'images' if (split_path / 'images').exists() else split_path
-                            labels_dir = split_path / 'labels' if (split_path / 'labels').exists() else None
-                        
-                        print(f"Split '{split}' - Images dir: {images_dir}, Labels dir: {labels_dir}")
-                        
-                        if images_dir and images_dir.exists():
-                            # Count images using proper file extensions
-                            image_extensions = ['jpg', 'jpeg', 'png', 'bmp', 'tif', 'tiff', 'webp']
-                            images = []
-                            
-                            for ext in image_extensions:
-                                # Use rglob for recursive search, but limit to immediate directory for performance
-                                images.extend(list(images_dir.glob(f'*.{ext}')))
-                                images.extend(list(images_dir.glob(f'*.{ext.upper()}')))
-                            
-                            labels = []
-                            if labels_dir and labels_dir.exists():
-                                labels = list(labels_dir.glob('*.txt'))
-                            
-                            print(f"Found {len(images)} images and {len(labels)} labels in {split}")
-                            
-                            if images:  # Only add if we found images
-                                dataset_info['splits'][split] = {
-                                    'images_dir': str(images_dir),
-                                    'labels_dir': str(labels_dir) if labels_dir and labels_dir.exists() else None,
-                                    'image_count': len(images),
-                                    'label_count': len(labels),
-                                    'images': [img.name for img in images]
-                                }
-                                
-                                dataset_info['total_images'] += len(images)
-                                dataset_info['total_labels'] += len(labels)
-            
-            dataset_info['valid'] = dataset_info['total_images'] > 0
-            
-        except Exception as e:
-            print(f"Error parsing YAML file {yaml_file}: {e}")
-    
-    # If no YAML or YAML didn't work, try to infer structure
-    if not dataset_info['valid']:
-        print("No valid YAML found, trying to infer dataset structure...")
-        
-        # Look for common YOLO directory structures
-        for subdir in ['train', 'val', 'test', 'valid']:
-            subdir_path = dataset_path / subdir
-            print(f"Checking for split directory: {subdir_path}")
-            
-            if subdir_path.exists() and subdir_path.is_dir():
-                print(f"Found split directory: {subdir}")
-                
-                # Check for images subdirectory, otherwise use the split directory itself
-                images_dir = subdir_path / 'images' if (subdir_path / 'images').exists() else subdir_path
-                labels_dir = subdir_path / 'labels' if (subdir_path / 'labels').exists() else None
-                
-                print(f"Images dir: {images_dir}, Labels dir: {labels_dir}")
-                
-                # Count images
-                image_extensions = ['jpg', 'jpeg', 'png', 'bmp', 'tif', 'tiff', 'webp']
-                images = []
-                
-                for ext in image_extensions:
-                    images.extend(list(images_dir.glob(f'*.{ext}')))
-                    images.extend(list(images_dir.glob(f'*.{ext.upper()}')))
-                
-                labels = []
-                if labels_dir and labels_dir.exists():
-                    labels = list(labels_dir.glob('*.txt'))
-                
-                print(f"Found {len(images)} images and {len(labels)} labels")
-                
-                if images:  # Only add if we found images
-                    dataset_info['splits'][subdir] = {
-                        'images_dir': str(images_dir),
-                        'labels_dir': str(labels_dir) if labels_dir and labels_dir.exists() else None,
-                        'image_count': len(images),
-                        'label_count': len(labels),
-                        'images': [img.name for img in images]
-                    }
-                    
-                    dataset_info['total_images'] += len(images)
-                    dataset_info['total_labels'] += len(labels)
-        
-        # Try to infer classes from label files
-        if dataset_info['splits'] and not dataset_info['classes']:
-            print("Inferring classes from label files...")
-            classes_set = set()
-            for split_info in dataset_info['splits'].values():
-                labels_dir = split_info['labels_dir']
-                if labels_dir and os.path.exists(labels_dir):
-                    for label_file in Path(labels_dir).glob('*.txt'):
-                        try:
-                            with open(label_file, 'r') as f:
-                                for line in f:
-                                    parts = line.strip().split()
-                                    if parts and parts[0].isdigit():
-                                        class_id = int(parts[0])
-                                        classes_set.add(class_id)
-                        except Exception as e:
-                            print(f"Error reading label file {label_file}: {e}")
-                            continue
-            
-            if classes_set:
-                max_class = max(classes_set)
-                dataset_info['classes'] = [f'class_{i}' for i in range(max_class + 1)]
-                print(f"Inferred classes: {dataset_info['classes']}")
-        
-        dataset_info['valid'] = dataset_info['total_images'] > 0
-    
-    print(f"Dataset analysis complete. Valid: {dataset_info['valid']}, Total images: {dataset_info['total_images']}")
-    return dataset_info if dataset_info['valid'] else None
+def find_dataset(dataset_name):
+    """Look up a single dataset in the index"""
+    return dataset_index.get(dataset_name)
+
+# Workers are forked here, before any of the app's background threads exist, and
+# shared by every background job that fans out over a process pool
+analysis_pool = AnalysisPool(app.config['INDEX_WORKERS'])
+dataset_index = DatasetIndex(
+    app.config['UPLOAD_FOLDER'],
+    os.path.join(app.config['CACHE_FOLDER'], 'dataset_index.json'),
+    analyze_dataset,
+    pool=analysis_pool,
+    refine_fn=refine_classes,
+)
+dataset_catalog = DatasetCatalog(os.path.join(app.config['CACHE_FOLDER'], 'catalog.sqlite3'))
+dataset_index.listeners.append(dataset_catalog.on_dataset_changed)
+dataset_watcher = DatasetWatcher(dataset_index, mode=app.config['UPLOAD_WATCHER'])
+label_cache = LabelCache(os.path.join(app.config['CACHE_FOLDER'], 'labels'))
+dataset_stats = DatasetStats(os.path.join(app.config['CACHE_FOLDER'], 'stats'), label_cache)
+validation_jobs = ValidationJobs(os.path.join(app.config['CACHE_FOLDER'], 'validation'), analysis_pool.executor)
+audit_jobs = AuditJobs(os.path.join(app.config['CACHE_FOLDER'], 'audit'), model_lock)
+thumbnail_cache = ThumbnailCache(os.path.join(app.config['CACHE_FOLDER'], 'thumbnails'),
+                                 app.config['THUMBNAIL_CACHE_MB'] * 1024 * 1024, analysis_pool.executor)
+
+def on_labels_written(entries):
+    """Catch the catalog up with label files written by the save endpoint"""
+    unindexed = set()
+    for entry in entries:
+        if not dataset_catalog.refresh_label(entry['dataset'], entry['image'], entry['split']):
+            unindexed.add(entry['dataset'])
+    # A split without labels got its labels directory just now: re-analyze so the index and catalog find it
+    for dataset_name in sorted(unindexed):
+        print(f"Re-indexing {dataset_name} to pick up new label files")
+        dataset_index.reindex(dataset_name)
+
+label_writer = LabelWriter(app.config['LABEL_FLUSH_INTERVAL'], on_flushed=on_labels_written)
+atexit.register(label_writer.close)
+
+def journal_label_path(dataset_name, split, image_name):
+    """Label file an edited image is compacted into"""
+    image_row = dataset_catalog.find_image(dataset_name, image_name, split)
+    if image_row and image_row['label_path']:
+        return image_row['label_path']
+    dataset = find_dataset(dataset_name)
+    if not dataset or split not in dataset['splits']:
+        raise ValueError(f"Unknown image {split}/{image_name} of dataset {dataset_name}")
+    return label_path_for(dataset, split, image_name)
+
+# Edits go to the journal first; it compacts them into label files through the label writer
+annotation_journals = AnnotationJournals(os.path.join(app.config['CACHE_FOLDER'], 'journal'),
+                                         journal_label_path, label_writer)
+atexit.register(annotation_journals.close)  # runs before label_writer.close
+dataset_index.removal_listeners.append(annotation_journals.drop)
+
+def compact_journal(dataset_name):
+    """Write a dataset's journaled edits to its label files; returns an error response if that failed"""
+    try:
+        annotation_journals.compact(dataset_name)
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"Error compacting annotations of {dataset_name}: {e}")
+        return jsonify({"success": False, "error": f"Could not write saved annotations to label files: {e}"}), 500
+    return None
+
+def build_dataset_index():
+    """Initial index build; datasets appear in the UI one by one as they finish"""
+    dataset_index.refresh()
+    dataset_watcher.start()
+    dataset_catalog.sync_index(dataset_index)
+    annotation_journals.open_existing()  # replay edits not compacted before the last shutdown
+    dataset_catalog.start_metadata_worker(analysis_pool.executor)
+
+threading.Thread(target=build_dataset_index, name='dataset-indexer', daemon=True).start()
 
 def load_dataset_images(dataset_name, split=None):
     """Load images from a specific dataset and split"""
-    datasets = scan_datasets()
-    dataset = next((d for d in datasets if d['name'] == dataset_name), None)
-    
-    if not dataset:
+    if not find_dataset(dataset_name):
+        return []
+    return dataset_catalog.list_images(dataset_name, split)
+
+def parse_yolo_label(label_path, image_width, image_height, class_names, data=None):
+    """Parse a YOLO format label file (or its contents, when `data` is given)"""
+    if data is None and not os.path.exists(label_path):
         return []
-    
-    images = []
-    splits_to_load = [split] if split else dataset['splits'].keys()
-    
-    for split_name in splits_to_load:
-        if split_name in dataset['splits']:
-            split_info = dataset['splits'][split_name]
-            images_dir = split_info['images_dir']
-            labels_dir = split_info['labels_dir']
-            
-            for image_name in split_info['images']:
-                image_path = os.path.join(images_dir, image_name)
-                label_path = None
-                
-                if labels_dir:
-                    label_name = os.path.splitext(image_name)[0] + '.txt'
-                    label_path = os.path.join(labels_dir, label_name)
-                    if not os.path.exists(label_path):
-                        label_path = None
-                
-                if os.path.exists(image_path):
-                    images.append({
-                        'name': image_name,
-                        'image_path': image_path,
-                        'label_path': label_path,
-                        'split': split_name,
-                        'dataset': dataset_name
-                    })
-    
-    return images
 
-def parse_yolo_label(label_path, image_width, image_height, class_names):
-    """Parse a YOLO format label file"""
-    boxes = []
-    if not os.path.exists(label_path):
-        return boxes
-    
     try:
-        with open(label_path, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) >= 5:
-                    class_id = int(parts[0])
-                    x_center = float(parts[1])
-                    y_center = float(parts[2])
-                    width = float(parts[3])
-                    height = float(parts[4])
-                    
-                    # Convert from YOLO format (normalized) to pixel coordinates
-                    x = (x_center - width / 2) * image_width
-                    y = (y_center - height / 2) * image_height
-                    w = width * image_width
-                    h = height * image_height
-                    
-                    class_name = class_names[class_id] if class_id < len(class_names) else f'class_{class_id}'
-                    
-                    boxes.append({
-                        'x': max(0, x),
-                        'y': max(0, y),
-                        'width': min(w, image_width - x),
-                        'height': min(h, image_height - y),
-                        'label': class_name
-                    })
+        if data is None:
+            with open(label_path, 'rb') as f:
+                data = f.read()
+        _, class_ids, coords = parse_label_data(data + b'\n', dtype=np.float64)
     except Exception as e:
         print(f"Error parsing label file {label_path}: {e}")
-    
-    return boxes
+        return []
+
+    return yolo_to_pixel_boxes(class_ids.tolist(), coords, image_width, image_height, class_names)
+
+def yolo_to_pixel_boxes(class_ids, coords, image_width, image_height, class_names):
+    """Box dicts in pixels for class ids and normalized (x_center, y_center, width, height) rows"""
+    if not len(class_ids):
+        return []
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 4)
+    # Convert from YOLO format (normalized) to pixel coordinates, all boxes at once
+    x = (coords[:, 0] - coords[:, 2] / 2) * image_width
+    y = (coords[:, 1] - coords[:, 3] / 2) * image_height
+    w = np.minimum(coords[:, 2] * image_width, image_width - x)
+    h = np.minimum(coords[:, 3] * image_height, image_height - y)
+    x, y = np.maximum(x, 0), np.maximum(y, 0)
+
+    return [{
+        'x': float(x[i]),
+        'y': float(y[i]),
+        'width': float(w[i]),
+        'height': float(h[i]),
+        'label': class_names[class_id] if class_id < len(class_names) else f'class_{class_id}'
+    } for i, class_id in enumerate(class_ids)]
+
+def pixel_to_yolo_boxes(boxes, image_width, image_height, class_names):
+    """[class_id, x_center, y_center, width, height] rows for boxes in pixels (the inverse of yolo_to_pixel_boxes)"""
+    rows = []
+    unknown = set()
+    for box in boxes:
+        label = box['label']
+        if label in class_names:
+            class_id = class_names.index(label)
+        elif label.startswith('class_') and label[6:].isdigit():
+            class_id = int(label[6:])
+        else:
+            unknown.add(label)
+            continue
+        x_center = (box['x'] + box['width'] / 2) / image_width
+        y_center = (box['y'] + box['height'] / 2) / image_height
+        width = box['width'] / image_width
+        height = box['height'] / image_height
+        rows.append([class_id] + [min(max(v, 0.0), 1.0) for v in (x_center, y_center, width, height)])
+    if unknown:
+        raise ValueError(f"Labels not in the dataset's classes: {', '.join(sorted(unknown))}")
+    return rows
+
+def label_path_for(dataset, split, image_name):
+    """Where an image's YOLO label file lives (or will be created)"""
+    split_info = dataset['splits'][split]
+    labels_dir = split_info['labels_dir']
+    if not labels_dir:
+        labels_dir = str(labels_dir_for(split_info['images_dir']))
+    return os.path.join(labels_dir, os.path.splitext(image_name)[0] + '.txt')
 
 # --- Function to Load YOLO Model ---
 def load_yolo_model():
@@ -359,11 +273,10 @@ def load_yolo_model():
 @app.route('/')
 def index():
     yoloe_classes = getattr(yoloe_label, 'yoloe_model_classes', [])
-    datasets = scan_datasets()
+    datasets, _ = dataset_index.summaries()
     
     print(f"Rendering index. YOLOE Status - Model: {yoloe_label.yoloe_model is not None}, Error: {yoloe_label.yoloe_model_load_error}, Classes: {yoloe_classes}")
     print(f"Found {len(datasets)} datasets: {[d['name'] for d in datasets]}")
-    print(f"Datasets being passed to template: {datasets}")
     
     template_data = {
         'yolo_model_loaded': yolo_model is not None,
@@ -374,27 +287,341 @@ def index():
         'datasets': datasets
     }
     
-    print(f"Template data: {template_data}")
-    
     return render_template('index.html', **template_data)
 
 # --- Dataset Management Endpoints ---
+IMAGE_PAGE_SIZE = 100
+MAX_IMAGE_PAGE_SIZE = 1000
+
 @app.route('/api/datasets', methods=['GET'])
 def get_datasets():
-    """Get list of available datasets"""
-    datasets = scan_datasets()
-    return jsonify({"success": True, "datasets": datasets})
+    """Get summaries of the available datasets (image names are listed by the images endpoint)"""
+    _, datasets_json = dataset_index.summaries()
+    return app.response_class('{"success": true, "datasets": %s}' % datasets_json, mimetype='application/json')
+
+@app.route('/api/datasets/status', methods=['GET'])
+def get_datasets_status():
+    """Progress of dataset indexing, polled by the UI while datasets are still being analyzed"""
+    return jsonify({"success": True, **dataset_index.status()})
+
+def _image_page_response(dataset_name, filters):
+    """Paginated image listing shared by the images and query endpoints"""
+    after = request.args.get('after') or None
+    sort = request.args.get('sort', 'name')
+    descending = request.args.get('order', 'asc').lower() == 'desc'
+    try:
+        limit = min(max(int(request.args.get('limit', IMAGE_PAGE_SIZE)), 1), MAX_IMAGE_PAGE_SIZE)
+        images, next_cursor = dataset_catalog.page_images(
+            dataset_name, after=after, limit=limit, sort=sort, descending=descending, **filters)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    response = {"success": True, "images": images, "next_cursor": next_cursor}
+    if not after:
+        # Total only on the first page so following pages stay index-only
+        response["total"] = dataset_catalog.count_images(dataset_name, **filters)
+    return jsonify(response)
+
+def _bool_arg(name):
+    value = request.args.get(name)
+    return None if value is None else value.lower() in ('1', 'true', 'yes')
+
+def _int_arg(name):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+def _query_filters(dataset):
+    """Catalog filters from the query endpoint's parameters; raises ValueError on bad values"""
+    classes = []
+    for value in request.args.getlist('class'):
+        for item in value.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            if item.isdigit():
+                classes.append(int(item))
+            elif item in dataset['classes']:
+                classes.append(dataset['classes'].index(item))
+            else:
+                raise ValueError(f"Unknown class: {item}")
+    return {
+        'split': request.args.get('split') or None,
+        'prefix': request.args.get('prefix') or None,
+        'labeled': _bool_arg('labeled'),
+        'classes': classes,
+        'match': request.args.get('match', 'any'),
+        'min_class_boxes': _int_arg('min_class_boxes'),
+        'min_boxes': _int_arg('min_boxes'),
+        'max_boxes': _int_arg('max_boxes'),
+    }
 
 @app.route('/api/datasets/<dataset_name>/images', methods=['GET'])
 def get_dataset_images(dataset_name):
-    """Get images from a specific dataset"""
-    split = request.args.get('split', None)
-    images = load_dataset_images(dataset_name, split)
-    return jsonify({"success": True, "images": images})
+    """Get one page of images from a specific dataset.
+
+    Query parameters: split, limit, after (cursor from the previous page),
+    labeled (true/false), prefix (file name prefix), sort (name, split, mtime,
+    boxes) and order (asc/desc).
+    """
+    if not find_dataset(dataset_name):
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+
+    filters = {
+        'split': request.args.get('split') or None,
+        'prefix': request.args.get('prefix') or None,
+        'labeled': _bool_arg('labeled'),
+    }
+    return _image_page_response(dataset_name, filters)
+
+@app.route('/api/datasets/<dataset_name>/query', methods=['GET'])
+def query_dataset_images(dataset_name):
+    """Find images by class, box count and label state, paginated like the images endpoint.
+
+    Query parameters, on top of the images endpoint's: class (class id or
+    name; repeat or comma-separate for several), match (any/all),
+    min_class_boxes (boxes of each matched class), min_boxes and max_boxes
+    (total boxes in the image).
+    Example: ?split=train&class=3&min_class_boxes=20 or ?labeled=false
+    """
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    try:
+        filters = _query_filters(dataset)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return _image_page_response(dataset_name, filters)
+
+@app.route('/api/datasets/<dataset_name>/stats', methods=['GET'])
+def get_dataset_stats(dataset_name):
+    """Label statistics: class counts, boxes per image and box size/aspect distributions.
+
+    Query parameter: split (default: all splits, plus dataset-wide totals).
+    """
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+
+    split = request.args.get('split') or None
+    if split and split not in dataset['splits']:
+        return jsonify({"success": False, "error": f"Unknown split: {split}"}), 400
+
+    try:
+        stats = dataset_stats.dataset_stats(dataset, [split] if split else None)
+        return jsonify({"success": True, "dataset": dataset_name, **stats})
+    except Exception as e:
+        print(f"Error computing stats for {dataset_name}: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/datasets/<dataset_name>/validate', methods=['POST'])
+def start_dataset_validation(dataset_name):
+    """Start checking every label file of a dataset in the background"""
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    job = validation_jobs.start(dataset)
+    return jsonify({"success": True, **{k: v for k, v in job.items() if k != 'report'}}), 202
+
+@app.route('/api/datasets/<dataset_name>/validate', methods=['GET'])
+def get_dataset_validation(dataset_name):
+    """Status of the latest validation, with its report once it's done"""
+    job = validation_jobs.get(dataset_name)
+    if not job:
+        return jsonify({"success": False, "error": "No validation has been run for this dataset"}), 404
+    return jsonify({"success": True, **job})
+
+def _audit_split(dataset):
+    """Split named by the request, or the only split of the dataset"""
+    split = request.args.get('split') or (request.get_json(silent=True) or {}).get('split')
+    if not split and len(dataset['splits']) == 1:
+        split = next(iter(dataset['splits']))
+    return split if split in dataset['splits'] else None
+
+@app.route('/api/datasets/<dataset_name>/audit', methods=['POST'])
+def start_dataset_audit(dataset_name):
+    """Start comparing the YOLO model's predictions with a split's labels in the background"""
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    split = _audit_split(dataset)
+    if not split:
+        return jsonify({"success": False, "error": f"Choose a split: {', '.join(dataset['splits'])}"}), 400
+    success, error_message = load_yolo_model()
+    if not success:
+        return jsonify({"success": False, "error": error_message or "Failed to load YOLO model."}), 503
+
+    failed = compact_journal(dataset_name)  # audit the label files as edited
+    if failed:
+        return failed
+    images, cursor = [], None
+    while True:
+        page, cursor = dataset_catalog.page_images(dataset_name, after=cursor, limit=1000, split=split)
+        images.extend(page)
+        if not cursor:
+            break
+
+    def read_labels(image_row):
+        if not image_row['label_path']:
+            return []
+        image_width, image_height = image_display_size(image_row)
+        return parse_yolo_label(image_row['label_path'], image_width, image_height, dataset['classes'])
+
+    job = audit_jobs.start(dataset_name, split, images, yolo_model, YOLO_MODEL_PATH, read_labels)
+    return jsonify({"success": True, **{k: v for k, v in job.items() if k != 'report'}}), 202
+
+@app.route('/api/datasets/<dataset_name>/audit', methods=['GET'])
+def get_dataset_audit(dataset_name):
+    """Status of a split's latest audit, with images ranked by disagreement once done (limit: default 100)"""
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    split = _audit_split(dataset)
+    if not split:
+        return jsonify({"success": False, "error": f"Choose a split: {', '.join(dataset['splits'])}"}), 400
+    job = audit_jobs.get(dataset_name, split)
+    if not job:
+        return jsonify({"success": False, "error": "No audit has been run for this split"}), 404
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be an integer"}), 400
+    if job['report']:
+        job = {**job, 'report': {**job['report'], 'images': job['report']['images'][:limit]}}
+    return jsonify({"success": True, **job})
+
+@app.route('/api/datasets/<dataset_name>/duplicates', methods=['GET'])
+def get_dataset_duplicates(dataset_name):
+    """Groups of near-duplicate images by perceptual hash (dHash).
+
+    Query parameters: max_distance (Hamming distance in bits, default 4) and
+    across (true to also match images of other datasets; only groups that
+    contain an image of this dataset are returned).
+    """
+    if not find_dataset(dataset_name):
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    try:
+        max_distance = int(request.args.get('max_distance', 4))
+    except ValueError:
+        return jsonify({"success": False, "error": "max_distance must be an integer"}), 400
+    if not 0 <= max_distance <= MAX_DUPLICATE_DISTANCE:
+        return jsonify({"success": False, "error": f"max_distance must be between 0 and {MAX_DUPLICATE_DISTANCE}"}), 400
+    across = request.args.get('across', 'false').lower() in ('1', 'true', 'yes')
+
+    scope = None if across else [dataset_name]
+    rows, hashes = dataset_catalog.image_hashes(scope)
+    groups = []
+    for group in group_near_duplicates(hashes, max_distance):
+        images = [rows[i] for i in group]
+        if across and not any(image['dataset'] == dataset_name for image in images):
+            continue
+        images.sort(key=lambda image: (image['dataset'], image['split'], image['name']))
+        groups.append({"size": len(images), "images": images})
+    groups.sort(key=lambda group: -group['size'])
+
+    return jsonify({
+        "success": True,
+        "dataset": dataset_name,
+        "max_distance": max_distance,
+        "across": across,
+        "groups": groups,
+        "duplicate_images": sum(group['size'] - 1 for group in groups),
+        # Images still waiting for the background hasher; results are incomplete until this is 0
+        "pending_images": dataset_catalog.count_unhashed_images(scope),
+    })
+
+@app.route('/api/datasets/<dataset_name>/export', methods=['GET'])
+def export_dataset(dataset_name):
+    """Download a dataset as a zip archive, streamed as it is built.
+
+    Query parameters: format (yolo, coco or voc), split (repeat or
+    comma-separate; default all) and images (true to include the images).
+    """
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    fmt = request.args.get('format', 'yolo')
+    splits = [item.strip() for value in request.args.getlist('split') for item in value.split(',') if item.strip()]
+    unknown = [split for split in splits if split not in dataset['splits']]
+    if unknown:
+        return jsonify({"success": False, "error": f"Unknown split: {', '.join(unknown)}"}), 400
+
+    failed = compact_journal(dataset_name)  # include annotations saved moments ago
+    if failed:
+        return failed
+    try:
+        export = DatasetExport(dataset, dataset_catalog, label_cache, fmt, splits or None,
+                               include_images=_bool_arg('images') or False,
+                               executor=analysis_pool.executor, window=2 * analysis_pool.workers)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    filename = secure_filename(f"{dataset_name}_{fmt}.zip") or f"dataset_{fmt}.zip"
+    return app.response_class(export.export_zip(), mimetype='application/zip',
+                              headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/datasets/<dataset_name>/coco', methods=['GET'])
+def export_coco_annotations(dataset_name):
+    """One split's annotations as a COCO JSON file, streamed as it is written.
+
+    Query parameters: split (required if the dataset has several) and gzip
+    (true for a .json.gz download, compressed on the fly).
+    """
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    split = request.args.get('split') or (next(iter(dataset['splits'])) if len(dataset['splits']) == 1 else None)
+    if split not in dataset['splits']:
+        return jsonify({"success": False, "error": f"Choose a split: {', '.join(dataset['splits'])}"}), 400
+    compress = _bool_arg('gzip') or False
+
+    failed = compact_journal(dataset_name)
+    if failed:
+        return failed
+    export = DatasetExport(dataset, dataset_catalog, label_cache, 'coco', [split],
+                           executor=analysis_pool.executor, window=2 * analysis_pool.workers)
+    filename = secure_filename(f"{dataset_name}_{split}.json") + ('.gz' if compress else '')
+    return app.response_class(export.coco_json(split, compress),
+                              mimetype='application/gzip' if compress else 'application/json',
+                              headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def original_image_size(image_row, full_path):
+    """Displayed size of an original image (EXIF orientation applied), or None if it can't be read"""
+    try:
+        if image_row:
+            return image_display_size(image_row)
+        return oriented_size(*probe_image(full_path))
+    except Exception as e:
+        print(f"Error reading size of {full_path}: {e}")
+        return None
+
+def image_variant(image_row, full_path, size, original_size):
+    """Cached variant of a dataset image fitting THUMBNAIL_SIZES[size], or the original if that fits already"""
+    box = THUMBNAIL_SIZES[size]
+    if original_size and original_size[0] <= box[0] and original_size[1] <= box[1]:
+        return full_path
+    st = os.stat(full_path)
+    if image_row and image_row['content_hash'] and image_row['size'] == st.st_size \
+            and image_row['mtime_ns'] == st.st_mtime_ns:
+        key = image_row['content_hash']
+    else:
+        key = fallback_key(full_path)  # not fingerprinted yet (or changed since)
+    return thumbnail_cache.get(full_path, key, size)
 
 @app.route('/api/datasets/<dataset_name>/image/<path:image_path>')
 def get_dataset_image(dataset_name, image_path):
-    """Serve an image from a dataset"""
+    """Serve an image from a dataset.
+
+    Query parameter size (one of THUMBNAIL_SIZES, e.g. display for the
+    canvas) serves a cached JPEG scaled to fit instead of the original.
+    X-Original-Width/X-Original-Height give the original's displayed size,
+    which labels refer to.
+    """
     try:
         # Security check: ensure the path is within our uploads directory
         full_path = os.path.abspath(image_path)
@@ -403,48 +630,209 @@ def get_dataset_image(dataset_name, image_path):
         if not full_path.startswith(uploads_path):
             return jsonify({"error": "Invalid path"}), 403
         
-        if os.path.exists(full_path):
-            return send_file(full_path)
-        else:
+        if not os.path.exists(full_path):
             return jsonify({"error": "Image not found"}), 404
+
+        size = request.args.get('size')
+        if size:
+            size = int(size) if size.isdigit() else size
+            if size not in THUMBNAIL_SIZES:
+                sizes = ', '.join(str(variant) for variant in THUMBNAIL_SIZES)
+                return jsonify({"error": f"Unsupported size: {size} (use one of {sizes})"}), 400
+
+        image_row = dataset_catalog.find_image_by_path(dataset_name, image_path)
+        original_size = original_image_size(image_row, full_path)
+        response = None
+        if size:
+            try:
+                response = send_file(image_variant(image_row, full_path, size, original_size))
+            except Exception as e:
+                print(f"Error making thumbnail of {full_path}, sending the original: {e}")
+        if response is None:
+            response = send_file(full_path)
+        if original_size:
+            response.headers['X-Original-Width'] = str(original_size[0])
+            response.headers['X-Original-Height'] = str(original_size[1])
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/datasets/<dataset_name>/labels', methods=['GET'])
+def get_dataset_labels(dataset_name):
+    """Labels of many images in one streamed response.
+
+    Accepts the query endpoint's filters, sort/order and after. With limit,
+    one page is returned (same pages as the images/query endpoints, with
+    next_cursor); without it, every matching image, e.g. a whole split.
+    format: json (default) or binary; see label_bulk for both layouts.
+    Boxes are normalized x_center, y_center, width, height; width/height are
+    the displayed image size (null if unknown).
+    """
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    fmt = request.args.get('format', 'json')
+    if fmt not in ('json', 'binary'):
+        return jsonify({"success": False, "error": f"Unknown format: {fmt}"}), 400
+
+    after = request.args.get('after') or None
+    sort = request.args.get('sort', 'name')
+    descending = request.args.get('order', 'asc').lower() == 'desc'
+    try:
+        filters = _query_filters(dataset)
+        limit = _int_arg('limit')
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_IMAGE_PAGE_SIZE)
+
+        def fetch_page(cursor, page_size):
+            return dataset_catalog.page_images(
+                dataset_name, after=cursor, limit=page_size, sort=sort, descending=descending, **filters)
+
+        def split_labels(split):
+            return label_cache.split_labels(dataset_name, split, dataset['splits'][split]['labels_dir'])
+
+        stream = LabelStream(fetch_page, after=after, limit=limit, split_labels=split_labels,
+                             journal=annotation_journals.get(dataset_name))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    header = {"dataset": dataset_name, "classes": dataset['classes']}
+    if not after:
+        header["total"] = dataset_catalog.count_images(dataset_name, **filters)
+    if fmt == 'binary':
+        return app.response_class(encode_binary(stream, header), mimetype='application/octet-stream')
+    return app.response_class(encode_json(stream, header), mimetype='application/json')
+
+def image_display_size(image_row):
+    """Size of a catalog image as displayed, i.e. with EXIF orientation applied (what labels refer to)"""
+    width, height, orientation = image_row['width'], image_row['height'], image_row['orientation']
+    if width is None or height is None:
+        # Header couldn't be probed at index time: try once more and remember it
+        width, height, orientation = probe_image(image_row['image_path'])
+        dataset_catalog.set_image_size(image_row['id'], width, height, orientation)
+    return oriented_size(width, height, orientation)
+
+def journal_pixel_boxes(dataset, image_row, rows):
+    """Box dicts in pixels for [class_id, x_center, y_center, width, height] rows of the annotation journal"""
+    image_width, image_height = image_display_size(image_row)
+    return yolo_to_pixel_boxes([row[0] for row in rows], [row[1:] for row in rows],
+                               image_width, image_height, dataset['classes'])
+
+def image_pixel_boxes(dataset, image_row):
+    """(version, boxes in pixels) of a catalog image"""
+    # Edits not compacted into the label file yet come from the journal
+    version, journal_boxes = annotation_journals.get(dataset['name']).boxes(image_row['split'], image_row['name'])
+    if journal_boxes is not None:
+        return version, journal_pixel_boxes(dataset, image_row, journal_boxes)
+    label_path = image_row['label_path']
+    if not label_path:
+        return version, []
+    pending = label_writer.pending(label_path)
+    image_width, image_height = image_display_size(image_row)
+    return version, parse_yolo_label(label_path, image_width, image_height, dataset['classes'],
+                                     data=pending.encode() if pending is not None else None)
+
 @app.route('/api/datasets/<dataset_name>/labels/<path:image_name>')
 def get_image_labels(dataset_name, image_name):
     """Get YOLO labels for a specific image"""
     try:
-        datasets = scan_datasets()
-        dataset = next((d for d in datasets if d['name'] == dataset_name), None)
+        dataset = find_dataset(dataset_name)
         
         if not dataset:
             return jsonify({"error": "Dataset not found"}), 404
         
-        # Find the image in the dataset
-        for split_name, split_info in dataset['splits'].items():
-            if image_name in split_info['images']:
-                if split_info['labels_dir']:
-                    label_name = os.path.splitext(image_name)[0] + '.txt'
-                    label_path = os.path.join(split_info['labels_dir'], label_name)
-                    
-                    # Load image to get dimensions
-                    image_path = os.path.join(split_info['images_dir'], image_name)
-                    if os.path.exists(image_path):
-                        with Image.open(image_path) as img:
-                            image_width, image_height = img.size
-                        
-                        boxes = parse_yolo_label(label_path, image_width, image_height, dataset['classes'])
-                        return jsonify({
-                            "success": True,
-                            "boxes": boxes,
-                            "classes": dataset['classes']
-                        })
-        
-        return jsonify({"success": True, "boxes": [], "classes": dataset['classes']})
+        # Indexed lookup of the image in the catalog
+        image_row = dataset_catalog.find_image(dataset_name, image_name)
+        if not image_row:
+            return jsonify({"success": True, "boxes": [], "classes": dataset['classes'], "version": 0})
+
+        version, boxes = image_pixel_boxes(dataset, image_row)
+        return jsonify({
+            "success": True,
+            "boxes": boxes,
+            "classes": dataset['classes'],
+            "version": version
+        })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/datasets/<dataset_name>/labels/<path:image_name>', methods=['PATCH'])
+def patch_image_labels(dataset_name, image_name):
+    """Apply a delta to an image's boxes.
+
+    JSON body: split (optional), version (the version the client's boxes are
+    based on), width and height (image size the boxes refer to), added
+    ([{x, y, width, height, label}] in pixels), changed ([{index, x, y, width,
+    height, label}]) and removed ([index]). Indices refer to the boxes of
+    that version. Responds with the new version, or with 409 and the current
+    version and boxes if another client changed the image in the meantime.
+    """
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    data = request.get_json(silent=True) or {}
+    image_row = dataset_catalog.find_image(dataset_name, image_name, data.get('split') or None)
+    if not image_row:
+        return jsonify({"success": False, "error": "Image not found"}), 404
+
+    try:
+        version = int(data['version'])
+        width, height = float(data['width']), float(data['height'])
+        if width <= 0 or height <= 0:
+            raise ValueError("width and height must be positive")
+        added = pixel_to_yolo_boxes(data.get('added') or [], width, height, dataset['classes'])
+        changed_boxes = data.get('changed') or []
+        changed = dict(zip([int(box['index']) for box in changed_boxes],
+                           pixel_to_yolo_boxes(changed_boxes, width, height, dataset['classes'])))
+        removed = [int(index) for index in data.get('removed') or []]
+        journal = annotation_journals.get(dataset_name)
+        new_version, boxes = journal.patch(image_row['split'], image_row['name'], version, added, changed, removed)
+    except VersionConflict as e:
+        current_version, rows = journal.boxes(image_row['split'], image_row['name'])
+        if rows is None:
+            rows = read_label_boxes(journal_label_path(dataset_name, image_row['split'], image_row['name']))
+        return jsonify({"success": False, "error": str(e), "conflict": True, "version": current_version,
+                        "boxes": journal_pixel_boxes(dataset, image_row, rows)}), 409
+    except (KeyError, TypeError) as e:
+        return jsonify({"success": False, "error": f"Invalid annotation data: {e}"}), 400
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except OSError as e:
+        return jsonify({"success": False, "error": f"Could not record the annotation: {e}"}), 500
+    return jsonify({"success": True, "version": new_version, "boxes": len(boxes)})
+
+@app.route('/api/datasets/<dataset_name>/history/<path:image_name>')
+def get_image_history(dataset_name, image_name):
+    """Edit history of one image from the annotation journal, newest first.
+
+    Query parameters: split, limit (default 200) and at (a journal sequence
+    number: also return the image's boxes right after that edit).
+    """
+    dataset = find_dataset(dataset_name)
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    image_row = dataset_catalog.find_image(dataset_name, image_name, request.args.get('split') or None)
+    if not image_row:
+        return jsonify({"success": False, "error": "Image not found"}), 404
+    try:
+        limit = min(int(request.args.get('limit', 200)), 10000)
+        at = int(request.args['at']) if request.args.get('at') else None
+    except ValueError:
+        return jsonify({"success": False, "error": "limit and at must be integers"}), 400
+
+    journal = annotation_journals.get(dataset_name)
+    split, name = image_row['split'], image_row['name']
+    result = {"success": True, "split": split, "image": name, "version": journal.version(split, name),
+              "history": journal.history(split, name, limit)}
+    if at is not None:
+        boxes = journal.boxes_at(split, name, at)
+        if boxes is None:
+            return jsonify({"success": False, "error": f"Edit {at} is older than the kept history"}), 404
+        result["at"] = at
+        result["boxes"] = journal_pixel_boxes(dataset, image_row, boxes)
+    return jsonify(result)
+
 @app.route('/upload_dataset', methods=['POST'])
 def upload_dataset():
     """Handle dataset upload (ZIP files)"""
@@ -470,6 +858,9 @@ def upload_dataset():
         
         print(f"Uploading dataset: {filename} to {dataset_path}")
         
+        # Edits journaled for a previous upload of this name don't apply to the new one
+        annotation_journals.drop(dataset_name)
+
         # Remove existing dataset if it exists
         if os.path.exists(dataset_path):
             print(f"Removing existing dataset at {dataset_path}")
@@ -487,22 +878,32 @@ def upload_dataset():
             print(f"Error extracting ZIP: {e}")
             return jsonify({"error": f"Failed to extract ZIP file: {str(e)}"}), 400
         
+        # COCO uploads are converted to YOLO labels in place (streamed, so large files are fine)
+        try:
+            if convert_coco_dataset(dataset_path):
+                print("Converted COCO annotations to YOLO format")
+        except Exception as e:
+            print(f"Error converting COCO annotations: {e}")
+            shutil.rmtree(dataset_path)
+            return jsonify({"error": f"Failed to convert COCO annotations: {str(e)}"}), 400
+
         # Analyze the uploaded dataset
         print("Analyzing uploaded dataset...")
-        dataset_info = analyze_dataset(dataset_path)
+        dataset_info = dataset_index.add(dataset_path)
         
         if dataset_info:
-            print(f"Dataset upload successful: {dataset_info}")
+            print(f"Dataset upload successful: {dataset_name} with {dataset_info['total_images']} images")
             return jsonify({
                 "success": True,
                 "message": f"Dataset '{dataset_name}' uploaded successfully",
-                "dataset": dataset_info
+                "dataset": dataset_index.summary(dataset_name)
             })
         else:
             print("Dataset analysis failed - removing uploaded files")
             shutil.rmtree(dataset_path)  # Clean up invalid dataset
+            dataset_index.remove(dataset_name)
             return jsonify({
-                "error": "Invalid dataset structure. Please ensure it follows YOLO format with proper directory structure and image files."
+                "error": "Invalid dataset structure. Please ensure it follows YOLO (or COCO) format with proper directory structure and image files."
             }), 400
     
     except Exception as e:
@@ -560,9 +961,81 @@ def trigger_load_yolo_model():
 
 @app.route('/save_annotation', methods=['POST'])
 def save_annotation():
-    data = request.json
-    print("Received data for saving (placeholder):", data)
-    return jsonify({"success": True, "message": "Annotation save endpoint reached (placeholder)"})
+    """Save the boxes of one dataset image to its YOLO label file.
+
+    JSON body: dataset, image (file name), split (optional), width and height
+    (image size the boxes refer to) and boxes ([{x, y, width, height, label}]
+    in pixels). The changes are appended to the dataset's annotation journal
+    and compacted into the label file later; the labels endpoint returns the
+    new boxes right away. Responds with the image's new version (journal
+    sequence number). The UI sends deltas to PATCH
+    /api/datasets/<name>/labels/<image> instead of whole box lists.
+    """
+    data = request.get_json(silent=True) or {}
+    dataset = find_dataset(data.get('dataset', ''))
+    if not dataset:
+        return jsonify({"success": False, "error": "Dataset not found"}), 404
+    image_row = dataset_catalog.find_image(dataset['name'], data.get('image', ''), data.get('split') or None)
+    if not image_row:
+        return jsonify({"success": False, "error": "Image not found"}), 404
+
+    try:
+        width, height = float(data['width']), float(data['height'])
+        if width <= 0 or height <= 0:
+            raise ValueError("width and height must be positive")
+        boxes = [{'x': float(box['x']), 'y': float(box['y']), 'width': float(box['width']),
+                  'height': float(box['height']), 'label': str(box['label'])} for box in data['boxes']]
+        rows = pixel_to_yolo_boxes(boxes, width, height, dataset['classes'])
+    except (KeyError, TypeError) as e:
+        return jsonify({"success": False, "error": f"Invalid annotation data: {e}"}), 400
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    try:
+        version, boxes = annotation_journals.get(dataset['name']).replace(image_row['split'], image_row['name'], rows)
+    except (OSError, ValueError) as e:
+        return jsonify({"success": False, "error": f"Could not record the annotation: {e}"}), 500
+    return jsonify({"success": True, "boxes": len(boxes), "version": version})
+
+def merge_assist_boxes(data, image_size, detected_boxes):
+    """Merge assist predictions into the image's existing boxes, when the request says which they are.
+
+    The request lists them in `existing` ([{x, y, width, height, label}] in
+    pixels of the sent image) or names a dataset image (`dataset`, `image`,
+    optional `split`), whose current boxes are used. Optional: match_iou and
+    assignment ('greedy' or 'hungarian'). Returns the response fields: only
+    the predictions that are new boxes, plus corrections suggested for
+    existing boxes (by index) that a prediction matches loosely or with
+    another label. Without existing boxes, all predictions are returned.
+    """
+    existing = data.get('existing')
+    if existing is None and data.get('dataset') and data.get('image'):
+        dataset = find_dataset(data['dataset'])
+        image_row = dataset_catalog.find_image(data['dataset'], data['image'], data.get('split') or None) if dataset else None
+        if not image_row:
+            raise ValueError("Dataset image not found")
+        _, existing = image_pixel_boxes(dataset, image_row)
+        # Stored boxes refer to the image as displayed; the sent image may be scaled
+        display_width, display_height = image_display_size(image_row)
+        if display_width and display_height:
+            scale_x, scale_y = image_size[0] / display_width, image_size[1] / display_height
+            existing = [{'x': box['x'] * scale_x, 'y': box['y'] * scale_y, 'width': box['width'] * scale_x,
+                         'height': box['height'] * scale_y, 'label': box['label']} for box in existing]
+    if not existing:
+        return {"boxes": detected_boxes, "corrections": [], "matched": 0}
+
+    existing_xyxy = [[float(box['x']), float(box['y']), float(box['x']) + float(box['width']),
+                      float(box['y']) + float(box['height'])] for box in existing]
+    predicted_xyxy = [[box['x_min'], box['y_min'], box['x_max'], box['y_max']] for box in detected_boxes]
+    new, corrections = merge_predictions(
+        predicted_xyxy, [box['label'] for box in detected_boxes], existing_xyxy, [str(box['label']) for box in existing],
+        match_iou=float(data.get('match_iou', MATCH_IOU)), assignment=data.get('assignment', 'greedy'))
+    return {
+        "boxes": [detected_boxes[i] for i in new],
+        "corrections": [{"index": index, **detected_boxes[prediction], "iou": round(iou, 3),
+                         "current_label": existing[index]['label']} for index, prediction, iou in corrections],
+        "matched": len(detected_boxes) - len(new),
+    }
 
 @app.route('/ai_assist', methods=['POST'])
 def ai_assist():
@@ -588,7 +1061,8 @@ def ai_assist():
 
         print(f"Performing YOLO AI inference on image of size {image.size}...")
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        results = yolo_model.predict(image, conf=0.25, verbose=False, device=device)
+        with model_lock:
+            results = yolo_model.predict(image, conf=0.25, verbose=False, device=device)
 
         detected_boxes = []
         if results and len(results) > 0:
@@ -618,7 +1092,11 @@ def ai_assist():
              print("YOLO Inference returned no results or unexpected format.")
 
         print(f"YOLO AI Assist finished. Found {len(detected_boxes)} boxes above threshold.")
-        return jsonify({"success": True, "boxes": detected_boxes})
+        try:
+            merged = merge_assist_boxes(data, image.size, detected_boxes)
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"success": False, "error": f"Invalid existing boxes: {e}"}), 400
+        return jsonify({"success": True, **merged})
 
     except Exception as e:
         print(f"Error during YOLO AI Assist processing: {e}")
@@ -659,7 +1137,8 @@ def yoloe_assist():
 
         print(f"Performing YOLOE inference on image of size {image.size}...")
 
-        predictions = predict_yoloe(image)
+        with model_lock:
+            predictions = predict_yoloe(image)
 
         detected_boxes = []
         if predictions:
@@ -691,7 +1170,11 @@ def yoloe_assist():
             print("YOLOE Inference returned no valid predictions.")
 
         print(f"YOLOE Assist finished. Found {len(detected_boxes)} boxes.")
-        return jsonify({"success": True, "boxes": detected_boxes})
+        try:
+            merged = merge_assist_boxes(data, image.size, detected_boxes)
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"success": False, "error": f"Invalid existing boxes: {e}"}), 400
+        return jsonify({"success": True, **merged})
 
     except RuntimeError as e:
          print(f"RuntimeError during YOLOE Assist: {e}")
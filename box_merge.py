@@ -0,0 +1,115 @@
+"""
+Merging model predictions into an image's existing boxes.
+
+The assist endpoints used to return every predicted box, so running a model
+on an image that already has labels duplicated them. merge_predictions()
+matches predictions to existing boxes on an IoU matrix computed for all
+pairs at once with NumPy, then assigns pairs greedily (highest IoU first) or
+optimally (Hungarian algorithm, when SciPy is available). Unmatched
+predictions are returned as new boxes; matched pairs that overlap only
+loosely, or disagree on the label, become suggested corrections of the
+existing box.
+
+Boxes are [x_min, y_min, x_max, y_max] in pixels.
+"""
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # installed with ultralytics; greedy matching works without it
+    linear_sum_assignment = None
+
+MATCH_IOU = 0.5  # a prediction overlapping an existing box this much is the same object
+ALIGNED_IOU = 0.85  # matched boxes overlapping less are suggested for correction
+ASSIGNMENTS = ('greedy', 'hungarian')
+
+
+def iou_matrix(a, b):
+    """IoU of every box in a (N, 4) with every box in b (M, 4), as an (N, M) array"""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    width = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    height = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    area_a = (a[:, 2] - a[:, 0]).clip(0) * (a[:, 3] - a[:, 1]).clip(0)
+    area_b = (b[:, 2] - b[:, 0]).clip(0) * (b[:, 3] - b[:, 1]).clip(0)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def match_greedy(iou, threshold):
+    """(rows, cols) of pairs taken in descending IoU order, each row and column at most once"""
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind='stable')
+    used_rows, used_cols = set(), set()
+    matched_rows, matched_cols = [], []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matched_rows.append(row)
+        matched_cols.append(col)
+    return np.array(matched_rows, dtype=np.int64), np.array(matched_cols, dtype=np.int64)
+
+
+def match_hungarian(iou, threshold):
+    """(rows, cols) of the assignment maximizing total IoU, keeping pairs above threshold"""
+    if linear_sum_assignment is None:
+        return match_greedy(iou, threshold)
+    rows, cols = linear_sum_assignment(-iou)
+    keep = iou[rows, cols] >= threshold
+    return rows[keep], cols[keep]
+
+
+def match_boxes(iou, threshold=MATCH_IOU, assignment='greedy'):
+    if not iou.size:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if assignment == 'hungarian':
+        return match_hungarian(iou, threshold)
+    return match_greedy(iou, threshold)
+
+
+def match_labeled_boxes(predicted, predicted_labels, existing, existing_labels,
+                        match_iou=MATCH_IOU, assignment='greedy'):
+    """Match predictions to existing boxes, same label first, then regardless of label.
+
+    Returns (iou, same, other): the (predictions, existing) IoU matrix and the
+    (rows, cols) index arrays of the same-label pairs and of the pairs matched
+    across labels among the boxes left over.
+    """
+    predicted_labels = np.asarray(predicted_labels, dtype=object)
+    existing_labels = np.asarray(existing_labels, dtype=object)
+    iou = iou_matrix(predicted, existing)
+
+    same_label = predicted_labels[:, None] == existing_labels[None, :] if iou.size else np.zeros_like(iou, dtype=bool)
+    rows, cols = match_boxes(np.where(same_label, iou, 0.0), match_iou, assignment)
+
+    free_rows = np.setdiff1d(np.arange(iou.shape[0]), rows)
+    free_cols = np.setdiff1d(np.arange(iou.shape[1]), cols)
+    other_rows, other_cols = match_boxes(iou[np.ix_(free_rows, free_cols)], match_iou, assignment)
+    return iou, (rows, cols), (free_rows[other_rows], free_cols[other_cols])
+
+
+def merge_predictions(predicted, predicted_labels, existing, existing_labels,
+                      match_iou=MATCH_IOU, aligned_iou=ALIGNED_IOU, assignment='greedy'):
+    """Split predictions into new boxes and corrections of existing ones.
+
+    Boxes of the same label are matched first; predictions left over are
+    then matched to left-over existing boxes regardless of label (a likely
+    wrong label). Returns (new, corrections): indices of unmatched
+    predictions, and (existing index, prediction index, iou) for matched
+    pairs that are loosely aligned or labeled differently.
+    """
+    if assignment not in ASSIGNMENTS:
+        raise ValueError(f"Unknown assignment: {assignment} (use one of {', '.join(ASSIGNMENTS)})")
+    iou, (rows, cols), (other_rows, other_cols) = match_labeled_boxes(
+        predicted, predicted_labels, existing, existing_labels, match_iou, assignment)
+
+    corrections = [(int(col), int(row), float(iou[row, col]))
+                   for row, col in zip(rows, cols) if iou[row, col] < aligned_iou]
+    corrections += [(int(col), int(row), float(iou[row, col])) for row, col in zip(other_rows, other_cols)]
+    corrections.sort()
+    new = np.setdiff1d(np.arange(iou.shape[0]), np.concatenate([rows, other_rows])).tolist()
+    return new, corrections
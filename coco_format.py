@@ -0,0 +1,313 @@
+"""
+Streaming COCO reading and writing.
+
+CocoWriter writes an annotations file section by section (categories,
+images, then annotations) as chunks of items arrive, optionally gzipped on
+the fly, so a file with millions of annotations is never built as one dict.
+Annotation ids come from a counter that hands out whole ranges, so chunks
+can be serialized independently (e.g. on a process pool) and still get
+consecutive ids. Image ids are the caller's (the export uses catalog ids).
+
+iter_coco() reads a COCO file the other way round: it yields the items of
+the images, categories and annotations arrays one at a time from a buffered
+reader. convert_coco_dataset() uses it to turn an uploaded COCO dataset into
+the YOLO layout analyze_dataset() expects (data.yaml plus one label file per
+image).
+"""
+
+import gzip
+import json
+import os
+from pathlib import Path
+
+import yaml
+
+from dataset_scan import labels_dir_for
+
+COCO_SECTIONS = ('categories', 'images', 'annotations')
+READ_CHUNK = 1024 * 1024  # characters read from the file at a time
+FLUSH_LINES = 100000  # YOLO lines buffered before they are appended to label files
+DETECT_BYTES = 64 * 1024
+
+
+class CocoWriter:
+    """Incremental writer of one COCO annotations file.
+
+    Call write_images() for every chunk of images, then write_annotations()
+    for the annotations, then close(). Items are dicts or already serialized
+    text (comma-separated JSON objects).
+    """
+
+    def __init__(self, fileobj, categories, info=None, compress=False):
+        self._gzip = gzip.GzipFile(fileobj=fileobj, mode='wb', mtime=0) if compress else None
+        self._out = self._gzip or fileobj
+        self.next_annotation_id = 1
+        self._section = None
+        self._separator = b''
+        self._out.write(('{"info": %s, "licenses": [], "categories": %s'
+                         % (json.dumps(info or {}), json.dumps(categories))).encode())
+
+    def reserve_annotation_ids(self, count):
+        """First id of a range of `count` annotation ids"""
+        first = self.next_annotation_id
+        self.next_annotation_id += count
+        return first
+
+    def _begin(self, section):
+        if section == self._section:
+            return
+        # Images always precede annotations, so readers know image sizes before the boxes
+        if self._section == 'annotations':
+            raise ValueError('COCO images must be written before annotations')
+        if self._section is None and section == 'annotations':
+            self._begin('images')
+        if self._section is not None:
+            self._out.write(b']')
+        self._out.write(b', "%s": [' % section.encode())
+        self._section = section
+        self._separator = b''
+
+    def _write(self, section, items):
+        self._begin(section)
+        text = items if isinstance(items, str) else ', '.join(json.dumps(item) for item in items)
+        if text:
+            self._out.write(self._separator + text.encode())
+            self._separator = b', '
+
+    def write_images(self, images):
+        self._write('images', images)
+
+    def write_annotations(self, annotations):
+        self._write('annotations', annotations)
+
+    def close(self):
+        """Finish the JSON document (and the gzip stream); the file object stays open"""
+        self._begin('annotations')
+        self._out.write(b']}')
+        if self._gzip:
+            self._gzip.close()
+
+
+# --- Reading ---
+class _JsonReader:
+    """Buffered reader decoding one JSON value at a time with json.JSONDecoder.raw_decode"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(READ_CHUNK)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character ('' at the end of the file)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"Invalid COCO JSON: expected one of {chars!r}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def _open_text(path):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_coco(path, sections=COCO_SECTIONS):
+    """Yield (section, item) for the items of the given top-level arrays of a COCO file.
+
+    Other top-level values are decoded and dropped. Items are yielded in file
+    order; ('<section>', None) marks the end of each listed array.
+    """
+    with _open_text(path) as f:
+        reader = _JsonReader(f)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key in sections and reader.peek() == '[':
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.expect(']')
+                else:
+                    while True:
+                        yield key, reader.value()
+                        if reader.expect(',]') == ']':
+                            break
+                yield key, None
+            else:
+                reader.value()
+            if reader.expect(',}') == '}':
+                return
+
+
+def is_coco_file(path):
+    """Cheap check whether a .json/.json.gz file looks like COCO annotations"""
+    try:
+        with _open_text(path) as f:
+            head = f.read(DETECT_BYTES)
+    except (OSError, UnicodeDecodeError, EOFError):
+        return False
+    return head.lstrip().startswith('{') and any(f'"{section}"' in head for section in COCO_SECTIONS)
+
+
+def find_coco_files(dataset_path):
+    """COCO annotation files in a dataset directory or one level below it"""
+    dataset_path = Path(dataset_path)
+    candidates = []
+    for directory in [dataset_path] + sorted(p for p in dataset_path.iterdir() if p.is_dir()):
+        for path in sorted(directory.iterdir()):
+            if path.is_file() and path.name.lower().endswith(('.json', '.json.gz')) and is_coco_file(path):
+                candidates.append(path)
+    return candidates
+
+
+def coco_split_name(path):
+    """YOLO split for a COCO file: instances_val2017.json -> val, train/_annotations.coco.json -> train"""
+    stem = path.name.lower().split('.')[0]
+    for name in (stem.replace('instances_', ''), path.parent.name.lower(), stem):
+        for split in ('train', 'valid', 'val', 'test'):
+            if name.startswith(split):
+                return split
+    return 'train'
+
+
+# --- COCO to YOLO conversion ---
+def _locate_images(dataset_path, coco_path, split, file_name):
+    """Directory an image's file_name is relative to"""
+    for root in (coco_path.parent, dataset_path / split, dataset_path / 'images' / split,
+                 dataset_path / 'images', dataset_path):
+        if (root / file_name).is_file():
+            return root
+    return None
+
+
+def convert_coco_file(dataset_path, coco_path, split, category_index):
+    """Write YOLO label files for one COCO file; returns (images_dir, labels_dir, images, boxes) or None.
+
+    Images are read in a first pass (id -> file name and size); annotations
+    are streamed in a second pass and appended to the label files in
+    batches, so annotation memory stays bounded whatever order the file has.
+    """
+    dataset_path = Path(dataset_path)
+    images = {}
+    for section, item in iter_coco(coco_path, ('images',)):
+        if item is not None:
+            images[item['id']] = (item['file_name'], item.get('width'), item.get('height'))
+    if not images:
+        return None
+
+    first_name = next(iter(images.values()))[0]
+    root = _locate_images(dataset_path, coco_path, split, first_name)
+    if root is None:
+        print(f"Images of {coco_path} not found (looked for {first_name})")
+        return None
+    images_dir = (root / first_name).parent
+    labels_dir = labels_dir_for(images_dir)
+    labels_dir.mkdir(parents=True, exist_ok=True)
+
+    pending, pending_lines, written, boxes = {}, 0, set(), 0
+
+    def flush():
+        for image_id, lines in pending.items():
+            stem = os.path.splitext(os.path.basename(images[image_id][0]))[0]
+            with open(labels_dir / f'{stem}.txt', 'a' if image_id in written else 'w') as f:
+                f.write(''.join(lines))
+            written.add(image_id)
+        pending.clear()
+
+    for section, ann in iter_coco(coco_path, ('annotations',)):
+        if ann is None or ann.get('iscrowd') or ann.get('image_id') not in images:
+            continue
+        class_id = category_index.get(ann.get('category_id'))
+        _, width, height = images[ann['image_id']]
+        x, y, w, h = (ann.get('bbox') or [0, 0, 0, 0])[:4]
+        if class_id is None or not width or not height or w <= 0 or h <= 0:
+            continue
+        values = [min(max(v, 0.0), 1.0) for v in ((x + w / 2) / width, (y + h / 2) / height, w / width, h / height)]
+        pending.setdefault(ann['image_id'], []).append(f"{class_id} " + " ".join(f"{v:.6f}" for v in values) + "\n")
+        pending_lines += 1
+        boxes += 1
+        if pending_lines >= FLUSH_LINES:
+            flush()
+            pending_lines = 0
+    flush()
+    return images_dir, labels_dir, len(images), boxes
+
+
+def convert_coco_dataset(dataset_path):
+    """Convert an extracted COCO dataset to YOLO labels plus data.yaml; returns True if converted.
+
+    Does nothing when the dataset already has a YAML file or no COCO
+    annotation file is found.
+    """
+    dataset_path = Path(dataset_path)
+    if any(p.suffix.lower() in ('.yaml', '.yml') for p in dataset_path.iterdir() if p.is_file()):
+        return False
+    coco_files = find_coco_files(dataset_path)
+    if not coco_files:
+        return False
+
+    # Categories of all files, mapped to YOLO class indices in category id order
+    categories = {}
+    for path in coco_files:
+        for _, item in iter_coco(path, ('categories',)):
+            if item is not None:
+                categories.setdefault(item['id'], item['name'])
+    category_ids = sorted(categories)
+    category_index = {category_id: i for i, category_id in enumerate(category_ids)}
+
+    data_yaml = {'path': '.', 'nc': len(category_ids), 'names': [categories[i] for i in category_ids]}
+    for path in coco_files:
+        split = coco_split_name(path)
+        if split in data_yaml:
+            print(f"Skipping {path}: split {split} already converted")
+            continue
+        print(f"Converting COCO annotations {path} ({split})")
+        result = convert_coco_file(dataset_path, path, split, category_index)
+        if result is None:
+            continue
+        images_dir, labels_dir, image_count, box_count = result
+        data_yaml[split] = os.path.relpath(images_dir, dataset_path)
+        print(f"Converted {box_count} boxes of {image_count} images to YOLO labels in {labels_dir}")
+
+    if not any(split in data_yaml for split in ('train', 'val', 'valid', 'test')):
+        return False
+    with open(dataset_path / 'data.yaml', 'w') as f:
+        yaml.safe_dump(data_yaml, f, sort_keys=False, allow_unicode=True)
+    return True
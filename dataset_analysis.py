@@ -0,0 +1,443 @@
+"""
+Dataset analysis for Laibel.
+
+analyze_dataset() decides whether a directory is a valid YOLO dataset and
+describes its splits. The work is split into small steps so that many
+datasets can be analyzed at once by AnalysisPool: every split directory is
+listed by its own task and class inference reads label files in chunks, with
+the results merged back per dataset as they arrive.
+
+Class inference parses the first column of many label files at once with
+NumPy. Large datasets are first inferred from a sample of their label files
+(class_inference == 'sampled'); refine_classes() computes the exact answer,
+which DatasetIndex does in the background.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from dataset_scan import list_split_files, find_yaml_files, labels_dir_for
+from name_list import ImageNameList
+
+SPLIT_NAMES = ['train', 'val', 'test', 'valid']
+CLASS_INFERENCE_CHUNK = 2000  # label files per class inference task
+CLASS_SAMPLE_SIZE = 5000  # label files read for a quick answer before the exact background pass
+CLASS_READ_BYTES = 4 * 1024 * 1024  # label data parsed per NumPy pass
+MAX_CLASS_DIGITS = 9  # longer class ids are parsed in Python
+MAX_CLASS_ID = 100000  # larger ids are treated as corrupt lines
+WHITESPACE = np.array([ord(c) for c in ' \t\r\n\v\f'], dtype=np.uint8)
+
+
+# --- Analysis steps ---
+def plan_dataset(dataset_path):
+    """Parse the dataset YAML and work out which directories to list.
+
+    Returns (dataset_info, yaml_candidates, fallback_candidates); candidates
+    are (split, images_dir, labels_dir) tuples. The fallback candidates are
+    the conventional train/val/test/valid directories, used when the YAML is
+    missing or yields no images.
+    """
+    dataset_path = Path(dataset_path)
+    dataset_name = dataset_path.name
+
+    print(f"\nAnalyzing dataset: {dataset_name}")
+    print(f"Dataset path: {dataset_path}")
+
+    # Look for data.yaml or similar configuration file
+    yaml_files = [Path(p) for p in find_yaml_files(dataset_path)]
+
+    dataset_info = {
+        'name': dataset_name,
+        'path': str(dataset_path),
+        'yaml_file': None,
+        'classes': [],
+        'splits': {},
+        'total_images': 0,
+        'total_labels': 0,
+        'valid': False
+    }
+    yaml_candidates = []
+
+    # Parse YAML file if exists
+    if yaml_files:
+        yaml_file = yaml_files[0]  # Use the first YAML file found
+        dataset_info['yaml_file'] = str(yaml_file)
+        print(f"Found YAML file: {yaml_file}")
+
+        try:
+            with open(yaml_file, 'r') as f:
+                yaml_data = yaml.safe_load(f)
+
+            print(f"YAML contents: {yaml_data}")
+
+            # Extract classes
+            if 'names' in yaml_data:
+                if isinstance(yaml_data['names'], dict):
+                    dataset_info['classes'] = list(yaml_data['names'].values())
+                elif isinstance(yaml_data['names'], list):
+                    dataset_info['classes'] = yaml_data['names']
+                print(f"Classes from YAML: {dataset_info['classes']}")
+
+            # Extract split information
+            for split in SPLIT_NAMES:
+                if split in yaml_data:
+                    split_path = yaml_data[split]
+                    if isinstance(split_path, str):
+                        # Relative paths are relative to the dataset directory
+                        split_dir = Path(split_path) if os.path.isabs(split_path) else dataset_path / split_path
+                        if split_dir.name == 'images':
+                            # Path points to images directory
+                            images_dir = split_dir
+                        else:
+                            # Path points to split directory, look for an images subdir
+                            images_dir = split_dir / 'images' if (split_dir / 'images').exists() else split_dir
+                        labels_dir = labels_dir_for(images_dir)
+
+                        print(f"Split '{split}' - Images dir: {images_dir}, Labels dir: {labels_dir}")
+
+                        if images_dir and images_dir.exists():
+                            if labels_dir is not None and not labels_dir.exists():
+                                labels_dir = None
+                            yaml_candidates.append((split, str(images_dir), str(labels_dir) if labels_dir else None))
+
+        except Exception as e:
+            print(f"Error parsing YAML file {yaml_file}: {e}")
+
+    # Look for common YOLO directory structures
+    fallback_candidates = []
+    for subdir in SPLIT_NAMES:
+        subdir_path = dataset_path / subdir
+        if subdir_path.exists() and subdir_path.is_dir():
+            # Check for images subdirectory, otherwise use the split directory itself
+            images_dir = subdir_path / 'images' if (subdir_path / 'images').exists() else subdir_path
+            labels_dir = labels_dir_for(images_dir)
+            labels_dir = labels_dir if labels_dir.exists() else None
+            fallback_candidates.append((subdir, str(images_dir), str(labels_dir) if labels_dir else None))
+
+    return dataset_info, yaml_candidates, fallback_candidates
+
+
+def list_split(images_dir, labels_dir):
+    """Image and label file names of one split directory (one listing per directory)"""
+    files = list_split_files(images_dir, labels_dir, stat=False)
+    return list(files.images), list(files.labels)
+
+
+def build_splits(dataset_info, candidates, listings):
+    """Fill dataset_info['splits'] from listed candidates.
+
+    `listings` maps (images_dir, labels_dir) -> (images, labels). Returns
+    {split: label file names} for class inference.
+    """
+    label_files = {}
+    for split, images_dir, labels_dir in candidates:
+        images, labels = listings[(images_dir, labels_dir)]
+        print(f"Found {len(images)} images and {len(labels)} labels in {split}")
+
+        if images:  # Only add if we found images
+            dataset_info['splits'][split] = {
+                'images_dir': images_dir,
+                'labels_dir': labels_dir,
+                'image_count': len(images),
+                'label_count': len(labels),
+                'images': ImageNameList(images)
+            }
+            dataset_info['total_images'] += len(images)
+            dataset_info['total_labels'] += len(labels)
+            label_files[split] = labels
+    dataset_info['valid'] = dataset_info['total_images'] > 0
+    return label_files
+
+
+def needs_class_inference(dataset_info):
+    return bool(dataset_info['splits']) and not dataset_info['classes']
+
+
+# --- Class inference ---
+def parse_class_column(data):
+    """Class ids from the first column of newline-terminated YOLO label lines.
+
+    Matches the line-by-line parser: the first whitespace-separated token must
+    consist of digits only, otherwise the line is skipped.
+    """
+    width = MAX_CLASS_DIGITS + 1
+    buf = np.frombuffer(data + b'\n' * width, dtype=np.uint8)
+    newlines = np.flatnonzero(buf[:len(data)] == ord('\n'))
+    if len(newlines) == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], newlines[:-1] + 1))
+
+    window = buf[starts[:, None] + np.arange(width)]
+    digits = (window >= ord('0')) & (window <= ord('9'))
+    # Length of the leading digit run (rows that are all digits are too long to parse here)
+    digit_count = np.where(digits.all(axis=1), 0, np.argmin(digits, axis=1))
+    terminator = window[np.arange(len(starts)), digit_count]
+    valid = (digit_count > 0) & np.isin(terminator, WHITESPACE)
+
+    powers = digit_count[:, None] - 1 - np.arange(width)
+    place = np.where(powers >= 0, 10 ** np.clip(powers, 0, None), 0)
+    values = ((window.astype(np.int64) - ord('0')) * place).sum(axis=1)
+    ids = values[valid]
+
+    # Indented lines and very long ids are rare; parse those the slow way
+    slow = np.flatnonzero(np.isin(window[:, 0], WHITESPACE[:2]) | (digits.all(axis=1)))
+    if len(slow):
+        extra = []
+        for start in starts[slow]:
+            parts = data[start:data.index(b'\n', start)].split()
+            if parts and parts[0].isdigit():
+                extra.append(int(parts[0]))
+        ids = np.concatenate((ids, np.array(extra, dtype=np.int64)))
+    return ids
+
+
+def add_counts(a, b):
+    """Sum two class histograms of possibly different lengths"""
+    if len(a) < len(b):
+        a, b = b, a
+    a = a.copy()
+    a[:len(b)] += b
+    return a
+
+
+def count_class_ids(labels_dir, label_names, read_bytes=CLASS_READ_BYTES):
+    """Histogram of class ids (index = class id) over a batch of label files.
+
+    Files are concatenated into large buffers and parsed with one NumPy pass
+    per buffer instead of line by line.
+    """
+    counts = np.zeros(0, dtype=np.int64)
+    buffer, size = [], 0
+    for label_name in label_names:
+        label_file = os.path.join(labels_dir, label_name)
+        try:
+            with open(label_file, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            print(f"Error reading label file {label_file}: {e}")
+            continue
+        buffer.append(data)
+        buffer.append(b'\n')
+        size += len(data) + 1
+        if size >= read_bytes:
+            counts = add_counts(counts, _histogram(b''.join(buffer), labels_dir))
+            buffer, size = [], 0
+    if buffer:
+        counts = add_counts(counts, _histogram(b''.join(buffer), labels_dir))
+    return counts
+
+
+def _histogram(data, labels_dir):
+    ids = parse_class_column(data)
+    too_large = ids > MAX_CLASS_ID
+    if too_large.any():
+        print(f"Ignoring {int(too_large.sum())} label lines with class ids above {MAX_CLASS_ID} in {labels_dir}")
+        ids = ids[~too_large]
+    return np.bincount(ids)
+
+
+def sample_names(names, size):
+    """Evenly spaced subset of a sorted name list"""
+    if len(names) <= size:
+        return names
+    step = len(names) / size
+    return [names[int(i * step)] for i in range(size)]
+
+
+def class_inference_tasks(dataset_info, label_files, sample_size=CLASS_SAMPLE_SIZE,
+                          chunk_size=CLASS_INFERENCE_CHUNK):
+    """(labels_dir, label_names) chunks to infer classes from, and whether they're a sample.
+
+    With sample_size set, datasets with more label files than that are
+    sampled evenly across their splits.
+    """
+    total = sum(len(label_files.get(split, [])) for split, split_info in dataset_info['splits'].items()
+                if split_info['labels_dir'])
+    sampled = sample_size is not None and total > sample_size
+    tasks = []
+    for split, split_info in dataset_info['splits'].items():
+        labels_dir = split_info['labels_dir']
+        names = label_files.get(split, [])
+        if not labels_dir:
+            continue
+        if sampled:
+            names = sample_names(names, max(1, sample_size * len(names) // total))
+        for start in range(0, len(names), chunk_size):
+            tasks.append((labels_dir, names[start:start + chunk_size]))
+    return tasks, sampled
+
+
+def apply_class_counts(dataset_info, class_counts, sampled=False):
+    """Set inferred classes (class_0..class_N for the highest id seen) and their box counts"""
+    class_counts = np.asarray(class_counts, dtype=np.int64)
+    if not class_counts.any():
+        return
+    max_class = int(np.flatnonzero(class_counts)[-1])
+    dataset_info['classes'] = [f'class_{i}' for i in range(max_class + 1)]
+    dataset_info['class_counts'] = class_counts[:max_class + 1].tolist()
+    dataset_info['class_inference'] = 'sampled' if sampled else 'exact'
+    print(f"Inferred classes{' (from a sample)' if sampled else ''}: {dataset_info['classes']}")
+
+
+def refine_classes(dataset_info):
+    """Exact class inference over every label file; returns the fields to update"""
+    counts = np.zeros(0, dtype=np.int64)
+    for split_info in dataset_info['splits'].values():
+        labels_dir = split_info['labels_dir']
+        if labels_dir:
+            label_names = list_split_files(None, labels_dir, stat=False).labels
+            counts = add_counts(counts, count_class_ids(labels_dir, label_names))
+    refined = {'class_inference': 'exact'}
+    apply_class_counts(refined, counts)
+    return refined
+
+
+def finish_dataset(dataset_info, class_counts=None, sampled=False):
+    """Apply inferred classes and return dataset_info, or None if the dataset isn't valid"""
+    if class_counts is not None:
+        apply_class_counts(dataset_info, class_counts, sampled)
+
+    print(f"Dataset analysis complete. Valid: {dataset_info['valid']}, Total images: {dataset_info['total_images']}")
+    return dataset_info if dataset_info['valid'] else None
+
+
+def analyze_dataset(dataset_path):
+    """Analyze a directory to determine if it's a valid YOLO dataset"""
+    dataset_info, yaml_candidates, fallback_candidates = plan_dataset(dataset_path)
+
+    listings = {}
+    for _, images_dir, labels_dir in yaml_candidates:
+        listings[(images_dir, labels_dir)] = list_split(images_dir, labels_dir)
+    label_files = build_splits(dataset_info, yaml_candidates, listings)
+
+    # If no YAML or YAML didn't work, try to infer structure
+    if not dataset_info['valid']:
+        print("No valid YAML found, trying to infer dataset structure...")
+        for _, images_dir, labels_dir in fallback_candidates:
+            if (images_dir, labels_dir) not in listings:
+                listings[(images_dir, labels_dir)] = list_split(images_dir, labels_dir)
+        label_files = build_splits(dataset_info, fallback_candidates, listings)
+
+        # Try to infer classes from label files
+        if needs_class_inference(dataset_info):
+            print("Inferring classes from label files...")
+            tasks, sampled = class_inference_tasks(dataset_info, label_files)
+            class_counts = np.zeros(0, dtype=np.int64)
+            for labels_dir, names in tasks:
+                class_counts = add_counts(class_counts, count_class_ids(labels_dir, names))
+            return finish_dataset(dataset_info, class_counts, sampled)
+
+    return finish_dataset(dataset_info)
+
+
+# --- Parallel analysis ---
+class AnalysisPool:
+    """Worker pool that analyzes many datasets concurrently.
+
+    Uses worker processes forked up front (before the app starts its own
+    threads); on platforms without fork it falls back to threads, which still
+    overlap the directory listings.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        if 'fork' in multiprocessing.get_all_start_methods():
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+            # Fork every worker now, while the process is still single-threaded
+            self.executor.submit(os.getpid).result()
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def analyze(self, dataset_paths, on_result, on_progress=None):
+        """Analyze datasets in parallel, calling on_result(path, dataset_info) as each one completes.
+
+        Every split directory is listed by its own task; datasets needing class
+        inference then get one task per chunk of label files. on_progress is
+        called with (tasks_done, tasks_total) after each task.
+        """
+        submit = self.executor.submit
+        states = {}
+        futures = {}
+        progress = {'done': 0, 'total': 0}
+
+        def add_task(future, path, kind, key):
+            futures[future] = (path, kind, key)
+            states[path]['pending'] += 1
+            progress['total'] += 1
+
+        def start_listing(path, candidates):
+            state = states[path]
+            for _, images_dir, labels_dir in candidates:
+                key = (images_dir, labels_dir)
+                if key not in state['listings'] and key not in state['requested']:
+                    state['requested'].add(key)
+                    add_task(submit(list_split, images_dir, labels_dir), path, 'list', key)
+
+        def advance(path):
+            """Move a dataset to its next phase once all of its tasks have finished"""
+            state = states[path]
+            info = state['info']
+            if state['phase'] == 'yaml':
+                state['label_files'] = build_splits(info, state['yaml'], state['listings'])
+                if info['valid']:
+                    return complete(path)
+                state['phase'] = 'fallback'
+                start_listing(path, state['fallback'])
+                if state['pending']:
+                    return
+            if state['phase'] == 'fallback':
+                state['label_files'] = build_splits(info, state['fallback'], state['listings'])
+                state['phase'] = 'classes'
+                if needs_class_inference(info):
+                    tasks, state['sampled'] = class_inference_tasks(info, state['label_files'])
+                    state['class_counts'] = np.zeros(0, dtype=np.int64)
+                    for labels_dir, names in tasks:
+                        add_task(submit(count_class_ids, labels_dir, names), path, 'classes', None)
+                    if state['pending']:
+                        return
+            complete(path)
+
+        def complete(path):
+            state = states.pop(path)
+            on_result(path, finish_dataset(state['info'], state['class_counts'], state['sampled']))
+
+        for path in dataset_paths:
+            info, yaml_candidates, fallback_candidates = plan_dataset(path)
+            states[path] = {
+                'info': info, 'yaml': yaml_candidates, 'fallback': fallback_candidates,
+                'phase': 'yaml', 'listings': {}, 'requested': set(), 'label_files': {},
+                'class_counts': None, 'sampled': False, 'pending': 0,
+            }
+            start_listing(path, yaml_candidates)
+            if not states[path]['pending']:
+                advance(path)
+
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path, kind, key = futures.pop(future)
+                state = states[path]
+                state['pending'] -= 1
+                progress['done'] += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error analyzing {path}: {e}")
+                    result = ([], []) if kind == 'list' else np.zeros(0, dtype=np.int64)
+                if kind == 'list':
+                    state['listings'][key] = result
+                else:
+                    state['class_counts'] = add_counts(state['class_counts'], result)
+                if on_progress:
+                    on_progress(progress['done'], progress['total'])
+                if state['pending'] == 0:
+                    advance(path)
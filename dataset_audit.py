@@ -0,0 +1,307 @@
+"""
+Dataset audit: model predictions against the labels.
+
+Runs the YOLO model over every image of a split and compares its
+predictions with the image's labels to find likely labeling errors:
+
+  missed       a confident prediction no label matches (an object nobody boxed)
+  wrong_class  a prediction matching a label of another class
+  sloppy       a prediction matching a label of its class, but loosely
+  unconfirmed  a label no prediction matches (a false box, or a hard example)
+
+Predictions and labels are matched the way the assist endpoints merge
+predictions (box_merge.match_labeled_boxes): same class first, then
+regardless of class. Each image gets a disagreement score from its issues,
+and the report ranks the images by it. Images the model fails on are listed
+in the report's errors and audited again next time.
+
+Results are cached per image under the model file's hash, the label file's
+mtime and the image file's size and mtime, so re-running after a few edits
+only runs the model on the images whose labels or pixels changed (or that
+are new).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from box_merge import ALIGNED_IOU, match_labeled_boxes
+
+AUDIT_VERSION = 1  # bump when scoring changes, to invalidate cached results
+AUDIT_CONF = 0.25  # predictions below this confidence are ignored
+MISSED_CONF = 0.5  # unmatched predictions need this confidence to count as missed objects
+AUDIT_BATCH = 16  # images per model call
+SAVE_EVERY = 20  # batches between cache saves, so an interrupted audit keeps its progress
+MAX_ISSUES = 50  # issues listed per image
+
+# Issue type -> weight in the disagreement score (missed and wrong_class are
+# also scaled by the prediction's confidence, sloppy by 1 - IoU)
+ISSUE_WEIGHTS = {'missed': 1.0, 'wrong_class': 1.0, 'sloppy': 1.0, 'unconfirmed': 0.5}
+
+_file_hashes = {}  # (path, size, mtime) -> hex digest
+
+
+def file_hash(path):
+    """Content hash of a (model) file, remembered while its size and mtime stay the same"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _file_hashes:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        _file_hashes[key] = h.hexdigest()
+    return _file_hashes[key]
+
+
+def _label_mtime(label_path):
+    try:
+        return os.stat(label_path).st_mtime_ns if label_path else None
+    except OSError:
+        return None
+
+
+def _image_stat(image_path):
+    try:
+        st = os.stat(image_path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _rounded(box):
+    return [round(float(v), 1) for v in box]
+
+
+def compare_image(predicted, predicted_labels, confidences, labels, label_names):
+    """Issues and disagreement score of one image.
+
+    predicted and labels are [x_min, y_min, x_max, y_max] arrays in pixels of
+    the same image; predicted_labels and label_names their class names.
+    """
+    predicted = np.asarray(predicted, dtype=np.float64).reshape(-1, 4)
+    labels = np.asarray(labels, dtype=np.float64).reshape(-1, 4)
+    predicted_labels = np.asarray(predicted_labels, dtype=object)
+    label_names = np.asarray(label_names, dtype=object)
+    confidences = np.asarray(confidences, dtype=np.float64)
+    iou, (rows, cols), (other_rows, other_cols) = match_labeled_boxes(predicted, predicted_labels,
+                                                                      labels, label_names)
+
+    issues = []
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        if iou[row, col] < ALIGNED_IOU:
+            issues.append({'type': 'sloppy', 'label_index': col, 'label': label_names[col],
+                           'iou': round(float(iou[row, col]), 3), 'box': _rounded(labels[col]),
+                           'predicted_box': _rounded(predicted[row]), 'confidence': round(float(confidences[row]), 3),
+                           'weight': ISSUE_WEIGHTS['sloppy'] * (1 - float(iou[row, col]))})
+    for row, col in zip(other_rows.tolist(), other_cols.tolist()):
+        issues.append({'type': 'wrong_class', 'label_index': col, 'label': label_names[col],
+                       'predicted': predicted_labels[row], 'iou': round(float(iou[row, col]), 3),
+                       'box': _rounded(labels[col]), 'confidence': round(float(confidences[row]), 3),
+                       'weight': ISSUE_WEIGHTS['wrong_class'] * float(confidences[row])})
+    matched_rows = np.concatenate([rows, other_rows])
+    for row in np.setdiff1d(np.arange(len(predicted)), matched_rows).tolist():
+        if confidences[row] >= MISSED_CONF:
+            issues.append({'type': 'missed', 'predicted': predicted_labels[row], 'box': _rounded(predicted[row]),
+                           'confidence': round(float(confidences[row]), 3),
+                           'weight': ISSUE_WEIGHTS['missed'] * float(confidences[row])})
+    for col in np.setdiff1d(np.arange(len(labels)), np.concatenate([cols, other_cols])).tolist():
+        issues.append({'type': 'unconfirmed', 'label_index': col, 'label': label_names[col],
+                       'box': _rounded(labels[col]), 'weight': ISSUE_WEIGHTS['unconfirmed']})
+
+    issues.sort(key=lambda issue: -issue['weight'])
+    counts = dict.fromkeys(ISSUE_WEIGHTS, 0)
+    for issue in issues:
+        counts[issue['type']] += 1
+        issue['weight'] = round(issue['weight'], 3)
+    return {'score': round(sum(issue['weight'] for issue in issues), 3), 'counts': counts,
+            'labels': len(labels), 'predictions': len(predicted), 'issues': issues[:MAX_ISSUES]}
+
+
+def predict_batch(model, image_paths):
+    """(boxes, class names, confidences) per image from an ultralytics model"""
+    outputs = []
+    for result in model.predict(image_paths, conf=AUDIT_CONF, verbose=False):
+        boxes = getattr(result, 'boxes', None)
+        names = getattr(result, 'names', {})
+        if boxes is None or not len(boxes):
+            outputs.append((np.zeros((0, 4)), [], np.zeros(0)))
+            continue
+        class_ids = boxes.cls.cpu().numpy().astype(int).tolist()
+        outputs.append((boxes.xyxy.cpu().numpy(), [names.get(i, f'class_{i}') for i in class_ids],
+                        boxes.conf.cpu().numpy()))
+    return outputs
+
+
+def predict_images(model, image_paths):
+    """predict_batch(), retrying image by image if the batch fails.
+
+    One unreadable image makes the model call fail for its whole batch; the
+    retry gives every other image its predictions. Images that still fail
+    get the exception in place of their output.
+    """
+    try:
+        return predict_batch(model, image_paths)
+    except Exception as e:
+        print(f"Audit batch failed ({e}), predicting its {len(image_paths)} images one by one")
+    outputs = []
+    for image_path in image_paths:
+        try:
+            outputs.extend(predict_batch(model, [image_path]))
+        except Exception as e:
+            outputs.append(e)
+    return outputs
+
+
+class AuditJobs:
+    """Runs audits in the background; keeps per-image results on disk per dataset split"""
+
+    def __init__(self, cache_dir, model_lock=None):
+        self.cache_dir = Path(cache_dir)
+        self.jobs = {}  # (dataset, split) -> job dict
+        self._lock = threading.Lock()
+        # Held around each model call; shared with everything else that runs the model
+        self.model_lock = model_lock or threading.Lock()
+
+    def _cache_file(self, dataset_name, split):
+        return self.cache_dir / dataset_name / f'{split}.json'
+
+    def _load(self, dataset_name, split, key):
+        try:
+            with open(self._cache_file(dataset_name, split), 'r') as f:
+                cache = json.load(f)
+            if cache.get('key') == key:
+                return cache['images']
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def _save(self, dataset_name, split, key, results):
+        cache_file = self._cache_file(dataset_name, split)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump({'key': key, 'images': results}, f)
+        os.replace(tmp_file, cache_file)
+
+    def start(self, dataset_name, split, images, model, model_path, read_labels):
+        """Start auditing a split unless that audit is already running; returns the job.
+
+        images are catalog rows (name, image_path, label_path, ...);
+        read_labels(row) returns the image's labels as box dicts in pixels
+        ({x, y, width, height, label}), as parse_yolo_label does.
+        """
+        with self._lock:
+            job = self.jobs.get((dataset_name, split))
+            if job and job['status'] == 'running':
+                return job
+            job = {'dataset': dataset_name, 'split': split, 'status': 'running', 'started_at': time.time(),
+                   'finished_at': None, 'progress': {'done': 0, 'total': 0}, 'report': None, 'error': None}
+            self.jobs[(dataset_name, split)] = job
+        threading.Thread(target=self._run, args=(job, images, model, model_path, read_labels),
+                         name=f'audit-{dataset_name}-{split}', daemon=True).start()
+        return job
+
+    def _run(self, job, images, model, model_path, read_labels):
+        dataset_name, split = job['dataset'], job['split']
+        try:
+            started = time.time()
+            model_hash = file_hash(model_path)
+            key = f'{AUDIT_VERSION}:{model_hash}:{AUDIT_CONF}:{MISSED_CONF}'
+            cached = self._load(dataset_name, split, key)
+            results, failed, todo = {}, {}, []
+            for row in images:
+                mtime = _label_mtime(row['label_path'])
+                image_stat = _image_stat(row['image_path'])
+                entry = cached.get(row['name'])
+                if entry and entry['label_mtime'] == mtime and entry.get('image_stat') == image_stat:
+                    results[row['name']] = entry
+                else:
+                    todo.append((row, mtime, image_stat))
+            job['progress'] = {'done': 0, 'total': len(todo)}
+
+            for batch_number, start in enumerate(range(0, len(todo), AUDIT_BATCH), 1):
+                batch = todo[start:start + AUDIT_BATCH]
+                # Per batch, so assist requests get the model in between
+                with self.model_lock:
+                    outputs = predict_images(model, [row['image_path'] for row, _, _ in batch])
+                for (row, mtime, image_stat), output in zip(batch, outputs):
+                    if isinstance(output, Exception):
+                        print(f"Error auditing {row['image_path']}: {output}")
+                        failed[row['name']] = str(output)
+                        continue
+                    predicted, predicted_labels, confidences = output
+                    labels = read_labels(row)
+                    label_boxes = [[box['x'], box['y'], box['x'] + box['width'], box['y'] + box['height']]
+                                   for box in labels]
+                    results[row['name']] = {
+                        'label_mtime': mtime,
+                        'image_stat': image_stat,
+                        **compare_image(predicted, predicted_labels, confidences, label_boxes,
+                                        [box['label'] for box in labels]),
+                    }
+                job['progress'] = {'done': min(start + AUDIT_BATCH, len(todo)), 'total': len(todo)}
+                if batch_number % SAVE_EVERY == 0:
+                    self._save(dataset_name, split, key, results)
+            self._save(dataset_name, split, key, results)
+
+            job['report'] = self._report(dataset_name, split, model_path, model_hash, results, failed,
+                                         computed=len(todo) - len(failed), duration=time.time() - started)
+            job['status'] = 'done'
+            print(f"Audited {dataset_name}/{split}: {len(todo) - len(failed)} images run through the model, "
+                  f"{len(results) - len(todo) + len(failed)} from cache, {len(failed)} failed, "
+                  f"in {time.time() - started:.1f}s")
+        except Exception as e:
+            print(f"Error auditing {dataset_name}/{split}: {e}")
+            import traceback
+            traceback.print_exc()
+            job['status'] = 'error'
+            job['error'] = str(e)
+        finally:
+            job['finished_at'] = time.time()
+
+    @staticmethod
+    def _report(dataset_name, split, model_path, model_hash, results, failed, computed, duration):
+        ranked = sorted(({'name': name, 'score': entry['score'], 'counts': entry['counts'],
+                          'labels': entry['labels'], 'predictions': entry['predictions'], 'issues': entry['issues']}
+                         for name, entry in results.items()), key=lambda item: (-item['score'], item['name']))
+        totals = dict.fromkeys(ISSUE_WEIGHTS, 0)
+        for item in ranked:
+            for issue, count in item['counts'].items():
+                totals[issue] += count
+        return {
+            'dataset': dataset_name,
+            'split': split,
+            'model': os.path.basename(model_path),
+            'model_hash': model_hash,
+            'generated_at': time.time(),
+            'duration': round(duration, 3),
+            'summary': {'images': len(ranked), 'computed': computed, 'cached': len(ranked) - computed,
+                        'failed': len(failed),
+                        'images_with_issues': sum(1 for item in ranked if item['score'] > 0), 'issues': totals},
+            'images': ranked,
+            'errors': [{'name': name, 'error': error} for name, error in sorted(failed.items())],
+        }
+
+    def get(self, dataset_name, split):
+        """Current or last audit of a split, falling back to the results cached on disk"""
+        with self._lock:
+            job = self.jobs.get((dataset_name, split))
+        if job:
+            return job
+        try:
+            cache_file = self._cache_file(dataset_name, split)
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+            model_hash = cache['key'].split(':')[1]
+            finished_at = cache_file.stat().st_mtime
+        except (OSError, ValueError, KeyError, IndexError):
+            return None
+        report = self._report(dataset_name, split, '', model_hash, cache['images'], {}, computed=0, duration=0)
+        return {'dataset': dataset_name, 'split': split, 'status': 'done', 'started_at': None,
+                'finished_at': finished_at, 'progress': None, 'report': report, 'error': None}
@@ -0,0 +1,559 @@
+"""
+SQLite catalog of datasets, splits, images and per-image label summaries.
+
+The catalog is filled by the scanner: every time the dataset index analyzes a
+dataset or applies watcher changes, the affected rows are synced here using
+the stat data from dataset_scan. API endpoints then answer listings and
+lookups with indexed queries instead of walking the filesystem.
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from dataset_scan import FileStat, SplitFiles, list_split_files, is_image_file
+from image_probe import probe_image
+from image_hash import image_fingerprint
+from label_arrays import parse_label_data
+
+SCHEMA_VERSION = 5  # 5: label summaries parsed like label_arrays
+
+# Sort keys accepted by page_images(); each is paired with i.id as a tie-breaker
+IMAGE_SORT_COLUMNS = {
+    'name': 'i.name',
+    'split': "s.name || '/' || i.name",
+    'mtime': 'i.mtime_ns',
+    'boxes': 'COALESCE(l.box_count, 0)',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    yaml_file TEXT,
+    classes TEXT NOT NULL,
+    total_images INTEGER NOT NULL DEFAULT 0,
+    total_labels INTEGER NOT NULL DEFAULT 0,
+    signature TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS splits (
+    id INTEGER PRIMARY KEY,
+    dataset_id INTEGER NOT NULL REFERENCES datasets(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    images_dir TEXT NOT NULL,
+    labels_dir TEXT,
+    image_count INTEGER NOT NULL DEFAULT 0,
+    label_count INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (dataset_id, name)
+);
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    split_id INTEGER NOT NULL REFERENCES splits(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    width INTEGER,
+    height INTEGER,
+    orientation INTEGER,
+    content_hash TEXT,
+    dhash INTEGER,
+    UNIQUE (split_id, name)
+);
+CREATE INDEX IF NOT EXISTS images_by_name ON images (name);
+CREATE INDEX IF NOT EXISTS images_missing_metadata ON images (id) WHERE content_hash IS NULL;
+CREATE TABLE IF NOT EXISTS labels (
+    image_id INTEGER PRIMARY KEY REFERENCES images(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    box_count INTEGER NOT NULL DEFAULT 0,
+    class_ids TEXT NOT NULL DEFAULT ''
+);
+-- Inverted index: which images contain a class, and how many boxes of it
+CREATE TABLE IF NOT EXISTS image_classes (
+    image_id INTEGER NOT NULL REFERENCES labels(image_id) ON DELETE CASCADE,
+    class_id INTEGER NOT NULL,
+    box_count INTEGER NOT NULL,
+    PRIMARY KEY (image_id, class_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS image_classes_by_class ON image_classes (class_id, box_count, image_id);
+"""
+
+
+def summarize_label_file(label_path):
+    """Box count and {class id: box count} of a YOLO label file.
+
+    Parsed with label_arrays.parse_label_data, so the catalog counts the same
+    boxes as the label listing and the stats.
+    """
+    try:
+        with open(label_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        print(f"Error reading label file {label_path}: {e}")
+        return 0, {}
+    _, class_ids, _ = parse_label_data(data + b'\n')
+    ids, counts = np.unique(class_ids, return_counts=True)
+    return len(class_ids), dict(zip(ids.tolist(), counts.tolist()))
+
+
+class DatasetCatalog:
+    """Thread-safe wrapper around the catalog database"""
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._metadata_event = threading.Event()
+        self._metadata_thread = None
+        self._metadata_executor = None
+
+        conn = self.connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with self._write_lock, conn:
+                for table in ('image_classes', 'labels', 'images', 'splits', 'datasets'):
+                    conn.execute(f'DROP TABLE IF EXISTS {table}')
+                conn.executescript(SCHEMA)
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA foreign_keys = ON')
+            self._local.conn = conn
+        return conn
+
+    # --- Syncing from the scanner ---
+    def sync_index(self, index):
+        """Make the catalog match the dataset index (used at startup)"""
+        entries = index.snapshot_entries()
+        conn = self.connection()
+        rows = {row['name']: row['signature'] for row in conn.execute('SELECT name, signature FROM datasets')}
+        for name in set(rows) - {n for n, e in entries.items() if e['info']}:
+            self.remove_dataset(name)
+        for name, entry in entries.items():
+            if entry['info'] and rows.get(name) != json.dumps(entry['signature'], sort_keys=True):
+                self.sync_dataset(entry['info'], entry['signature'])
+
+    def on_dataset_changed(self, name, dataset_info, signature=None, changes=None):
+        """DatasetIndex listener: keep the catalog in step with the index"""
+        if dataset_info is None:
+            self.remove_dataset(name)
+        elif changes is not None:
+            self.apply_file_changes(dataset_info, signature, changes)
+        else:
+            self.sync_dataset(dataset_info, signature)
+
+    def remove_dataset(self, name):
+        conn = self.connection()
+        with self._write_lock, conn:
+            conn.execute('DELETE FROM datasets WHERE name = ?', (name,))
+
+    def _upsert_dataset(self, conn, dataset_info, signature):
+        conn.execute(
+            """INSERT INTO datasets (name, path, yaml_file, classes, total_images, total_labels, signature, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (name) DO UPDATE SET
+                   path = excluded.path, yaml_file = excluded.yaml_file, classes = excluded.classes,
+                   total_images = excluded.total_images, total_labels = excluded.total_labels,
+                   signature = excluded.signature, updated_at = excluded.updated_at""",
+            (dataset_info['name'], dataset_info['path'], dataset_info['yaml_file'],
+             json.dumps(dataset_info['classes']), dataset_info['total_images'], dataset_info['total_labels'],
+             json.dumps(signature, sort_keys=True) if signature is not None else None, time.time()))
+        return conn.execute('SELECT id FROM datasets WHERE name = ?', (dataset_info['name'],)).fetchone()['id']
+
+    def _upsert_split(self, conn, dataset_id, split_name, split_info):
+        conn.execute(
+            """INSERT INTO splits (dataset_id, name, images_dir, labels_dir, image_count, label_count)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (dataset_id, name) DO UPDATE SET
+                   images_dir = excluded.images_dir, labels_dir = excluded.labels_dir,
+                   image_count = excluded.image_count, label_count = excluded.label_count""",
+            (dataset_id, split_name, split_info['images_dir'], split_info['labels_dir'],
+             split_info['image_count'], split_info['label_count']))
+        return conn.execute('SELECT id FROM splits WHERE dataset_id = ? AND name = ?',
+                            (dataset_id, split_name)).fetchone()['id']
+
+    def sync_dataset(self, dataset_info, signature=None):
+        """Full sync of one dataset: one directory listing per split, rows diffed by (size, mtime)"""
+        start = time.time()
+        conn = self.connection()
+        with self._write_lock, conn:
+            dataset_id = self._upsert_dataset(conn, dataset_info, signature)
+            conn.execute('DELETE FROM splits WHERE dataset_id = ? AND name NOT IN (%s)' %
+                         ','.join('?' * len(dataset_info['splits'])),
+                         (dataset_id, *dataset_info['splits']))
+
+            for split_name, split_info in dataset_info['splits'].items():
+                split_id = self._upsert_split(conn, dataset_id, split_name, split_info)
+                files = list_split_files(split_info['images_dir'], split_info['labels_dir'])
+                self._sync_split_images(conn, split_id, split_info, files)
+
+        print(f"Catalog synced dataset {dataset_info['name']} in {time.time() - start:.2f}s")
+        self._metadata_event.set()
+
+    def _sync_split_images(self, conn, split_id, split_info, files, only=None):
+        """Insert/update/delete image and label rows of a split.
+
+        `only` restricts the sync to a set of image names (watcher updates).
+        """
+        images_dir = split_info['images_dir']
+        labels_dir = split_info['labels_dir']
+
+        if only is None:
+            existing = {row['name']: row for row in conn.execute(
+                'SELECT i.id, i.name, i.size, i.mtime_ns, l.size AS label_size, l.mtime_ns AS label_mtime '
+                'FROM images i LEFT JOIN labels l ON l.image_id = i.id WHERE i.split_id = ?', (split_id,))}
+            names = files.images.keys()
+            stale = [row['id'] for name, row in existing.items() if name not in files.images]
+        else:
+            existing = {}
+            for name in only:
+                row = conn.execute(
+                    'SELECT i.id, i.name, i.size, i.mtime_ns, l.size AS label_size, l.mtime_ns AS label_mtime '
+                    'FROM images i LEFT JOIN labels l ON l.image_id = i.id WHERE i.split_id = ? AND i.name = ?',
+                    (split_id, name)).fetchone()
+                if row:
+                    existing[name] = row
+            names = [name for name in only if name in files.images]
+            stale = [row['id'] for name, row in existing.items() if name not in files.images]
+
+        conn.executemany('DELETE FROM images WHERE id = ?', ((image_id,) for image_id in stale))
+
+        for name in names:
+            image_stat = files.images[name]
+            image_path = os.path.join(images_dir, name)
+            row = existing.get(name)
+            if row is None:
+                # Header size and hashes are filled in by the metadata worker
+                cursor = conn.execute(
+                    'INSERT INTO images (split_id, name, path, size, mtime_ns) VALUES (?, ?, ?, ?, ?)',
+                    (split_id, name, image_path, image_stat.size, image_stat.mtime_ns))
+                image_id = cursor.lastrowid
+            else:
+                image_id = row['id']
+                if (row['size'], row['mtime_ns']) != (image_stat.size, image_stat.mtime_ns):
+                    # Image replaced: the metadata worker probes and hashes it again
+                    conn.execute(
+                        'UPDATE images SET size = ?, mtime_ns = ?, width = NULL, height = NULL, orientation = NULL, '
+                        'content_hash = NULL, dhash = NULL WHERE id = ?',
+                        (image_stat.size, image_stat.mtime_ns, image_id))
+
+            label_name = os.path.splitext(name)[0] + '.txt'
+            label_stat = files.labels.get(label_name) if labels_dir else None
+            if label_stat is None:
+                if row is not None and row['label_size'] is not None:
+                    conn.execute('DELETE FROM labels WHERE image_id = ?', (image_id,))
+                continue
+            if row is not None and (row['label_size'], row['label_mtime']) == (label_stat.size, label_stat.mtime_ns):
+                continue
+            self._upsert_label(conn, image_id, os.path.join(labels_dir, label_name), label_stat)
+
+    def _upsert_label(self, conn, image_id, label_path, label_stat):
+        """Summarize a label file into its labels row and image_classes entries"""
+        box_count, class_counts = summarize_label_file(label_path)
+        conn.execute(
+            """INSERT INTO labels (image_id, path, size, mtime_ns, box_count, class_ids)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (image_id) DO UPDATE SET
+                   path = excluded.path, size = excluded.size, mtime_ns = excluded.mtime_ns,
+                   box_count = excluded.box_count, class_ids = excluded.class_ids""",
+            (image_id, label_path, label_stat.size, label_stat.mtime_ns, box_count,
+             ','.join(str(c) for c in sorted(class_counts))))
+        conn.execute('DELETE FROM image_classes WHERE image_id = ?', (image_id,))
+        conn.executemany('INSERT INTO image_classes (image_id, class_id, box_count) VALUES (?, ?, ?)',
+                         ((image_id, class_id, count) for class_id, count in class_counts.items()))
+
+    def refresh_label(self, dataset_name, image_name, split=None):
+        """Re-read one image's label file right after it was written (e.g. by the save endpoint)"""
+        image = self.find_image(dataset_name, image_name, split)
+        if image is None:
+            return False
+        conn = self.connection()
+        with self._write_lock, conn:
+            row = conn.execute('SELECT s.labels_dir FROM images i JOIN splits s ON s.id = i.split_id '
+                               'WHERE i.id = ?', (image['id'],)).fetchone()
+            if not row['labels_dir']:
+                return False
+            label_path = os.path.join(row['labels_dir'], os.path.splitext(image_name)[0] + '.txt')
+            label_stat = _stat(label_path)
+            if label_stat is None:
+                conn.execute('DELETE FROM labels WHERE image_id = ?', (image['id'],))
+            else:
+                self._upsert_label(conn, image['id'], label_path, label_stat)
+        return True
+
+    def apply_file_changes(self, dataset_info, signature, changes):
+        """Sync only the images touched by watcher events"""
+        conn = self.connection()
+        with self._write_lock, conn:
+            dataset_id = self._upsert_dataset(conn, dataset_info, signature)
+            for split_name, split_changes in changes.items():
+                split_info = dataset_info['splits'].get(split_name)
+                if split_info is None:
+                    continue
+                split_id = self._upsert_split(conn, dataset_id, split_name, split_info)
+
+                touched = set(split_changes.get('images', {}))
+                for label_name in split_changes.get('labels', {}):
+                    touched.update(self._image_names_for_stem(conn, split_id, os.path.splitext(label_name)[0]))
+
+                images, labels = {}, {}
+                for name in touched:
+                    stat = _stat(os.path.join(split_info['images_dir'], name))
+                    if stat is not None and is_image_file(name):
+                        images[name] = stat
+                    if split_info['labels_dir']:
+                        label_name = os.path.splitext(name)[0] + '.txt'
+                        label_stat = _stat(os.path.join(split_info['labels_dir'], label_name))
+                        if label_stat is not None:
+                            labels[label_name] = label_stat
+                files = SplitFiles(images=images, labels=labels)
+                self._sync_split_images(conn, split_id, split_info, files, only=touched)
+        self._metadata_event.set()
+
+    def _image_names_for_stem(self, conn, split_id, stem):
+        # Range scan on the name prefix "<stem>." ('/' sorts right after '.')
+        rows = conn.execute('SELECT name FROM images WHERE split_id = ? AND name >= ? AND name < ?',
+                            (split_id, stem + '.', stem + '/'))
+        return [row['name'] for row in rows if os.path.splitext(row['name'])[0] == stem]
+
+    # --- Background metadata (content hash, perceptual hash) ---
+    def start_metadata_worker(self, executor=None):
+        """Fill in hashes of new images in the background, fanning out to `executor` if given"""
+        self._metadata_executor = executor
+        if self._metadata_thread is None:
+            self._metadata_thread = threading.Thread(target=self._metadata_loop, name='catalog-metadata', daemon=True)
+            self._metadata_thread.start()
+        self._metadata_event.set()
+
+    def _metadata_loop(self):
+        while True:
+            self._metadata_event.wait()
+            self._metadata_event.clear()
+            try:
+                while self.fill_image_metadata(batch_size=256):
+                    pass
+            except Exception as e:
+                print(f"Error filling image metadata: {e}")
+
+    def fill_image_metadata(self, batch_size=256):
+        """Probe and hash a batch of new or changed images (size, content hash and dHash). Returns rows updated."""
+        conn = self.connection()
+        rows = conn.execute('SELECT id, path FROM images WHERE content_hash IS NULL LIMIT ?',
+                            (batch_size,)).fetchall()
+        paths = [row['path'] for row in rows]
+        fingerprints = None
+        if self._metadata_executor is not None:
+            try:
+                fingerprints = list(self._metadata_executor.map(image_metadata, paths, chunksize=16))
+            except RuntimeError:
+                # Pool shut down (interpreter exit or a broken worker): hash in this thread instead
+                self._metadata_executor = None
+        if fingerprints is None:
+            fingerprints = map(image_metadata, paths)
+        # A failed hash is stored as '' so it isn't retried until the file changes
+        updates = [(*fingerprint, row['id']) for row, fingerprint in zip(rows, fingerprints)]
+        if updates:
+            with self._write_lock, conn:
+                conn.executemany('UPDATE images SET content_hash = ?, dhash = ?, width = ?, height = ?, '
+                                 'orientation = ? WHERE id = ?', updates)
+        return len(updates)
+
+    def image_hashes(self, dataset_names=None):
+        """(rows, dhashes) of every perceptually hashed image, optionally limited to some datasets"""
+        query = ('SELECT i.id, i.name, i.path AS image_path, s.name AS split, d.name AS dataset, i.dhash '
+                 'FROM images i JOIN splits s ON s.id = i.split_id JOIN datasets d ON d.id = s.dataset_id '
+                 'WHERE i.dhash IS NOT NULL')
+        params = []
+        if dataset_names:
+            query += ' AND d.name IN (%s)' % ','.join('?' * len(dataset_names))
+            params.extend(dataset_names)
+        rows = [dict(row) for row in self.connection().execute(query, params)]
+        return rows, [row.pop('dhash') for row in rows]
+
+    def count_unhashed_images(self, dataset_names=None):
+        query = ('SELECT COUNT(*) FROM images i JOIN splits s ON s.id = i.split_id '
+                 'JOIN datasets d ON d.id = s.dataset_id WHERE i.content_hash IS NULL')
+        params = []
+        if dataset_names:
+            query += ' AND d.name IN (%s)' % ','.join('?' * len(dataset_names))
+            params.extend(dataset_names)
+        return self.connection().execute(query, params).fetchone()[0]
+
+    # --- Queries ---
+    def list_images(self, dataset_name, split=None):
+        """Images of a dataset (optionally one split) with their label paths"""
+        query = ('SELECT i.name, i.path AS image_path, l.path AS label_path, s.name AS split, d.name AS dataset '
+                 'FROM images i JOIN splits s ON s.id = i.split_id JOIN datasets d ON d.id = s.dataset_id '
+                 'LEFT JOIN labels l ON l.image_id = i.id WHERE d.name = ?')
+        params = [dataset_name]
+        if split:
+            query += ' AND s.name = ?'
+            params.append(split)
+        query += ' ORDER BY s.name, i.name'
+        return [dict(row) for row in self.connection().execute(query, params)]
+
+    def page_images(self, dataset_name, after=None, limit=100, sort='name', descending=False, **filters):
+        """One page of a dataset's images using keyset (cursor) pagination.
+
+        Returns (images, next_cursor); next_cursor is None on the last page.
+        `after` is the cursor returned by the previous call with the same
+        filters; see _image_filters() for the filters.
+        """
+        if sort not in IMAGE_SORT_COLUMNS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        sort_column = IMAGE_SORT_COLUMNS[sort]
+
+        where, params = self._image_filters(dataset_name, **filters)
+        if after:
+            sort_value, image_id = decode_cursor(after)
+            where.append(f"({sort_column}, i.id) {'<' if descending else '>'} (?, ?)")
+            params.extend([sort_value, image_id])
+
+        direction = 'DESC' if descending else 'ASC'
+        query = (f'SELECT i.id, i.name, i.path AS image_path, l.path AS label_path, s.name AS split, '
+                 f'd.name AS dataset, i.width, i.height, i.orientation, '
+                 f'COALESCE(l.box_count, 0) AS box_count, l.class_ids, '
+                 f'{sort_column} AS sort_value '
+                 f'{IMAGE_FROM} WHERE {" AND ".join(where)} '
+                 f'ORDER BY {sort_column} {direction}, i.id {direction} LIMIT ?')
+        rows = self.connection().execute(query, params + [limit + 1]).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['sort_value'], rows[-1]['id'])
+        images = []
+        for row in rows:
+            image = dict(row)
+            del image['sort_value']
+            image['class_ids'] = [int(c) for c in image['class_ids'].split(',') if c] if image['class_ids'] else []
+            images.append(image)
+        return images, next_cursor
+
+    def count_images(self, dataset_name, **filters):
+        where, params = self._image_filters(dataset_name, **filters)
+        query = f'SELECT COUNT(*) {IMAGE_FROM} WHERE {" AND ".join(where)}'
+        return self.connection().execute(query, params).fetchone()[0]
+
+    def _image_filters(self, dataset_name, split=None, labeled=None, prefix=None, classes=None,
+                       match='any', min_boxes=None, max_boxes=None, min_class_boxes=None):
+        """WHERE clauses for image listings.
+
+        classes: class ids the image must contain (any or all of them, per
+        `match`), with at least min_class_boxes boxes of that class.
+        min_boxes/max_boxes bound the image's total box count.
+        """
+        where, params = ['d.name = ?'], [dataset_name]
+        if split:
+            where.append('s.name = ?')
+            params.append(split)
+        if labeled is True:
+            where.append('l.image_id IS NOT NULL')
+        elif labeled is False:
+            where.append('l.image_id IS NULL')
+        if prefix:
+            # Range on the name instead of LIKE so the (split_id, name) index can be used
+            where.append('i.name >= ? AND i.name < ?')
+            params.extend([prefix, prefix + '\U0010ffff'])
+        if classes:
+            if match not in ('any', 'all'):
+                raise ValueError(f"Unknown class match mode: {match}")
+            # Driven by the (class_id, box_count, image_id) index, so rare classes are cheap to find
+            subquery = 'i.id IN (SELECT image_id FROM image_classes WHERE class_id = ? AND box_count >= ?)'
+            clauses = []
+            for class_id in classes:
+                clauses.append(subquery)
+                params.extend([class_id, min_class_boxes or 1])
+            where.append('(' + (' AND ' if match == 'all' else ' OR ').join(clauses) + ')')
+        if min_boxes is not None:
+            where.append('COALESCE(l.box_count, 0) >= ?')
+            params.append(min_boxes)
+        if max_boxes is not None:
+            where.append('COALESCE(l.box_count, 0) <= ?')
+            params.append(max_boxes)
+        return where, params
+
+    def find_image(self, dataset_name, image_name, split=None):
+        """Catalog row for one image (first split that has it unless `split` is given)"""
+        query = ('SELECT i.id, i.name, i.path AS image_path, i.width, i.height, i.orientation, s.name AS split, '
+                 'l.path AS label_path, l.box_count, l.class_ids '
+                 'FROM images i JOIN splits s ON s.id = i.split_id JOIN datasets d ON d.id = s.dataset_id '
+                 'LEFT JOIN labels l ON l.image_id = i.id WHERE i.name = ? AND d.name = ?')
+        params = [image_name, dataset_name]
+        if split:
+            query += ' AND s.name = ?'
+            params.append(split)
+        row = self.connection().execute(query + ' ORDER BY s.name LIMIT 1', params).fetchone()
+        return dict(row) if row else None
+
+    def find_image_by_path(self, dataset_name, image_path):
+        """Catalog row (with file size, mtime and content hash) of the image stored at image_path"""
+        row = self.connection().execute(
+            'SELECT i.id, i.name, i.path AS image_path, i.size, i.mtime_ns, i.width, i.height, i.orientation, '
+            'i.content_hash FROM images i JOIN splits s ON s.id = i.split_id JOIN datasets d ON d.id = s.dataset_id '
+            'WHERE i.name = ? AND i.path = ? AND d.name = ?',
+            (os.path.basename(image_path), image_path, dataset_name)).fetchone()
+        return dict(row) if row else None
+
+    def set_image_size(self, image_id, width, height, orientation=1):
+        conn = self.connection()
+        with self._write_lock, conn:
+            conn.execute('UPDATE images SET width = ?, height = ?, orientation = ? WHERE id = ?',
+                         (width, height, orientation, image_id))
+
+
+IMAGE_FROM = ('FROM images i JOIN splits s ON s.id = i.split_id JOIN datasets d ON d.id = s.dataset_id '
+              'LEFT JOIN labels l ON l.image_id = i.id')
+
+
+def encode_cursor(sort_value, image_id):
+    data = json.dumps([sort_value, image_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(); raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, image_id = json.loads(base64.urlsafe_b64decode(padded))
+        return sort_value, int(image_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return FileStat(st.st_size, st.st_mtime_ns)
+
+
+def image_metadata(image_path):
+    """(content hash, dhash, width, height, orientation) of an image file, for the metadata worker"""
+    return (*image_fingerprint(image_path), *_probe(image_path))
+
+
+def _probe(image_path):
+    """(width, height, orientation) from the image header, or Nones if it can't be read"""
+    try:
+        return probe_image(image_path)
+    except Exception as e:
+        print(f"Error probing image {image_path}: {e}")
+        return None, None, None
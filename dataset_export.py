@@ -0,0 +1,335 @@
+"""
+Streaming dataset export.
+
+export_zip() generates a zip archive of a dataset in YOLO, COCO or Pascal VOC
+format chunk by chunk, for a streamed HTTP response: nothing is written to
+disk, and only a bounded number of image chunks is in memory at a time.
+Boxes are read from the per-split label cache (label_arrays.LabelCache),
+image names and sizes from the catalog, and the conversion of each chunk of
+images runs on a process pool. Images can be included; they are copied into
+the archive from their original locations, uncompressed. COCO files are
+written with coco_format.CocoWriter, also on their own via coco_json().
+
+Layouts:
+  yolo  data.yaml, <split>/images/<image>, <split>/labels/<stem>.txt (label files as they are)
+  coco  annotations/instances_<split>.json, <split>/<image>
+  voc   labels.txt, <split>/Annotations/<stem>.xml, <split>/JPEGImages/<image>,
+        ImageSets/Main/<split>.txt
+"""
+
+import json
+import os
+import time
+import zipfile
+from array import array
+from collections import deque, namedtuple
+from xml.sax.saxutils import escape
+
+import numpy as np
+import yaml
+
+from coco_format import CocoWriter
+from image_probe import probe_image, oriented_size
+
+EXPORT_FORMATS = ('yolo', 'coco', 'voc')
+EXPORT_CHUNK = 1000  # images per catalog page and conversion task
+COPY_BYTES = 1024 * 1024
+
+# One image of a conversion task. width/height: displayed size, None if unknown;
+# class_ids/boxes: YOLO class ids and normalized (x_center, y_center, width, height)
+ExportImage = namedtuple('ExportImage', ['name', 'image_path', 'width', 'height', 'class_ids', 'boxes'])
+
+
+class _StreamBuffer:
+    """Write-only file object for ZipFile; what's written is taken out by the response generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# --- Conversion (runs in worker processes) ---
+def image_size(image):
+    """Displayed size of an ExportImage, probing the file when the catalog doesn't know it"""
+    if image.width and image.height:
+        return image.width, image.height
+    try:
+        width, height, orientation = probe_image(image.image_path)
+        return oriented_size(width, height, orientation)
+    except Exception as e:
+        print(f"Error reading size of {image.image_path}: {e}")
+        return None, None
+
+
+def pixel_boxes(boxes, width, height):
+    """Normalized YOLO boxes to (x_min, y_min, x_max, y_max) pixels, clipped to the image"""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    x_min = np.clip((boxes[:, 0] - boxes[:, 2] / 2) * width, 0, width)
+    y_min = np.clip((boxes[:, 1] - boxes[:, 3] / 2) * height, 0, height)
+    x_max = np.clip((boxes[:, 0] + boxes[:, 2] / 2) * width, 0, width)
+    y_max = np.clip((boxes[:, 1] + boxes[:, 3] / 2) * height, 0, height)
+    return np.column_stack((x_min, y_min, x_max, y_max))
+
+
+def voc_chunk(images, class_names, split):
+    """Pascal VOC XML files for a chunk of images: [(stem, xml bytes)]"""
+    files = []
+    for image in images:
+        width, height = image_size(image)
+        if width is None:
+            continue
+        objects = []
+        for class_id, (x_min, y_min, x_max, y_max) in zip(image.class_ids.tolist(),
+                                                          pixel_boxes(image.boxes, width, height)):
+            objects.append(
+                f"  <object>\n    <name>{escape(class_names[class_id])}</name>\n    <pose>Unspecified</pose>\n"
+                f"    <truncated>0</truncated>\n    <difficult>0</difficult>\n    <bndbox>\n"
+                f"      <xmin>{round(x_min)}</xmin>\n      <ymin>{round(y_min)}</ymin>\n"
+                f"      <xmax>{round(x_max)}</xmax>\n      <ymax>{round(y_max)}</ymax>\n"
+                f"    </bndbox>\n  </object>\n")
+        xml = (f"<annotation>\n  <folder>{escape(split)}</folder>\n  <filename>{escape(image.name)}</filename>\n"
+               f"  <size>\n    <width>{width}</width>\n    <height>{height}</height>\n    <depth>3</depth>\n  </size>\n"
+               f"  <segmented>0</segmented>\n{''.join(objects)}</annotation>\n")
+        files.append((os.path.splitext(image.name)[0], xml.encode('utf-8')))
+    return files
+
+
+def coco_annotations_chunk(images, image_ids, first_annotation_id):
+    """Comma-separated COCO annotation objects for a chunk of images.
+
+    Annotation ids are assigned by the caller (first_annotation_id plus the
+    box's position in the chunk), so chunks can be converted in any order.
+    """
+    parts = []
+    annotation_id = first_annotation_id
+    for image, image_id in zip(images, image_ids):
+        if not len(image.class_ids):
+            continue
+        width, height = image_size(image)
+        if width is None:
+            annotation_id += len(image.class_ids)
+            continue
+        corners = pixel_boxes(image.boxes, width, height)
+        for class_id, (x_min, y_min, x_max, y_max) in zip(image.class_ids.tolist(), corners.tolist()):
+            box_width, box_height = x_max - x_min, y_max - y_min
+            parts.append(json.dumps({
+                'id': annotation_id, 'image_id': image_id, 'category_id': class_id + 1,
+                'bbox': [round(x_min, 2), round(y_min, 2), round(box_width, 2), round(box_height, 2)],
+                'area': round(box_width * box_height, 2), 'iscrowd': 0, 'segmentation': [],
+            }))
+            annotation_id += 1
+    return ', '.join(parts)
+
+
+# --- Archive generation ---
+def _submit_bounded(executor, fn, tasks, window):
+    """Run fn(*args) for every (key, args) task on the executor with at most `window` in flight.
+
+    Yields (key, result) in task order; runs inline without an executor or
+    once the executor has been shut down.
+    """
+    pending = deque()
+    for key, args in tasks:
+        future = None
+        if executor is not None:
+            try:
+                future = executor.submit(fn, *args)
+            except RuntimeError:
+                executor = None
+        pending.append((key, future, args))
+        if len(pending) >= window:
+            yield _result(fn, *pending.popleft())
+    while pending:
+        yield _result(fn, *pending.popleft())
+
+
+def _result(fn, key, future, args):
+    return key, (future.result() if future is not None else fn(*args))
+
+
+class DatasetExport:
+    """One export of a dataset; iterate export_zip() for the archive bytes"""
+
+    def __init__(self, dataset_info, catalog, label_cache, fmt, splits=None, include_images=False,
+                 executor=None, window=4):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        self.dataset = dataset_info
+        self.catalog = catalog
+        self.label_cache = label_cache
+        self.fmt = fmt
+        self.splits = splits or list(dataset_info['splits'])
+        self.include_images = include_images
+        self.executor = executor
+        self.window = window  # conversion tasks in flight (bounds memory)
+        self._labels = {split: self._split_labels(split) for split in self.splits}
+        self.class_names = self._class_names()
+
+    def _split_labels(self, split):
+        labels_dir = self.dataset['splits'][split]['labels_dir']
+        return self.label_cache.split_labels(self.dataset['name'], split, labels_dir)
+
+    def _class_names(self):
+        """data.yaml names, extended with class_<id> for ids used in labels beyond them"""
+        names = list(self.dataset['classes'])
+        max_id = max((int(labels.class_ids.max()) for labels in self._labels.values() if len(labels.class_ids)),
+                     default=-1)
+        return names + [f'class_{i}' for i in range(len(names), max_id + 1)]
+
+    def _pages(self, split):
+        """Catalog rows of a split in name order, a page at a time"""
+        cursor = None
+        while True:
+            rows, cursor = self.catalog.page_images(self.dataset['name'], after=cursor, limit=EXPORT_CHUNK, split=split)
+            if rows:
+                yield rows
+            if not cursor:
+                return
+
+    def _export_images(self, split, rows):
+        labels = self._labels[split]
+        images = []
+        for row in rows:
+            if row['label_path']:
+                class_ids, boxes = labels.file_labels(os.path.basename(row['label_path']))
+            else:
+                class_ids, boxes = labels.class_ids[:0], labels.boxes[:0]
+            width, height = (oriented_size(row['width'], row['height'], row['orientation'])
+                             if row['width'] and row['height'] else (None, None))
+            images.append(ExportImage(row['name'], row['image_path'], width, height, class_ids, boxes))
+        return images
+
+    def export_zip(self):
+        """Generate the zip archive"""
+        out = _StreamBuffer()
+        started = time.time()
+        with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            writer = {'yolo': self._write_yolo, 'coco': self._write_coco, 'voc': self._write_voc}[self.fmt]
+            for _ in writer(zf):
+                data = out.take()
+                if data:
+                    yield data
+        yield out.take()
+        print(f"Exported {self.dataset['name']} as {self.fmt} in {time.time() - started:.1f}s")
+
+    # Each writer yields whenever it has written something, so the archive is
+    # passed on to the response as it grows.
+    def _write_file(self, zf, arcname, path):
+        """Copy a file into the archive in chunks (stored: images are already compressed)"""
+        try:
+            file_stat = os.stat(path)
+            info = zipfile.ZipInfo(arcname, time.localtime(file_stat.st_mtime)[:6])
+            info.file_size = file_stat.st_size
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, zf.open(info, 'w') as dst:
+                for chunk in iter(lambda: src.read(COPY_BYTES), b''):
+                    dst.write(chunk)
+                    yield
+        except OSError as e:
+            print(f"Error exporting {path}: {e}")
+
+    def _write_images(self, zf, prefix, rows):
+        if self.include_images:
+            for row in rows:
+                yield from self._write_file(zf, f"{prefix}/{row['name']}", row['image_path'])
+
+    def _write_yolo(self, zf):
+        for split in self.splits:
+            for rows in self._pages(split):
+                for row in rows:
+                    if row['label_path']:
+                        stem = os.path.splitext(row['name'])[0]
+                        yield from self._write_file(zf, f"{split}/labels/{stem}.txt", row['label_path'])
+                yield from self._write_images(zf, f"{split}/images", rows)
+        data_yaml = {'path': '.', 'nc': len(self.class_names), 'names': self.class_names}
+        data_yaml.update({split: f'{split}/images' for split in self.splits})
+        zf.writestr('data.yaml', yaml.safe_dump(data_yaml, sort_keys=False, allow_unicode=True))
+        yield
+
+    def _write_voc(self, zf):
+        zf.writestr('labels.txt', ''.join(name + '\n' for name in self.class_names))
+        for split in self.splits:
+            stems = []
+            tasks = ((rows, (self._export_images(split, rows), self.class_names, split))
+                     for rows in self._pages(split))
+            for rows, files in _submit_bounded(self.executor, voc_chunk, tasks, self.window):
+                for stem, xml in files:
+                    zf.writestr(f"{split}/Annotations/{stem}.xml", xml)
+                    stems.append(stem)
+                yield
+                yield from self._write_images(zf, f"{split}/JPEGImages", rows)
+            zf.writestr(f"ImageSets/Main/{split}.txt", ''.join(stem + '\n' for stem in stems))
+            yield
+
+    def _coco_categories(self):
+        return [{'id': i + 1, 'name': name, 'supercategory': 'none'} for i, name in enumerate(self.class_names)]
+
+    def _coco_info(self, split):
+        return {'description': f"{self.dataset['name']} {split}"}
+
+    def _write_coco(self, zf):
+        for split in self.splits:
+            info = zipfile.ZipInfo(f'annotations/instances_{split}.json', time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with zf.open(info, 'w', force_zip64=True) as f:
+                writer = CocoWriter(f, self._coco_categories(), self._coco_info(split))
+                yield from self._write_coco_split(writer, split)
+            yield
+            if self.include_images:
+                for rows in self._pages(split):
+                    yield from self._write_images(zf, split, rows)
+
+    def coco_json(self, split, compress=False):
+        """Generate one split's COCO annotations file on its own (gzipped if `compress`)"""
+        out = _StreamBuffer()
+        writer = CocoWriter(out, self._coco_categories(), self._coco_info(split), compress=compress)
+        for _ in self._write_coco_split(writer, split):
+            data = out.take()
+            if data:
+                yield data
+        yield out.take()
+
+    def _write_coco_split(self, writer, split):
+        """Write a split through a CocoWriter, yielding after every chunk"""
+        # COCO image ids are catalog ids; only those are kept for the annotations pass
+        exported_ids = array('q')
+        for rows in self._pages(split):
+            chunk = []
+            for row, image in zip(rows, self._export_images(split, rows)):
+                width, height = image_size(image)
+                exported_ids.append(row['id'])
+                chunk.append({'id': row['id'], 'file_name': image.name, 'width': width, 'height': height})
+            writer.write_images(chunk)
+            yield
+        exported_ids = np.sort(np.frombuffer(exported_ids, dtype=np.int64))
+
+        for text in self._coco_annotations(writer, split, exported_ids):
+            writer.write_annotations(text)
+            yield
+        writer.close()
+
+    def _coco_annotations(self, writer, split, exported_ids):
+        """Annotation text per chunk, converted on the executor with pre-assigned id ranges"""
+        def tasks():
+            for rows in self._pages(split):
+                # Images added since the images pass aren't in the images array: skip them
+                ids = np.array([row['id'] for row in rows], dtype=np.int64)
+                positions = np.minimum(np.searchsorted(exported_ids, ids), max(len(exported_ids) - 1, 0))
+                keep = exported_ids[positions] == ids if len(exported_ids) else np.zeros(len(ids), dtype=bool)
+                images = [image for image, kept in zip(self._export_images(split, rows), keep) if kept]
+                first_id = writer.reserve_annotation_ids(sum(len(image.class_ids) for image in images))
+                yield None, (images, ids[keep].tolist(), first_id)
+
+        for _, text in _submit_bounded(self.executor, coco_annotations_chunk, tasks(), self.window):
+            yield text
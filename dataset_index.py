@@ -0,0 +1,472 @@
+"""
+Persistent dataset index for Laibel.
+
+Keeps the result of analyze_dataset() for every directory in the uploads folder
+and saves it to disk, together with a manifest of the directory/YAML mtimes each
+result depends on. A refresh only re-analyzes datasets whose manifest no longer
+matches, so request handlers can read from the index instead of rescanning.
+Stale datasets are analyzed in parallel when an AnalysisPool is given, and
+each result is published as soon as it arrives. Datasets whose classes were
+inferred from a sample of their labels are refined in a background thread.
+Listeners (the catalog) are called after the index lock is released, so
+lookups never wait for them.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from dataset_scan import find_yaml_files, list_split_files
+from name_list import ImageNameList
+
+INDEX_VERSION = 1
+SPLIT_NAMES = ['train', 'val', 'test', 'valid']
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def signature_paths(dataset_path, dataset_info=None):
+    """Paths whose mtimes decide whether a dataset has to be analyzed again.
+
+    Directory mtimes change whenever an entry is added, removed or renamed, so
+    watching the dataset root, the split directories and the images/labels
+    directories is enough to notice new or deleted files.
+    """
+    dataset_path = Path(dataset_path)
+    paths = {str(dataset_path)}
+
+    for item in ('data.yaml', 'data.yml'):
+        paths.add(str(dataset_path / item))
+    paths.update(find_yaml_files(dataset_path))
+
+    for split in SPLIT_NAMES:
+        split_path = dataset_path / split
+        paths.add(str(split_path))
+        paths.add(str(split_path / 'images'))
+        paths.add(str(split_path / 'labels'))
+
+    if dataset_info:
+        for split_info in dataset_info['splits'].values():
+            images_dir = Path(split_info['images_dir'])
+            paths.add(str(images_dir))
+            paths.add(str(images_dir.parent))
+            paths.add(str(images_dir.parent / 'labels'))
+            paths.add(str(images_dir / 'labels'))
+            if split_info['labels_dir']:
+                paths.add(split_info['labels_dir'])
+
+    return sorted(paths)
+
+
+def compute_signature(dataset_path, dataset_info=None):
+    """Map each signature path to its mtime (None if it doesn't exist)"""
+    return {path: _mtime_ns(path) for path in signature_paths(dataset_path, dataset_info)}
+
+
+def signature_matches(signature):
+    return all(_mtime_ns(path) == mtime for path, mtime in signature.items())
+
+
+def dataset_summary(dataset_info, signature):
+    """Small representation of a dataset for list views (no image names)"""
+    mtimes = [mtime for mtime in signature.values() if mtime is not None]
+    return {
+        'name': dataset_info['name'],
+        'classes': dataset_info['classes'],
+        'total_images': dataset_info['total_images'],
+        'total_labels': dataset_info['total_labels'],
+        'splits': {
+            split: {'image_count': info['image_count'], 'label_count': info['label_count']}
+            for split, info in dataset_info['splits'].items()
+        },
+        'last_modified': max(mtimes) / 1e9 if mtimes else None,
+    }
+
+
+def _json_default(value):
+    if isinstance(value, ImageNameList):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class DatasetIndex:
+    """On-disk index of analyzed datasets, validated against directory mtimes"""
+
+    def __init__(self, uploads_path, index_file, analyze_fn, check_interval=2.0, pool=None, refine_fn=None):
+        # check_interval: seconds between mtime validations on the request path,
+        # or None once a DatasetWatcher keeps the index current
+        self.uploads_path = Path(uploads_path)
+        self.index_file = Path(index_file)
+        self.analyze_fn = analyze_fn
+        self.check_interval = check_interval
+        self.pool = pool  # Optional AnalysisPool used by refresh()
+        # Optional callable(dataset_info) -> fields to update, run in the background
+        # for datasets with class_inference == 'sampled'
+        self.refine_fn = refine_fn
+
+        # name -> {'signature': {...}, 'info': dataset_info or None}
+        self.entries = {}
+        self.generation = 0
+        # Callables (name, dataset_info or None, signature, changes) run after a dataset changes
+        self.listeners = []
+        # Callables (name) run after a dataset is removed from the index
+        self.removal_listeners = []
+        self._notifications = []  # (listeners, args) queued under the lock, delivered by _deliver()
+        self._deliver_lock = threading.Lock()  # keeps deliveries in queue order
+        self._checked_at = None
+        self._summary_cache = None  # (generation, summaries, serialized JSON)
+        self.progress = {'running': False, 'datasets_total': 0, 'datasets_done': 0,
+                         'tasks_total': 0, 'tasks_done': 0, 'pending': []}
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()  # Only one refresh analyzes at a time
+        self._refine_pending = set()
+        self._refine_cond = threading.Condition()
+        self._refine_thread = None
+        self.load()
+        for name, entry in self.entries.items():
+            self._maybe_refine(name, entry['info'])
+
+    # --- Persistence ---
+    def load(self):
+        """Load the saved index, ignoring it if it's missing or stale"""
+        if not self.index_file.exists():
+            return
+        try:
+            with open(self.index_file, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != INDEX_VERSION or data.get('uploads_path') != str(self.uploads_path.resolve()):
+                print(f"Dataset index at {self.index_file} is outdated, ignoring it")
+                return
+            self.entries = data.get('datasets', {})
+            for entry in self.entries.values():
+                for split_info in (entry['info'] or {}).get('splits', {}).values():
+                    split_info['images'] = ImageNameList(split_info['images'])
+            print(f"Loaded dataset index with {len(self.entries)} entries from {self.index_file}")
+        except Exception as e:
+            print(f"Error loading dataset index {self.index_file}: {e}")
+            self.entries = {}
+
+    def save(self):
+        """Write the index atomically (temp file + rename)"""
+        with self._lock:
+            data = {
+                'version': INDEX_VERSION,
+                'uploads_path': str(self.uploads_path.resolve()),
+                'datasets': self.entries,
+            }
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.index_file.with_suffix('.tmp')
+            try:
+                with open(tmp_file, 'w') as f:
+                    json.dump(data, f, default=_json_default)
+                os.replace(tmp_file, self.index_file)
+            except Exception as e:
+                print(f"Error saving dataset index {self.index_file}: {e}")
+
+    # --- Refresh ---
+    def refresh(self, force=False, wait=True):
+        """Bring the index up to date, analyzing only new or changed datasets.
+
+        Datasets are analyzed outside the index lock, so lookups keep working
+        (and see each dataset as soon as it's done) during a long refresh.
+        With wait=False, returns immediately if another refresh is running.
+        """
+        if not self._refresh_lock.acquire(blocking=wait):
+            return False
+        try:
+            with self._lock:
+                if not self.uploads_path.exists():
+                    print("Uploads folder doesn't exist, creating it...")
+                    self.uploads_path.mkdir(parents=True, exist_ok=True)
+
+                present = set()
+                stale = []
+                for entry in os.scandir(self.uploads_path):
+                    if not entry.is_dir() or entry.name.startswith('.'):
+                        continue
+                    present.add(entry.name)
+                    cached = self.entries.get(entry.name)
+                    if not force and cached and signature_matches(cached['signature']):
+                        continue
+                    stale.append((entry.name, entry.path))
+
+                removed = set(self.entries) - present
+                for name in removed:
+                    print(f"Dataset removed from uploads: {name}")
+                    del self.entries[name]
+                    self._notify(name, None)
+                    self._notify_removed(name)
+                if removed:
+                    self.generation += 1
+
+                self.progress = {'running': bool(stale), 'datasets_total': len(stale), 'datasets_done': 0,
+                                 'tasks_total': len(stale), 'tasks_done': 0,
+                                 'pending': sorted(name for name, _ in stale)}
+            self._deliver()
+
+            if stale:
+                self._analyze_many(stale)
+
+            with self._lock:
+                self.progress['running'] = False
+                self._checked_at = time.monotonic()
+                changed = bool(stale or removed)
+                if changed:
+                    self.save()
+                return changed
+        finally:
+            self._refresh_lock.release()
+
+    def _analyze_many(self, stale):
+        """Analyze (name, path) pairs, storing each result as it completes"""
+        if self.pool is None:
+            for name, path in stale:
+                print(f"Indexing dataset: {name}")
+                self._store_result(name, path, self.analyze_fn(path))
+            return
+
+        names = {path: name for name, path in stale}
+        print(f"Indexing {len(stale)} datasets with {self.pool.workers} workers")
+
+        def on_progress(done, total):
+            with self._lock:
+                self.progress['tasks_done'] = done
+                self.progress['tasks_total'] = total
+
+        self.pool.analyze(list(names), lambda path, info: self._store_result(names[path], path, info), on_progress)
+
+    def _store_result(self, name, path, dataset_info):
+        with self._lock:
+            self._store(name, path, dataset_info)
+            self.generation += 1  # Publish right away so list views show partial results
+            self.progress['datasets_done'] += 1
+            if name in self.progress['pending']:
+                self.progress['pending'].remove(name)
+        self._deliver()
+
+    def _store(self, name, path, dataset_info):
+        signature = compute_signature(path, dataset_info)
+        self.entries[name] = {
+            'signature': signature,
+            'info': dataset_info,
+        }
+        self._notify(name, dataset_info, signature)
+        self._maybe_refine(name, dataset_info)
+        return dataset_info
+
+    # --- Background refinement ---
+    def _maybe_refine(self, name, dataset_info):
+        if not self.refine_fn or not dataset_info or dataset_info.get('class_inference') != 'sampled':
+            return
+        with self._refine_cond:
+            self._refine_pending.add(name)
+            if self._refine_thread is None:
+                self._refine_thread = threading.Thread(target=self._refine_loop, name='dataset-refiner', daemon=True)
+                self._refine_thread.start()
+            self._refine_cond.notify()
+
+    def _refine_loop(self):
+        while True:
+            with self._refine_cond:
+                while not self._refine_pending:
+                    self._refine_cond.wait()
+                name = self._refine_pending.pop()
+
+            with self._lock:
+                entry = self.entries.get(name)
+                dataset_info = entry['info'] if entry else None
+            if not dataset_info or dataset_info.get('class_inference') != 'sampled':
+                continue
+
+            start = time.monotonic()
+            try:
+                updates = self.refine_fn(dataset_info)
+            except Exception as e:
+                print(f"Error refining dataset {name}: {e}")
+                continue
+
+            with self._lock:
+                entry = self.entries.get(name)
+                if not entry or entry['info'] is not dataset_info:
+                    continue  # Re-analyzed in the meantime
+                dataset_info.update(updates)
+                self._notify(name, dataset_info, entry['signature'])
+                self.generation += 1
+                self.save()
+            self._deliver()
+            print(f"Refined classes of {name} in {time.monotonic() - start:.2f}s: {len(dataset_info['classes'])} classes")
+
+    # --- Listeners ---
+    def _notify(self, name, dataset_info, signature=None, changes=None):
+        """Queue a change for the listeners (called with the lock held)"""
+        self._notifications.append((self.listeners, (name, dataset_info, signature, changes)))
+
+    def _notify_removed(self, name):
+        self._notifications.append((self.removal_listeners, (name,)))
+
+    def _deliver(self):
+        """Call the listeners for queued changes; never called with the lock held"""
+        with self._deliver_lock:
+            with self._lock:
+                notifications, self._notifications = self._notifications, []
+            for listeners, args in notifications:
+                for listener in listeners:
+                    try:
+                        listener(*args)
+                    except Exception as e:
+                        print(f"Error in dataset index listener for {args[0]}: {e}")
+                        import traceback
+                        traceback.print_exc()
+
+    def _ensure_fresh(self):
+        # Called before taking the lock, since refresh() delivers to the listeners.
+        # Never waits for a running refresh.
+        if self._checked_at is None:
+            self.refresh(wait=False)
+        elif self.check_interval is not None and time.monotonic() - self._checked_at >= self.check_interval:
+            self.refresh(wait=False)
+
+    # --- Lookups ---
+    def datasets(self):
+        """List of valid dataset_info dicts, sorted by name"""
+        self._ensure_fresh()
+        with self._lock:
+            return [entry['info'] for name, entry in sorted(self.entries.items()) if entry['info']]
+
+    def summaries(self):
+        """Dataset summaries and their JSON serialization, cached per index generation"""
+        self._ensure_fresh()
+        with self._lock:
+            if self._summary_cache is None or self._summary_cache[0] != self.generation:
+                summaries = [dataset_summary(entry['info'], entry['signature'])
+                             for name, entry in sorted(self.entries.items()) if entry['info']]
+                self._summary_cache = (self.generation, summaries, json.dumps(summaries))
+            return self._summary_cache[1], self._summary_cache[2]
+
+    def summary(self, name):
+        with self._lock:
+            entry = self.entries.get(name)
+            if not entry or not entry['info']:
+                return None
+            return dataset_summary(entry['info'], entry['signature'])
+
+    def get(self, name):
+        """dataset_info for a dataset name, or None if it's unknown or invalid"""
+        self._ensure_fresh()
+        with self._lock:
+            entry = self.entries.get(name)
+            return entry['info'] if entry else None
+
+    def add(self, dataset_path):
+        """Analyze a single dataset (e.g. right after an upload) and store it"""
+        dataset_path = Path(dataset_path)
+        print(f"Indexing dataset: {dataset_path.name}")
+        dataset_info = self.analyze_fn(str(dataset_path))
+        with self._lock:
+            self._store(dataset_path.name, str(dataset_path), dataset_info)
+            self.generation += 1
+            self.save()
+        self._deliver()
+        return dataset_info
+
+    def remove(self, name):
+        with self._lock:
+            if self.entries.pop(name, None) is not None:
+                self._notify(name, None)
+                self.generation += 1
+                self.save()
+            self._notify_removed(name)
+        self._deliver()
+
+    def status(self):
+        """Indexing progress for the UI"""
+        with self._lock:
+            status = dict(self.progress, pending=list(self.progress['pending']))
+            status['generation'] = self.generation
+            status['datasets'] = sum(1 for entry in self.entries.values() if entry['info'])
+            return status
+
+    def snapshot_entries(self):
+        with self._lock:
+            return dict(self.entries)
+
+    # --- Incremental updates (used by DatasetWatcher) ---
+    def commit(self):
+        """Publish changes made with save=False"""
+        with self._lock:
+            self.generation += 1
+            self.save()
+
+    def reindex(self, name, save=True):
+        """Re-analyze one dataset (outside the lock), or drop it if its directory is gone"""
+        path = self.uploads_path / name
+        if path.is_dir():
+            print(f"Indexing dataset: {name}")
+            dataset_info = self.analyze_fn(str(path))
+            with self._lock:
+                self._store(name, str(path), dataset_info)
+        else:
+            print(f"Dataset removed from uploads: {name}")
+            with self._lock:
+                if self.entries.pop(name, None) is not None:
+                    self._notify(name, None)
+                self._notify_removed(name)
+        if save:
+            self.commit()
+        self._deliver()
+
+    def apply_file_changes(self, name, changes, save=True):
+        """Apply coalesced image/label adds and removes to a dataset's splits.
+
+        `changes` maps split -> {'images': {file name: exists}, 'labels': {...}}.
+        Falls back to a re-analysis when a split has no images left or the
+        dataset wasn't valid before.
+        """
+        with self._lock:
+            reanalyze = self._update_splits(name, changes)
+            if not reanalyze and save:
+                self.commit()
+        if reanalyze:
+            self.reindex(name, save=save)
+        else:
+            self._deliver()
+
+    def _update_splits(self, name, changes):
+        """Update a dataset's entry in place; returns True if it needs a re-analysis instead"""
+        entry = self.entries.get(name)
+        info = entry['info'] if entry else None
+        if not info:
+            return True
+
+        for split, split_changes in changes.items():
+            split_info = info['splits'].get(split)
+            if split_info is None:
+                continue
+
+            image_changes = split_changes.get('images', {})
+            if image_changes:
+                images = split_info['images'].with_changes(
+                    added=[n for n, exists in image_changes.items() if exists],
+                    removed=[n for n, exists in image_changes.items() if not exists])
+                if not images:
+                    return True
+                split_info['images'] = images
+                split_info['image_count'] = len(images)
+
+            label_changes = split_changes.get('labels', {})
+            if label_changes and split_info['labels_dir']:
+                # Whether a touched label existed before isn't known, so recount with one listing
+                split_info['label_count'] = len(list_split_files(None, split_info['labels_dir'], stat=False).labels)
+
+        info['total_images'] = sum(s['image_count'] for s in info['splits'].values())
+        info['total_labels'] = sum(s['label_count'] for s in info['splits'].values())
+        entry['signature'] = compute_signature(self.uploads_path / name, info)
+        self._notify(name, info, entry['signature'], changes)
+        return False
@@ -0,0 +1,101 @@
+"""
+Directory enumeration shared by the dataset analyzer and debug_dataset.py.
+
+Each directory is listed exactly once with os.scandir and its entries are
+bucketed by lower-cased extension, so `IMG_1.Jpg` is found just like
+`IMG_1.jpg` without one glob per extension and case.
+"""
+
+import os
+from collections import namedtuple
+from pathlib import Path
+
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'})
+LABEL_EXTENSIONS = frozenset({'.txt'})
+YAML_EXTENSIONS = frozenset({'.yaml', '.yml'})
+
+FileStat = namedtuple('FileStat', ['size', 'mtime_ns'])
+SplitFiles = namedtuple('SplitFiles', ['images', 'labels'])
+
+
+def scan_directory(path, stat=True):
+    """List the regular files of a directory, grouped by lower-cased extension.
+
+    Returns {'.jpg': {name: FileStat or None, ...}, ...} with names sorted.
+    A missing or unreadable directory yields an empty dict.
+    """
+    by_ext = {}
+    try:
+        with os.scandir(path) as it:
+            entries = [entry for entry in it if entry.is_file()]
+    except OSError:
+        return by_ext
+
+    entries.sort(key=lambda entry: entry.name)
+    for entry in entries:
+        ext = os.path.splitext(entry.name)[1].lower()
+        file_stat = None
+        if stat:
+            try:
+                st = entry.stat()
+                file_stat = FileStat(st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+        by_ext.setdefault(ext, {})[entry.name] = file_stat
+    return by_ext
+
+
+def select(by_ext, extensions):
+    """Merge the buckets for a set of extensions into one name-sorted dict"""
+    files = {}
+    for ext in extensions:
+        files.update(by_ext.get(ext, {}))
+    return dict(sorted(files.items()))
+
+
+def list_split_files(images_dir, labels_dir=None, stat=True):
+    """Enumerate the images and label files of a split.
+
+    Each directory is listed once; when images and labels live in the same
+    directory it is only listed a single time. Returns a SplitFiles tuple of
+    {name: FileStat} dicts.
+    """
+    image_listing = scan_directory(images_dir, stat=stat) if images_dir else {}
+    if labels_dir and os.path.normpath(str(labels_dir)) == os.path.normpath(str(images_dir)):
+        label_listing = image_listing
+    else:
+        label_listing = scan_directory(labels_dir, stat=stat) if labels_dir else {}
+
+    return SplitFiles(
+        images=select(image_listing, IMAGE_EXTENSIONS),
+        labels=select(label_listing, LABEL_EXTENSIONS),
+    )
+
+
+def labels_dir_for(images_dir):
+    """Directory that holds (or will hold) the YOLO labels of an images directory.
+
+    An images directory named `images` pairs with a sibling `labels`
+    directory; any other images directory keeps its labels in a `labels`
+    subdirectory. Datasets that already put them in `images/labels` keep
+    that location.
+    """
+    images_dir = Path(images_dir)
+    if images_dir.name != 'images':
+        return images_dir / 'labels'
+    sibling, nested = images_dir.parent / 'labels', images_dir / 'labels'
+    return nested if nested.is_dir() and not sibling.is_dir() else sibling
+
+
+def find_yaml_files(dataset_path):
+    """Paths of the YAML files directly inside a dataset directory"""
+    listing = scan_directory(dataset_path, stat=False)
+    return [os.path.join(str(dataset_path), name) for name in select(listing, YAML_EXTENSIONS)]
+
+
+def is_image_file(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def is_label_file(name):
+    return os.path.splitext(name)[1].lower() in LABEL_EXTENSIONS
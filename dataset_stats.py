@@ -0,0 +1,190 @@
+"""
+Label statistics for dataset splits.
+
+Reads all labels of a split as NumPy arrays (from the label_arrays.LabelCache) and
+computes class counts, boxes per image and box width/height/aspect/area
+distributions in one vectorized pass. Results are cached in memory and under
+cache/stats, keyed on the names, sizes and mtimes of the split's label files,
+so a split is only re-read after its labels change.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from dataset_scan import list_split_files
+from label_arrays import labels_key
+
+STATS_VERSION = 2
+PERCENTILES = [0, 5, 25, 50, 75, 95, 100]
+SIZE_BINS = np.linspace(0.0, 1.0, 21)  # width, height and area (normalized)
+ASPECT_BINS = 2.0 ** np.arange(-4.0, 4.5, 0.5)  # width / height, 1/16 .. 16
+MAX_BOXES_PER_IMAGE_BIN = 50  # boxes-per-image histogram: 0..49, then one bin for 50+
+
+
+def distribution(values, bins):
+    """Summary of a 1-D array: mean, percentiles and a histogram over fixed bins"""
+    if len(values) == 0:
+        return {'count': 0, 'mean': None, 'percentiles': {}, 'bins': bins.tolist(), 'histogram': [0] * (len(bins) - 1)}
+    clipped = np.clip(values, bins[0], bins[-1])
+    return {
+        'count': int(len(values)),
+        'mean': float(values.mean()),
+        'percentiles': {str(p): float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+        'bins': bins.tolist(),
+        'histogram': np.histogram(clipped, bins=bins)[0].tolist(),
+    }
+
+
+def compute_split_stats(labels, image_names, num_classes):
+    """Statistics for one split from its SplitLabels and image names.
+
+    Boxes of all label files are counted, but only label files with a
+    matching image count as labeled images.
+    """
+    image_count = len(image_names)
+    class_ids = labels.class_ids
+    widths, heights = labels.boxes[:, 2], labels.boxes[:, 3]
+
+    stems = {os.path.splitext(name)[0] for name in image_names}
+    has_image = np.fromiter((os.path.splitext(name)[0] in stems for name in labels.names),
+                            dtype=bool, count=len(labels.names))
+
+    # Boxes per image, counting images without a label file (or an empty one) as 0
+    boxes_per_file = np.diff(labels.offsets)
+    labeled = boxes_per_file[has_image & (boxes_per_file > 0)]
+    unlabeled = max(0, image_count - len(labeled))
+    per_image = np.concatenate((labeled, np.zeros(unlabeled, dtype=labeled.dtype)))
+
+    class_counts = np.bincount(class_ids, minlength=num_classes)
+    # Images containing each class: count unique (file, class) pairs
+    pairs = np.unique(labels.file_index.astype(np.int64) * len(class_counts) + class_ids)
+    images_per_class = np.bincount(pairs % len(class_counts), minlength=len(class_counts)) if len(class_counts) else class_counts
+
+    valid_size = (widths > 0) & (heights > 0)
+    aspect = widths[valid_size] / heights[valid_size]
+    out_of_range = ((labels.boxes < 0) | (labels.boxes > 1)).any(axis=1) | ~valid_size
+
+    return {
+        'image_count': int(image_count),
+        'label_files': len(labels.names),
+        'orphan_label_files': int((~has_image).sum()),
+        'labeled_images': int(len(labeled)),
+        'box_count': int(len(class_ids)),
+        'class_counts': class_counts.tolist(),
+        'images_per_class': images_per_class.tolist(),
+        'unknown_class_boxes': int((class_ids >= num_classes).sum()),
+        'out_of_range_boxes': int(out_of_range.sum()),
+        'boxes_per_image': {
+            'mean': float(per_image.mean()) if len(per_image) else None,
+            'max': int(per_image.max()) if len(per_image) else 0,
+            'percentiles': ({str(p): float(v) for p, v in zip(PERCENTILES, np.percentile(per_image, PERCENTILES))}
+                            if len(per_image) else {}),
+            'histogram': np.bincount(np.minimum(per_image, MAX_BOXES_PER_IMAGE_BIN),
+                                     minlength=MAX_BOXES_PER_IMAGE_BIN + 1).tolist(),
+        },
+        'width': distribution(widths, SIZE_BINS),
+        'height': distribution(heights, SIZE_BINS),
+        'area': distribution(widths * heights, SIZE_BINS),
+        'aspect': distribution(aspect, ASPECT_BINS),
+    }
+
+
+def _stats_key(labels_key, image_names, num_classes):
+    """Cache key over the split's label files (see label_arrays.labels_key), image names and class count"""
+    h = hashlib.blake2b(f"{STATS_VERSION}:{len(image_names)}:{num_classes}:{labels_key}\n".encode(),
+                        digest_size=16)
+    h.update(image_names.__getstate__()[0])
+    return h.hexdigest()
+
+
+class DatasetStats:
+    """Per-split statistics with an in-memory and on-disk cache"""
+
+    def __init__(self, cache_dir, label_cache):
+        self.cache_dir = Path(cache_dir)
+        self.label_cache = label_cache
+        self._cache = {}  # (dataset, split) -> (key, stats)
+        self._lock = threading.Lock()
+
+    def _cache_file(self, dataset_name, split):
+        return self.cache_dir / dataset_name / f'{split}.json'
+
+    def split_stats(self, dataset_info, split):
+        """Statistics of one split, recomputed only if its label files changed"""
+        split_info = dataset_info['splits'][split]
+        labels_dir = split_info['labels_dir']
+        label_files = list_split_files(None, labels_dir).labels if labels_dir else {}
+        num_classes = len(dataset_info['classes'])
+        key = _stats_key(labels_key(labels_dir, label_files), split_info['images'], num_classes)
+        cache_id = (dataset_info['name'], split)
+
+        with self._lock:
+            cached = self._cache.get(cache_id)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        cache_file = self._cache_file(*cache_id)
+        stats = None
+        try:
+            with open(cache_file, 'r') as f:
+                data = json.load(f)
+            if data.get('key') == key:
+                stats = data['stats']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if stats is None:
+            labels = self.label_cache.split_labels(dataset_info['name'], split, labels_dir, label_files)
+            stats = compute_split_stats(labels, split_info['images'], num_classes)
+            # Unique per writer: two requests may compute the same split's stats at once
+            tmp_file = f'{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                with open(tmp_file, 'w') as f:
+                    json.dump({'key': key, 'stats': stats}, f)
+                os.replace(tmp_file, cache_file)
+            except OSError as e:
+                print(f"Error writing stats cache {cache_file}: {e}")
+                try:
+                    os.unlink(tmp_file)
+                except OSError:
+                    pass
+
+        with self._lock:
+            self._cache[cache_id] = (key, stats)
+        return stats
+
+    def dataset_stats(self, dataset_info, splits=None):
+        """Statistics for the given splits (default: all) plus dataset-wide totals"""
+        splits = splits or list(dataset_info['splits'])
+        per_split = {split: self.split_stats(dataset_info, split) for split in splits}
+
+        class_counts = np.zeros(len(dataset_info['classes']), dtype=np.int64)
+        images_per_class = np.zeros(len(dataset_info['classes']), dtype=np.int64)
+        for stats in per_split.values():
+            class_counts = _add(class_counts, stats['class_counts'])
+            images_per_class = _add(images_per_class, stats['images_per_class'])
+        totals = {
+            'image_count': sum(s['image_count'] for s in per_split.values()),
+            'labeled_images': sum(s['labeled_images'] for s in per_split.values()),
+            'box_count': sum(s['box_count'] for s in per_split.values()),
+            'class_counts': class_counts.tolist(),
+            'images_per_class': images_per_class.tolist(),
+            'unknown_class_boxes': sum(s['unknown_class_boxes'] for s in per_split.values()),
+            'out_of_range_boxes': sum(s['out_of_range_boxes'] for s in per_split.values()),
+        }
+        return {'classes': dataset_info['classes'], 'splits': per_split, 'totals': totals}
+
+
+def _add(a, b):
+    b = np.asarray(b, dtype=np.int64)
+    if len(a) < len(b):
+        a, b = b, a
+    a = a.copy()
+    a[:len(b)] += b
+    return a
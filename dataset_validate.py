@@ -0,0 +1,295 @@
+"""
+Dataset validator for Laibel.
+
+Checks every label file of a dataset, spread over a worker pool in chunks of
+label files. Each chunk is read into one buffer and checked with NumPy:
+token counts, class ids (against the data.yaml names), coordinates outside
+[0, 1], zero-area boxes and duplicate lines. Orphan labels and images
+without labels are found from the directory listings. The result is a JSON
+serializable report, used by debug_dataset.py and the validate endpoint.
+"""
+
+import concurrent.futures
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from dataset_scan import list_split_files
+from label_arrays import tokenize
+
+VALIDATE_CHUNK = 2000  # label files per task
+MAX_EXAMPLES = 20  # examples kept per issue type and split
+MAX_LINE_TEXT = 200
+
+# Issue type -> severity
+ISSUES = {
+    'unreadable_label_files': 'error',
+    'bad_token_count': 'error',          # not 5 tokens (box) or an odd number >= 7 (polygon)
+    'non_numeric': 'error',
+    'invalid_class_id': 'error',         # negative or not an integer
+    'class_out_of_range': 'error',       # >= number of names in data.yaml
+    'coords_out_of_range': 'error',      # coordinate outside [0, 1]
+    'zero_area_box': 'error',
+    'duplicate_lines': 'warning',        # same box repeated within a file
+    'empty_label_files': 'warning',
+    'orphan_labels': 'warning',          # label file without a matching image
+    'images_without_labels': 'warning',
+}
+
+
+# --- Label checks (run in worker processes) ---
+def validate_label_chunk(labels_dir, label_names, num_classes=None, max_examples=MAX_EXAMPLES):
+    """Check a batch of label files; returns counts and examples per issue type"""
+    issues = dict.fromkeys(ISSUES, 0)
+    examples = {}
+
+    def example(issue, name, line=None, text=None):
+        items = examples.setdefault(issue, [])
+        if len(items) < max_examples:
+            item = {'file': name}
+            if line is not None:
+                item['line'] = line
+                item['text'] = text
+            items.append(item)
+
+    buffer, file_ids, line_counts = [], [], []
+    for i, label_name in enumerate(label_names):
+        try:
+            with open(os.path.join(labels_dir, label_name), 'rb') as f:
+                data = f.read()
+        except OSError:
+            issues['unreadable_label_files'] += 1
+            example('unreadable_label_files', label_name)
+            continue
+        if not data.strip():
+            issues['empty_label_files'] += 1
+            example('empty_label_files', label_name)
+            continue
+        data += b'\n'
+        buffer.append(data)
+        file_ids.append(i)
+        line_counts.append(data.count(b'\n'))
+
+    result = {'label_files': len(label_names), 'lines': 0, 'boxes': 0, 'issues': issues, 'examples': examples}
+    if not buffer:
+        return result
+
+    data = b''.join(buffer)
+    values, token_line, column, tokens_per_line = tokenize(data)
+    line_count = len(tokens_per_line)
+    line_file = np.repeat(np.array(file_ids), line_counts)
+    file_first_line = np.repeat(np.cumsum(line_counts) - line_counts, line_counts)
+    line_starts = np.concatenate(([0], np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n'))[:-1] + 1))
+
+    def per_line(token_mask):
+        return np.bincount(token_line[token_mask], minlength=line_count) > 0
+
+    def column_value(col):
+        out = np.full(line_count, np.nan)
+        mask = column == col
+        out[token_line[mask]] = values[mask]
+        return out
+
+    nonblank = tokens_per_line > 0
+    is_box = tokens_per_line == 5
+    is_polygon = (tokens_per_line >= 7) & (tokens_per_line % 2 == 1)
+    non_numeric = per_line(np.isnan(values))
+    class_id = column_value(0)
+    integral = np.isfinite(class_id) & (class_id >= 0) & (class_id == np.floor(class_id))
+    width, height = column_value(3), column_value(4)
+
+    checks = {
+        'bad_token_count': nonblank & ~is_box & ~is_polygon,
+        'non_numeric': non_numeric,
+        'invalid_class_id': np.isfinite(class_id) & ~integral,
+        'coords_out_of_range': per_line((column >= 1) & ((values < 0) | (values > 1))),
+        'zero_area_box': is_box & ~non_numeric & ((width <= 0) | (height <= 0)),
+    }
+    if num_classes is not None:
+        checks['class_out_of_range'] = integral & (class_id >= num_classes)
+
+    # Duplicates: identical (file, values) rows after the first occurrence
+    box_lines = np.flatnonzero(is_box & ~non_numeric)
+    duplicates = np.zeros(line_count, dtype=bool)
+    if len(box_lines):
+        rows = values[is_box[token_line] & ~non_numeric[token_line]].reshape(-1, 5)
+        keyed = np.column_stack((line_file[box_lines], rows))
+        _, first = np.unique(keyed, axis=0, return_index=True)
+        repeated = np.ones(len(box_lines), dtype=bool)
+        repeated[first] = False
+        duplicates[box_lines[repeated]] = True
+    checks['duplicate_lines'] = duplicates
+
+    for issue, mask in checks.items():
+        lines = np.flatnonzero(mask)
+        issues[issue] += int(len(lines))
+        for line in lines[:max_examples]:
+            start = line_starts[line]
+            text = data[start:data.index(b'\n', start)].decode('utf-8', 'replace').strip()
+            example(issue, label_names[line_file[line]], int(line - file_first_line[line] + 1), text[:MAX_LINE_TEXT])
+
+    result['lines'] = int(nonblank.sum())
+    result['boxes'] = int((is_box & ~non_numeric & integral).sum())
+    return result
+
+
+def _merge(total, part, max_examples=MAX_EXAMPLES):
+    for key in ('label_files', 'lines', 'boxes'):
+        total[key] += part[key]
+    for issue, count in part['issues'].items():
+        total['issues'][issue] += count
+    for issue, items in part['examples'].items():
+        kept = total['examples'].setdefault(issue, [])
+        kept.extend(items[:max_examples - len(kept)])
+
+
+def _stems(names):
+    return {os.path.splitext(name)[0]: name for name in names}
+
+
+# --- Dataset validation ---
+def validate_dataset(dataset_info, executor=None, chunk_size=VALIDATE_CHUNK, on_progress=None):
+    """Validate every split of a dataset and return the report.
+
+    Label chunks are checked on `executor` when given (a process pool for
+    large datasets), otherwise inline. on_progress(done, total) is called
+    after each chunk.
+    """
+    started = time.time()
+    # Class range can only be checked against names from data.yaml, not inferred ones
+    num_classes = len(dataset_info['classes']) if 'class_inference' not in dataset_info else None
+
+    splits = {}
+    tasks = []
+    for split, split_info in dataset_info['splits'].items():
+        labels_dir = split_info['labels_dir']
+        label_names = list(list_split_files(None, labels_dir, stat=False).labels) if labels_dir else []
+        report = {'images': split_info['image_count'], 'label_files': 0, 'lines': 0, 'boxes': 0,
+                  'issues': dict.fromkeys(ISSUES, 0), 'examples': {}}
+        splits[split] = report
+
+        image_stems = _stems(split_info['images'])
+        label_stems = _stems(label_names)
+        orphans = [name for stem, name in label_stems.items() if stem not in image_stems]
+        unlabeled = [name for stem, name in image_stems.items() if stem not in label_stems]
+        report['issues']['orphan_labels'] = len(orphans)
+        report['issues']['images_without_labels'] = len(unlabeled)
+        if orphans:
+            report['examples']['orphan_labels'] = [{'file': name} for name in orphans[:MAX_EXAMPLES]]
+        if unlabeled:
+            report['examples']['images_without_labels'] = [{'file': name} for name in unlabeled[:MAX_EXAMPLES]]
+
+        for start in range(0, len(label_names), chunk_size):
+            tasks.append((split, labels_dir, label_names[start:start + chunk_size]))
+
+    if executor is None:
+        for done, (split, labels_dir, names) in enumerate(tasks, 1):
+            _merge(splits[split], validate_label_chunk(labels_dir, names, num_classes))
+            if on_progress:
+                on_progress(done, len(tasks))
+    else:
+        futures = {executor.submit(validate_label_chunk, labels_dir, names, num_classes): split
+                   for split, labels_dir, names in tasks}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            _merge(splits[futures[future]], future.result())
+            if on_progress:
+                on_progress(done, len(tasks))
+
+    totals = dict.fromkeys(ISSUES, 0)
+    for report in splits.values():
+        for issue, count in report['issues'].items():
+            totals[issue] += count
+    errors = sum(count for issue, count in totals.items() if ISSUES[issue] == 'error')
+    warnings = sum(count for issue, count in totals.items() if ISSUES[issue] == 'warning')
+
+    return {
+        'dataset': dataset_info['name'],
+        'path': dataset_info['path'],
+        'classes': dataset_info['classes'],
+        'class_range_checked': num_classes is not None,
+        'generated_at': started,
+        'duration': round(time.time() - started, 3),
+        'valid': errors == 0,
+        'summary': {
+            'images': sum(r['images'] for r in splits.values()),
+            'label_files': sum(r['label_files'] for r in splits.values()),
+            'lines': sum(r['lines'] for r in splits.values()),
+            'boxes': sum(r['boxes'] for r in splits.values()),
+            'errors': errors,
+            'warnings': warnings,
+            'issues': totals,
+        },
+        'severity': ISSUES,
+        'splits': splits,
+    }
+
+
+class ValidationJobs:
+    """Runs dataset validations in the background and keeps the latest report per dataset"""
+
+    def __init__(self, report_dir, executor=None):
+        self.report_dir = Path(report_dir)
+        self.executor = executor
+        self.jobs = {}  # dataset name -> job dict
+        self._lock = threading.Lock()
+
+    def _report_file(self, name):
+        return self.report_dir / f'{name}.json'
+
+    def start(self, dataset_info):
+        """Start validating a dataset unless a validation is already running; returns the job"""
+        name = dataset_info['name']
+        with self._lock:
+            job = self.jobs.get(name)
+            if job and job['status'] == 'running':
+                return job
+            job = {'dataset': name, 'status': 'running', 'started_at': time.time(), 'finished_at': None,
+                   'progress': {'done': 0, 'total': 0}, 'report': None, 'error': None}
+            self.jobs[name] = job
+        threading.Thread(target=self._run, args=(job, dataset_info), name=f'validate-{name}', daemon=True).start()
+        return job
+
+    def _run(self, job, dataset_info):
+        def on_progress(done, total):
+            job['progress'] = {'done': done, 'total': total}
+
+        try:
+            report = validate_dataset(dataset_info, self.executor, on_progress=on_progress)
+            self.report_dir.mkdir(parents=True, exist_ok=True)
+            report_file = self._report_file(job['dataset'])
+            tmp_file = report_file.with_suffix('.tmp')
+            with open(tmp_file, 'w') as f:
+                json.dump(report, f)
+            os.replace(tmp_file, report_file)
+            job['report'] = report
+            job['status'] = 'done'
+            summary = report['summary']
+            print(f"Validated {job['dataset']} in {report['duration']:.1f}s: "
+                  f"{summary['errors']} errors, {summary['warnings']} warnings")
+        except Exception as e:
+            print(f"Error validating dataset {job['dataset']}: {e}")
+            import traceback
+            traceback.print_exc()
+            job['status'] = 'error'
+            job['error'] = str(e)
+        finally:
+            job['finished_at'] = time.time()
+
+    def get(self, name):
+        """Current or last job for a dataset, falling back to the report saved on disk"""
+        with self._lock:
+            job = self.jobs.get(name)
+        if job:
+            return job
+        try:
+            with open(self._report_file(name), 'r') as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return {'dataset': name, 'status': 'done', 'started_at': report['generated_at'],
+                'finished_at': report['generated_at'] + report['duration'],
+                'progress': None, 'report': report, 'error': None}
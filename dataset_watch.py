@@ -0,0 +1,336 @@
+"""
+Background watcher that keeps the dataset index current.
+
+Uses inotify (through ctypes, Linux only) and falls back to polling directory
+mtimes when inotify isn't available, e.g. on some Docker bind mounts. Events are
+collected per directory and only applied after a quiet period, so thousands of
+files landing at once (an rsync or unzip) turn into one index update instead
+of an update storm.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+from dataset_scan import is_image_file, is_label_file
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+SELF_EVENT = ''  # name used for events on the watched directory itself
+
+
+class _Inotify:
+    """Minimal ctypes wrapper around the inotify syscalls"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("inotify is not supported on this platform")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch failed: {os.strerror(err)}", path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """Yield (wd, mask, name) tuples, waiting up to `timeout` seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            yield wd, mask, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DatasetWatcher:
+    """Applies file adds/removes/renames in static/uploads to a DatasetIndex"""
+
+    def __init__(self, index, mode='auto', debounce=0.5, max_delay=5.0, poll_interval=2.0):
+        self.index = index
+        self.mode = mode
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+
+        self._inotify = None
+        self._wd_paths = {}       # wd -> path
+        self._path_wds = {}       # path -> wd
+        self._polled = {}         # path -> (mtime_ns, set of names)
+        self._yaml_files = {}     # path -> (dataset name, mtime_ns), polled when their directory is
+        self._targets = {}        # path -> (dataset name or None, [(split, kind), ...])
+
+        self._pending = {}        # path -> set of touched names
+        self._first_event_at = None
+        self._last_event_at = None
+        self._overflowed = False
+        self._last_poll = 0.0
+
+        self._thread = None
+        self._stop = threading.Event()
+
+    # --- Lifecycle ---
+    def start(self):
+        """Watch the datasets of an already refreshed index; returns False if watching is off"""
+        if self.mode == 'off':
+            print("Upload watcher disabled")
+            return False
+        if self.mode in ('auto', 'inotify'):
+            try:
+                self._inotify = _Inotify()
+            except OSError as e:
+                if self.mode == 'inotify':
+                    raise
+                print(f"inotify unavailable ({e}), falling back to polling for {self.index.uploads_path}")
+
+        # The caller has just built the index (build_dataset_index); from now on it relies on
+        # us instead of periodic mtime checks
+        self.index.check_interval = None
+        self._sync_watches()
+
+        self._thread = threading.Thread(target=self._run, name='dataset-watcher', daemon=True)
+        self._thread.start()
+        backend = 'inotify' if self._inotify else 'polling'
+        print(f"Watching {len(self._targets)} directories in {self.index.uploads_path} ({backend})")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    # --- Watch management ---
+    def _desired_targets(self):
+        """Directories to watch and what each one holds in the index"""
+        targets = {str(self.index.uploads_path): (None, [])}
+        for name, entry in self.index.snapshot_entries().items():
+            dataset_path = str(self.index.uploads_path / name)
+            dirs = [path for path in entry['signature'] if os.path.isdir(path)]
+            for path in dirs:
+                targets.setdefault(path, (name, []))
+            info = entry['info']
+            if not info:
+                continue
+            for split, split_info in info['splits'].items():
+                targets.setdefault(split_info['images_dir'], (name, []))[1].append((split, 'images'))
+                if split_info['labels_dir']:
+                    targets.setdefault(split_info['labels_dir'], (name, []))[1].append((split, 'labels'))
+            targets.setdefault(dataset_path, (name, []))
+        return targets
+
+    def _sync_watches(self):
+        targets = self._desired_targets()
+        for path in list(self._path_wds) + list(self._polled):
+            if path not in targets:
+                self._unwatch(path)
+        for path in targets:
+            if path not in self._path_wds and path not in self._polled:
+                self._watch(path)
+        self._targets = targets
+
+        # In-place YAML edits don't change directory mtimes, so polled datasets check them directly
+        self._yaml_files = {}
+        for name, entry in self.index.snapshot_entries().items():
+            for path, mtime in entry['signature'].items():
+                if path.endswith(('.yaml', '.yml')) and mtime is not None:
+                    self._yaml_files[path] = (name, mtime)
+
+    def _watch(self, path):
+        if self._inotify:
+            try:
+                wd = self._inotify.add_watch(path)
+                self._wd_paths[wd] = path
+                self._path_wds[path] = wd
+                return
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    return
+                print(f"Could not add inotify watch for {path} ({e}), polling it instead")
+        try:
+            self._polled[path] = (os.stat(path).st_mtime_ns, set(os.listdir(path)))
+        except OSError:
+            pass
+
+    def _unwatch(self, path):
+        wd = self._path_wds.pop(path, None)
+        if wd is not None:
+            self._wd_paths.pop(wd, None)
+            if self._inotify:
+                self._inotify.rm_watch(wd)
+        self._polled.pop(path, None)
+
+    # --- Event collection ---
+    def _touch(self, path, name):
+        now = time.monotonic()
+        self._pending.setdefault(path, set()).add(name)
+        if self._first_event_at is None:
+            self._first_event_at = now
+        self._last_event_at = now
+
+    def _read_inotify(self, timeout):
+        for wd, mask, name in self._inotify.read_events(timeout):
+            if mask & IN_Q_OVERFLOW:
+                print("inotify event queue overflowed, revalidating the whole index")
+                self._overflowed = True
+                self._touch(str(self.index.uploads_path), SELF_EVENT)
+                continue
+            path = self._wd_paths.get(wd)
+            if path is None:
+                continue
+            if mask & IN_IGNORED:
+                # Watch removed by the kernel (directory deleted or moved away)
+                self._wd_paths.pop(wd, None)
+                self._path_wds.pop(path, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self._touch(path, SELF_EVENT)
+            else:
+                self._touch(path, name)
+
+    def _poll(self):
+        for path, (mtime, names) in list(self._polled.items()):
+            try:
+                current_mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self._polled.pop(path)
+                self._touch(path, SELF_EVENT)
+                continue
+            if current_mtime == mtime:
+                continue
+            try:
+                current_names = set(os.listdir(path))
+            except OSError:
+                continue
+            for name in names ^ current_names:
+                self._touch(path, name)
+            self._polled[path] = (current_mtime, current_names)
+
+        for path, (dataset_name, mtime) in list(self._yaml_files.items()):
+            if os.path.dirname(path) not in self._polled:
+                continue
+            try:
+                current_mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                current_mtime = None
+            if current_mtime != mtime:
+                self._yaml_files[path] = (dataset_name, current_mtime)
+                self._touch(os.path.dirname(path), os.path.basename(path))
+
+    def _flush_due(self):
+        if not self._pending:
+            return False
+        now = time.monotonic()
+        return (now - self._last_event_at >= self.debounce or
+                now - self._first_event_at >= self.max_delay)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._inotify:
+                    self._read_inotify(self.debounce if self._pending else self.poll_interval)
+                else:
+                    self._stop.wait(min(self.debounce, self.poll_interval))
+                if self._polled and time.monotonic() - self._last_poll >= self.poll_interval:
+                    self._last_poll = time.monotonic()
+                    self._poll()
+                if self._flush_due():
+                    self._flush()
+            except Exception as e:
+                print(f"Error in dataset watcher: {e}")
+                import traceback
+                traceback.print_exc()
+                self._pending.clear()
+                self._first_event_at = self._last_event_at = None
+                self._stop.wait(self.poll_interval)
+
+    # --- Applying changes ---
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._first_event_at = self._last_event_at = None
+        uploads_path = str(self.index.uploads_path)
+
+        if self._overflowed:
+            self._overflowed = False
+            self.index.refresh()
+            self._sync_watches()
+            return
+
+        reindex = set()
+        changes = {}  # dataset -> {split: {'images': {name: exists}, 'labels': {name: exists}}}
+        for path, names in pending.items():
+            if path == uploads_path:
+                reindex.update(name for name in names if name and not name.startswith('.'))
+                continue
+            target = self._targets.get(path)
+            if target is None:
+                continue
+            dataset_name, roles = target
+            if not roles or SELF_EVENT in names:
+                # Dataset root, split directory or YAML change: re-analyze just this dataset
+                reindex.add(dataset_name)
+                continue
+            for split, kind in roles:
+                matches = is_image_file if kind == 'images' else is_label_file
+                touched = {name: os.path.exists(os.path.join(path, name)) for name in names if matches(name)}
+                if touched:
+                    split_changes = changes.setdefault(dataset_name, {}).setdefault(split, {})
+                    split_changes.setdefault(kind, {}).update(touched)
+
+        for dataset_name in reindex:
+            changes.pop(dataset_name, None)
+            self.index.reindex(dataset_name, save=False)
+        for dataset_name, dataset_changes in changes.items():
+            self.index.apply_file_changes(dataset_name, dataset_changes, save=False)
+
+        if reindex or changes:
+            self.index.commit()
+            touched_count = sum(len(names) for names in pending.values())
+            print(f"Dataset watcher applied {touched_count} file events "
+                  f"({len(changes)} datasets updated, {len(reindex)} re-analyzed)")
+        if reindex:
+            self._sync_watches()
@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 """
 Dataset Debug Tool for Laibel
-Run this script to debug your dataset structure and see what the app detects
+Run this script to debug your dataset structure and see what the app detects.
+With --validate, every label file is checked in parallel and a JSON report is
+written (see dataset_validate.py).
 """
 
+import argparse
+import concurrent.futures
+import contextlib
+import json
 import os
 import sys
 from pathlib import Path
 import yaml
 
+from dataset_scan import list_split_files, find_yaml_files
+from dataset_analysis import analyze_dataset
+from dataset_validate import validate_dataset
+
 def check_dataset_structure(dataset_path):
     """Debug function to check dataset structure"""
     dataset_path = Path(dataset_path)
@@ -31,7 +41,7 @@ def check_dataset_structure(dataset_path):
             print(f"  📄 {item.name}")
     
     # Check for YAML files
-    yaml_files = list(dataset_path.glob('*.yaml')) + list(dataset_path.glob('*.yml'))
+    yaml_files = [Path(p) for p in find_yaml_files(dataset_path)]
     print(f"\n🔧 YAML files found: {len(yaml_files)}")
     for yaml_file in yaml_files:
         print(f"  📄 {yaml_file.name}")
@@ -60,17 +70,10 @@ def check_dataset_structure(dataset_path):
             print(f"  📁 Images directory: {images_dir}")
             print(f"  📁 Labels directory: {labels_dir}")
             
-            # Count files
-            image_extensions = ['jpg', 'jpeg', 'png', 'bmp', 'tif', 'tiff', 'webp']
-            images = []
-            
-            for ext in image_extensions:
-                images.extend(list(images_dir.glob(f'*.{ext}')))
-                images.extend(list(images_dir.glob(f'*.{ext.upper()}')))
-            
-            labels = []
-            if labels_dir and labels_dir.exists():
-                labels = list(labels_dir.glob('*.txt'))
+            # Count files (one listing per directory, extensions matched case-insensitively)
+            files = list_split_files(images_dir, labels_dir, stat=False)
+            images = [images_dir / name for name in files.images]
+            labels = [labels_dir / name for name in files.labels]
             
             print(f"  🖼️  Images found: {len(images)}")
             print(f"  🏷️  Labels found: {len(labels)}")
@@ -101,13 +104,62 @@ def check_dataset_structure(dataset_path):
     
     return total_images > 0
 
+def validate_datasets(dataset_paths, workers=None):
+    """Validate datasets with a process pool; returns a list of reports"""
+    reports = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for dataset_path in dataset_paths:
+            # Analysis output goes to stderr so a report on stdout stays valid JSON
+            with contextlib.redirect_stdout(sys.stderr):
+                dataset_info = analyze_dataset(dataset_path)
+            if not dataset_info:
+                reports.append({'dataset': Path(dataset_path).name, 'path': str(dataset_path),
+                                'valid': False, 'error': 'Not a YOLO dataset (no images found)'})
+                continue
+
+            def on_progress(done, total):
+                print(f"\r  {dataset_info['name']}: {done}/{total} label chunks", end='', file=sys.stderr)
+
+            report = validate_dataset(dataset_info, executor, on_progress=on_progress)
+            print(file=sys.stderr)
+            summary = report['summary']
+            print(f"{report['dataset']}: {summary['label_files']} label files, {summary['boxes']} boxes, "
+                  f"{summary['errors']} errors, {summary['warnings']} warnings ({report['duration']:.1f}s)",
+                  file=sys.stderr)
+            reports.append(report)
+    return reports
+
+def dataset_dirs(path):
+    """The dataset itself, or every dataset directory if path is the uploads folder"""
+    path = Path(path)
+    if path.name == 'uploads':
+        return sorted(item for item in path.iterdir() if item.is_dir() and not item.name.startswith('.'))
+    return [path]
+
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python debug_dataset.py <path_to_dataset>")
-        print("Example: python debug_dataset.py static/uploads/my_dataset")
-        return
-    
-    dataset_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Debug and validate Laibel datasets")
+    parser.add_argument('dataset_path', help="Dataset directory, or static/uploads to check all datasets")
+    parser.add_argument('--validate', action='store_true', help="Check every label file and write a JSON report")
+    parser.add_argument('--json', default='-', metavar='FILE', help="Report destination for --validate (default: stdout)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for --validate (default: CPU count)")
+    args = parser.parse_args()
+
+    dataset_path = args.dataset_path
+
+    if args.validate:
+        if not Path(dataset_path).exists():
+            print(f"Dataset path doesn't exist: {dataset_path}", file=sys.stderr)
+            sys.exit(2)
+        reports = validate_datasets(dataset_dirs(dataset_path), args.workers)
+        output = reports[0] if len(reports) == 1 and Path(dataset_path).name != 'uploads' else {'datasets': reports}
+        if args.json == '-':
+            json.dump(output, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(output, f, indent=2)
+            print(f"Report written to {args.json}", file=sys.stderr)
+        sys.exit(0 if all(report.get('valid') for report in reports) else 1)
     
     # If it's in uploads folder, scan all datasets
     if dataset_path.endswith('uploads') or dataset_path == 'static/uploads':
@@ -129,4 +181,4 @@ def main():
         check_dataset_structure(dataset_path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
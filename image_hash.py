@@ -0,0 +1,140 @@
+"""
+Perceptual hashing and near-duplicate grouping.
+
+dhash() computes a 64-bit difference hash from a reduced-size decode (JPEG
+draft mode decodes at 1/2-1/8 scale, so hashing a large photo costs a
+fraction of a full decode). group_near_duplicates() finds all images within a
+Hamming distance of each other without comparing every pair: the 64 bits are
+split into max_distance + 1 bands, and any two hashes within max_distance
+must agree exactly on at least one band, so only hashes sharing a band value
+are compared. Identical hashes are merged before that, and a band whose
+bucket is still huge is skipped (the pair may still meet in another band).
+"""
+
+import hashlib
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 = 64 bit hashes
+MAX_DISTANCE = 10
+BLOCK_SIZE = 1024  # rows and columns of a bucket's distance matrix computed at once
+MAX_BUCKET = 20000  # larger buckets (e.g. thousands of near-blank frames) are skipped in that band
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(values):
+        return np.bitwise_count(values.astype(np.uint64)).astype(np.int64)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+    def popcount(values):
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(path, hash_size=HASH_SIZE):
+    """64-bit difference hash of an image as a signed integer (fits an SQLite INTEGER)"""
+    with Image.open(path) as img:
+        img.draft('L', (hash_size * 4, hash_size * 4))
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = int(np.packbits(bits).view('>u8')[0])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def image_fingerprint(path):
+    """(content hash, dhash) of an image file, for the catalog's metadata worker.
+
+    The content hash is '' and the dhash None when the file can't be read or
+    decoded, so it isn't retried until the file changes.
+    """
+    try:
+        content_hash = hash_file(path)
+    except Exception as e:
+        print(f"Error hashing image {path}: {e}")
+        return '', None
+    try:
+        return content_hash, dhash(path)
+    except Exception as e:
+        print(f"Error computing perceptual hash of {path}: {e}")
+        return content_hash, None
+
+
+def hamming(a, b):
+    """Bitwise Hamming distance between int64/uint64 hash arrays (broadcasting)"""
+    return popcount(np.bitwise_xor(np.asarray(a).astype(np.uint64), np.asarray(b).astype(np.uint64)))
+
+
+def group_near_duplicates(hashes, max_distance=4):
+    """Group hash indices whose hashes are within max_distance bits of each other.
+
+    Returns a list of index arrays (groups of 2 or more), linked transitively.
+    """
+    hashes = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+    if len(hashes) < 2:
+        return []
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # Union-find over the unique hashes
+    parent = np.arange(len(unique))
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    if max_distance > 0:
+        bands = max_distance + 1
+        edges = np.linspace(0, 64, bands + 1).astype(int)
+        for low, high in zip(edges[:-1], edges[1:]):
+            mask = np.uint64((1 << (high - low)) - 1)
+            keys = (unique >> np.uint64(low)) & mask
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+            for bucket in np.split(order, boundaries):
+                if len(bucket) > MAX_BUCKET:
+                    print(f"Skipping {len(bucket)} near-identical hashes in bits {low}-{high} "
+                          f"(more than {MAX_BUCKET} to compare)")
+                    continue
+                for i, j in _close_pairs(unique, bucket, max_distance):
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j:
+                        parent[root_j] = root_i
+
+    roots = np.array([find(i) for i in range(len(unique))])[inverse]
+    order = np.argsort(roots, kind='stable')
+    boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+    return [group for group in np.split(order, boundaries) if len(group) > 1]
+
+
+def _close_pairs(hashes, bucket, max_distance, block_size=BLOCK_SIZE):
+    """Index pairs (i < j position-wise) of a bucket within max_distance.
+
+    Computed in block_size x block_size tiles of the upper triangle, so
+    memory stays bounded whatever the bucket size.
+    """
+    if len(bucket) < 2:
+        return
+    values = hashes[bucket]
+    for row_start in range(0, len(bucket), block_size):
+        row_block = values[row_start:row_start + block_size]
+        for col_start in range(row_start, len(bucket), block_size):
+            col_block = values[col_start:col_start + block_size]
+            rows, cols = np.nonzero(hamming(row_block[:, None], col_block[None, :]) <= max_distance)
+            rows, cols = rows + row_start, cols + col_start
+            keep = cols > rows
+            yield from zip(bucket[rows[keep]], bucket[cols[keep]])
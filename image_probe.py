@@ -0,0 +1,138 @@
+"""
+Header-only image probing.
+
+Reads just enough of a file to get its width, height and EXIF orientation
+without decoding any pixels. JPEG, PNG, GIF, BMP, WebP and TIFF headers are
+parsed directly; anything else falls back to PIL (which also only reads the
+header on open).
+"""
+
+import struct
+
+from PIL import Image
+
+HEADER_READ_SIZE = 64 * 1024
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def probe_image(path):
+    """Return (width, height, orientation) of an image file.
+
+    Width and height are the stored pixel dimensions; orientation is the EXIF
+    orientation (1-8, 1 when absent).
+    """
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        f.seek(0)
+        try:
+            if head.startswith(b'\xff\xd8'):
+                result = _probe_jpeg(f)
+            elif head.startswith(b'\x89PNG\r\n\x1a\n'):
+                result = _probe_png(head)
+            elif head[:6] in (b'GIF87a', b'GIF89a'):
+                result = struct.unpack('<HH', head[6:10]) + (1,)
+            elif head.startswith(b'BM'):
+                result = _probe_bmp(head)
+            elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                result = _probe_webp(f)
+            elif head[:4] in (b'II*\x00', b'MM\x00*'):
+                result = _probe_tiff(f.read(HEADER_READ_SIZE))
+            else:
+                result = None
+        except (struct.error, ValueError, IndexError):
+            result = None
+
+    if result is None:
+        with Image.open(path) as img:
+            orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            return img.size[0], img.size[1], orientation
+    return result
+
+
+def oriented_size(width, height, orientation):
+    """Size of the image as displayed (browsers and Ultralytics apply EXIF orientation)"""
+    if orientation in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def _probe_png(head):
+    width, height = struct.unpack('>II', head[16:24])
+    return width, height, 1
+
+
+def _probe_bmp(head):
+    header_size = struct.unpack('<I', head[14:18])[0]
+    if header_size == 12:
+        width, height = struct.unpack('<HH', head[18:22])
+    else:
+        width, height = struct.unpack('<ii', head[18:26])
+    return width, abs(height), 1
+
+
+def _probe_webp(f):
+    data = f.read(64)
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3fff, height & 0x3fff, 1
+    if chunk == b'VP8L':
+        bits = struct.unpack('<I', data[21:25])[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1, 1
+    if chunk == b'VP8X':
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return width, height, 1
+    return None
+
+
+def _probe_jpeg(f):
+    """Walk JPEG markers up to the first SOF segment, noting the EXIF orientation on the way"""
+    orientation = 1
+    f.read(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        code = marker[1]
+        while code == 0xff:  # Fill bytes
+            code = f.read(1)[0]
+        if code in (0xd8, 0x01) or 0xd0 <= code <= 0xd7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if code == 0xe1 and orientation == 1:
+            segment = f.read(length - 2)
+            if segment.startswith(b'Exif\x00\x00'):
+                orientation = _tiff_tags(segment[6:], (EXIF_ORIENTATION_TAG,)).get(EXIF_ORIENTATION_TAG, 1)
+            continue
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height, orientation
+        if code == 0xd9:
+            return None
+        f.seek(length - 2, 1)
+
+
+def _probe_tiff(data):
+    tags = _tiff_tags(data, (0x0100, 0x0101, EXIF_ORIENTATION_TAG))
+    if 0x0100 not in tags or 0x0101 not in tags:
+        return None
+    return tags[0x0100], tags[0x0101], tags.get(EXIF_ORIENTATION_TAG, 1)
+
+
+def _tiff_tags(data, wanted):
+    """Read SHORT/LONG values of the given tags from the first IFD of a TIFF structure"""
+    endian = '<' if data[:2] == b'II' else '>'
+    ifd_offset = struct.unpack(endian + 'I', data[4:8])[0]
+    entry_count = struct.unpack(endian + 'H', data[ifd_offset:ifd_offset + 2])[0]
+    tags = {}
+    for i in range(entry_count):
+        entry = ifd_offset + 2 + i * 12
+        tag, field_type = struct.unpack(endian + 'HH', data[entry:entry + 4])
+        if tag not in wanted:
+            continue
+        if field_type == 3:  # SHORT
+            tags[tag] = struct.unpack(endian + 'H', data[entry + 8:entry + 10])[0]
+        elif field_type == 4:  # LONG
+            tags[tag] = struct.unpack(endian + 'I', data[entry + 8:entry + 12])[0]
+    return tags
@@ -0,0 +1,307 @@
+"""
+Bulk YOLO label loading into NumPy arrays.
+
+load_labels() reads every label file of a split in large buffers and returns
+one array per column instead of a list of boxes per file, so statistics can
+be computed over all boxes of a split at once.
+
+LabelCache keeps the parsed labels of each split in a binary file under
+cache/labels (class ids, float32 boxes and a per-file offset table), keyed on
+the names, sizes and mtimes of the split's label files. The file is
+memory-mapped, so reading a split whose labels haven't changed costs a
+directory listing instead of parsing every label file again.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from dataset_scan import list_split_files
+from name_list import ImageNameList
+
+READ_BYTES = 4 * 1024 * 1024  # label data parsed per NumPy pass
+CACHE_MAGIC = b'LBLC'
+CACHE_VERSION = 1
+CACHE_ALIGN = 16
+WHITESPACE = np.array([ord(c) for c in ' \t\r\n\v\f'], dtype=np.uint8)
+
+# names: label file names; file_index: index into names for every box;
+# class_ids: class id per box; boxes: (N, 4) float32 x_center, y_center, width, height (normalized)
+LabelArrays = namedtuple('LabelArrays', ['names', 'file_index', 'class_ids', 'boxes'])
+
+
+def tokenize(data):
+    """Split newline-terminated label data into numeric tokens with their positions.
+
+    Returns (values, token_line, column, tokens_per_line): float64 value of
+    every whitespace-separated token (NaN if it isn't a number), the line and
+    column of each token, and the token count of every line.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if len(buf) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return np.zeros(0, dtype=np.float64), empty, empty, empty
+
+    space = np.isin(buf, WHITESPACE)
+    newline = buf == ord('\n')
+    line_of_byte = np.cumsum(newline) - newline
+    token_starts = np.flatnonzero(~space & np.concatenate(([True], space[:-1])))
+    token_line = line_of_byte[token_starts]
+    line_count = int(line_of_byte[-1]) + 1
+    tokens_per_line = np.bincount(token_line, minlength=line_count)
+    first_token = np.cumsum(tokens_per_line) - tokens_per_line
+    column = np.arange(len(token_starts)) - first_token[token_line]
+
+    tokens = data.split()  # Same tokens, in the same order
+    try:
+        values = np.array(tokens, dtype=np.float64)
+    except ValueError:
+        values = np.array([_to_float(token) for token in tokens], dtype=np.float64)
+    return values, token_line, column, tokens_per_line
+
+
+def parse_label_data(data, dtype=np.float32):
+    """Parse newline-terminated YOLO label lines.
+
+    Returns (line_index, class_ids, boxes) for every line whose first five
+    tokens are a non-negative integer class id and four numbers, with boxes
+    as `dtype`. Further columns (segmentation points, confidences) are
+    ignored.
+    """
+    values, token_line, column, tokens_per_line = tokenize(data)
+    lines = np.flatnonzero(tokens_per_line >= 5)
+    rows = values[(column < 5) & (tokens_per_line[token_line] >= 5)].reshape(-1, 5)
+    class_column = rows[:, 0]
+    valid = np.isfinite(rows).all(axis=1) & (class_column >= 0) & (class_column == np.floor(class_column))
+    return lines[valid], class_column[valid].astype(np.int32), rows[valid, 1:].astype(dtype)
+
+
+def _to_float(token):
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+
+def load_labels(labels_dir, label_names, read_bytes=READ_BYTES):
+    """Load the boxes of many label files into a LabelArrays tuple"""
+    label_names = list(label_names)
+    file_index, class_ids, boxes = [], [], []
+    buffer, buffer_files, buffer_lines, size = [], [], [], 0
+
+    def flush():
+        lines, ids, coords = parse_label_data(b''.join(buffer))
+        line_files = np.repeat(np.array(buffer_files, dtype=np.int32), buffer_lines)
+        file_index.append(line_files[lines])
+        class_ids.append(ids)
+        boxes.append(coords)
+
+    for i, label_name in enumerate(label_names):
+        label_file = os.path.join(labels_dir, label_name)
+        try:
+            with open(label_file, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            print(f"Error reading label file {label_file}: {e}")
+            continue
+        data += b'\n'
+        buffer.append(data)
+        buffer_files.append(i)
+        buffer_lines.append(data.count(b'\n'))
+        size += len(data)
+        if size >= read_bytes:
+            flush()
+            buffer, buffer_files, buffer_lines, size = [], [], [], 0
+    if buffer:
+        flush()
+
+    if not class_ids:
+        return LabelArrays(label_names, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+                           np.zeros((0, 4), dtype=np.float32))
+    return LabelArrays(label_names, np.concatenate(file_index), np.concatenate(class_ids), np.concatenate(boxes))
+
+
+class SplitLabels:
+    """Boxes of all label files of a split, grouped by file with an offset table.
+
+    names is a sorted ImageNameList of label file names; the boxes of
+    names[i] are class_ids[offsets[i]:offsets[i + 1]] and the same rows of
+    boxes. Arrays read from the label cache are read-only memory maps.
+    """
+
+    __slots__ = ('names', 'offsets', 'class_ids', 'boxes')
+
+    def __init__(self, names, offsets, class_ids, boxes):
+        self.names = names
+        self.offsets = offsets
+        self.class_ids = class_ids
+        self.boxes = boxes
+
+    @classmethod
+    def load(cls, labels_dir, label_names, read_bytes=READ_BYTES):
+        """Parse the given label files (see load_labels)"""
+        names = ImageNameList(label_names)
+        labels = load_labels(labels_dir, names, read_bytes)
+        counts = np.bincount(labels.file_index, minlength=len(names))
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return cls(names, offsets, labels.class_ids, labels.boxes)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def file_index(self):
+        """Index into names for every box, as in LabelArrays"""
+        return np.repeat(np.arange(len(self.names), dtype=np.int32), np.diff(self.offsets))
+
+    def file_labels(self, label_name):
+        """(class_ids, boxes) of one label file; empty arrays if it isn't in the split"""
+        try:
+            i = self.names.index(label_name)
+        except ValueError:
+            return self.class_ids[:0], self.boxes[:0]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.class_ids[start:end], self.boxes[start:end]
+
+
+def labels_key(labels_dir, label_files):
+    """Cache key over a split's label files ({name: FileStat}): names, sizes and mtimes"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{CACHE_VERSION}:{labels_dir}\n".encode())
+    for name in sorted(label_files):
+        file_stat = label_files[name]
+        h.update(f"{name}:{file_stat.size}:{file_stat.mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+# --- Binary cache file ---
+# b'LBLC', u32 version, u32 header length, JSON header, then the sections
+# listed in the header ({name: [offset, length]}), each aligned to 16 bytes:
+# name data (UTF-8), name offsets (int64), box offsets (int64),
+# class ids (int32) and boxes (float32, 4 per box).
+def write_label_cache(cache_file, key, labels):
+    names_data, name_offsets = labels.names.__getstate__()
+    sections = [
+        ('names', names_data),
+        ('name_offsets', np.asarray(name_offsets, dtype='<i8').tobytes()),
+        ('offsets', np.asarray(labels.offsets, dtype='<i8').tobytes()),
+        ('class_ids', np.asarray(labels.class_ids, dtype='<i4').tobytes()),
+        ('boxes', np.asarray(labels.boxes, dtype='<f4').tobytes()),
+    ]
+    header = {'key': key, 'files': len(labels.names), 'boxes': int(len(labels.class_ids)), 'sections': {}}
+    # Section offsets depend on the header length: reserve room for the largest offsets
+    header_size = len(json.dumps({**header, 'sections': {name: [2 ** 62, 2 ** 62] for name, _ in sections}}))
+    offset = _align(12 + header_size)
+    for name, data in sections:
+        header['sections'][name] = [offset, len(data)]
+        offset = _align(offset + len(data))
+    header_data = json.dumps(header).encode().ljust(header_size)
+
+    cache_file = Path(cache_file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per writer: two requests may write the same split's cache at once
+    tmp_file = f'{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(CACHE_MAGIC + struct.pack('<II', CACHE_VERSION, header_size) + header_data)
+            for name, data in sections:
+                f.seek(header['sections'][name][0])
+                f.write(data)
+            f.truncate(offset)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        try:
+            os.unlink(tmp_file)
+        except OSError:
+            pass
+        raise
+
+
+def read_label_cache(cache_file, key):
+    """SplitLabels memory-mapped from a cache file, or None if it's missing, stale or corrupt"""
+    try:
+        with open(cache_file, 'rb') as f:
+            head = f.read(12)
+            if len(head) < 12 or head[:4] != CACHE_MAGIC:
+                return None
+            version, header_size = struct.unpack('<II', head[4:])
+            if version != CACHE_VERSION:
+                return None
+            header = json.loads(f.read(header_size))
+            if header['key'] != key:
+                return None
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    def section(name, dtype):
+        offset, length = header['sections'][name]
+        return np.frombuffer(data, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    try:
+        names = ImageNameList()
+        name_offsets = array('q')
+        name_offsets.frombytes(section('name_offsets', '<i8').tobytes())
+        offset, length = header['sections']['names']
+        names.__setstate__((data[offset:offset + length], name_offsets))
+        boxes = section('boxes', '<f4').reshape(-1, 4)
+        labels = SplitLabels(names, section('offsets', '<i8'), section('class_ids', '<i4'), boxes)
+    except (KeyError, ValueError) as e:
+        print(f"Error reading label cache {cache_file}: {e}")
+        return None
+    if len(labels.offsets) != len(names) + 1 or not len(labels.class_ids) == len(boxes) == header['boxes']:
+        return None
+    return labels
+
+
+def _align(offset):
+    return offset + (-offset % CACHE_ALIGN)
+
+
+class LabelCache:
+    """Parsed labels per split, memory-mapped from cache files that follow label file changes"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self._splits = {}  # (dataset, split) -> (key, SplitLabels)
+        self._lock = threading.Lock()
+
+    def _cache_file(self, dataset_name, split):
+        return self.cache_dir / dataset_name / f'{split}.bin'
+
+    def split_labels(self, dataset_name, split, labels_dir, label_files=None):
+        """SplitLabels of a split, re-parsed only if its label files changed.
+
+        label_files ({name: FileStat}) can be passed when the caller has
+        already listed the labels directory.
+        """
+        if label_files is None:
+            label_files = list_split_files(None, labels_dir).labels if labels_dir else {}
+        key = labels_key(labels_dir, label_files)
+        cache_id = (dataset_name, split)
+
+        with self._lock:
+            cached = self._splits.get(cache_id)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        cache_file = self._cache_file(dataset_name, split)
+        labels = read_label_cache(cache_file, key)
+        if labels is None:
+            labels = SplitLabels.load(labels_dir, label_files)
+            try:
+                write_label_cache(cache_file, key, labels)
+            except OSError as e:
+                print(f"Error writing label cache {cache_file}: {e}")
+
+        with self._lock:
+            self._splits[cache_id] = (key, labels)
+        return labels
@@ -0,0 +1,151 @@
+"""
+Bulk label responses.
+
+Sends the labels of many images in one response, as flat arrays per image
+(class ids plus normalized x_center, y_center, width, height) instead of one
+request and a list of box dicts per image. Images are fetched from the
+catalog and their label files parsed in batches (label_arrays.load_labels),
+and the response is generated batch by batch, so a whole split is never held
+in memory at once. Whole listings read the boxes from the memory-mapped
+per-split label cache instead, when one is given.
+
+Encodings:
+
+json    {"success", "dataset", "classes", ["total"], "images": [{..image fields.., ["version"],
+         "class_ids": [c, ...], "boxes": [x, y, w, h, ...]}, ...], "next_cursor"}
+
+binary  Little-endian; every section is padded to 4 bytes so the arrays can be
+        used in place as Int32Array / Float32Array:
+          b'LBL1'
+          u32 length + JSON header {dataset, classes, [total]}
+          per image: u32 length + JSON image fields (and version), u32 box count n,
+                     int32[n] class ids, float32[4n] boxes
+          u32 0 (end of images), u32 length + JSON trailer {next_cursor}
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from image_probe import oriented_size
+from label_arrays import load_labels
+
+BATCH_IMAGES = 500  # images per catalog page / label read when streaming a whole split
+BINARY_MAGIC = b'LBL1'
+JSON_DECIMALS = 6  # float32 precision, without float64 noise in the JSON text
+IMAGE_FIELDS = ('name', 'image_path', 'split', 'dataset')
+
+
+class LabelStream:
+    """Images of a catalog listing with their labels, read in batches.
+
+    fetch_page(after, limit) -> (images, next_cursor) returns catalog rows
+    (DatasetCatalog.page_images). With a limit, one page is read and
+    next_cursor points at the following one; without, pages are read until
+    the end of the listing. The first page is fetched right away so bad
+    filters raise before a response is started.
+
+    split_labels(split) -> label_arrays.SplitLabels is used for whole
+    listings, which touch most label files of a split anyway.
+
+    With a journal (annotation_journal.AnnotationJournal), every image gets
+    its version, and images edited since the journal's last compaction get
+    their boxes from it instead of the label file.
+    """
+
+    def __init__(self, fetch_page, after=None, limit=None, split_labels=None, journal=None):
+        self.fetch_page = fetch_page
+        self.limit = limit
+        self.split_labels = split_labels if not limit else None
+        self.journal = journal
+        self._first = fetch_page(after, limit or BATCH_IMAGES)
+        self.next_cursor = None
+
+    def _pages(self):
+        images, cursor = self._first
+        self._first = None
+        yield images
+        while cursor and not self.limit:
+            images, cursor = self.fetch_page(cursor, BATCH_IMAGES)
+            yield images
+        self.next_cursor = cursor if self.limit else None
+
+    def __iter__(self):
+        """Yield (fields, class_ids, boxes) per image; boxes is a float32 (N, 4) array"""
+        items = self._from_split_labels() if self.split_labels else self._from_label_files()
+        if not self.journal:
+            yield from items
+            return
+        for fields, class_ids, boxes in items:
+            fields['version'], rows = self.journal.boxes(fields['split'], fields['name'])
+            if rows is not None:
+                class_ids = np.array([row[0] for row in rows], dtype=np.int32)
+                boxes = np.array([row[1:] for row in rows], dtype=np.float32).reshape(-1, 4)
+            yield fields, class_ids, boxes
+
+    def _from_label_files(self):
+        for images in self._pages():
+            labeled = [image for image in images if image['label_path']]
+            labels = load_labels('', [image['label_path'] for image in labeled])
+            counts = np.bincount(labels.file_index, minlength=len(labeled))
+            ends = np.cumsum(counts)
+            ranges = {id(image): (end - count, end) for image, count, end in zip(labeled, counts, ends)}
+
+            for image in images:
+                start, end = ranges.get(id(image), (0, 0))
+                yield _fields(image), labels.class_ids[start:end], labels.boxes[start:end]
+
+    def _from_split_labels(self):
+        splits = {}
+        for images in self._pages():
+            for image in images:
+                if image['split'] not in splits:
+                    splits[image['split']] = self.split_labels(image['split'])
+                labels = splits[image['split']]
+                if image['label_path']:
+                    class_ids, boxes = labels.file_labels(os.path.basename(image['label_path']))
+                else:
+                    class_ids, boxes = labels.class_ids[:0], labels.boxes[:0]
+                yield _fields(image), class_ids, boxes
+
+
+def _fields(image):
+    fields = {key: image[key] for key in IMAGE_FIELDS}
+    # Size as displayed (EXIF orientation applied), which is what the boxes refer to
+    fields['width'], fields['height'] = oriented_size(image['width'], image['height'], image['orientation'])
+    return fields
+
+
+def encode_json(stream, header):
+    """Generate the JSON response body in chunks"""
+    yield json.dumps({'success': True, **header})[:-1].encode() + b', "images": ['
+    separator = b''
+    for fields, class_ids, boxes in stream:
+        item = {**fields, 'class_ids': class_ids.tolist(),
+                'boxes': np.round(boxes.astype(np.float64).ravel(), JSON_DECIMALS).tolist()}
+        yield separator + json.dumps(item).encode()
+        separator = b', '
+    yield b'], "next_cursor": ' + json.dumps(stream.next_cursor).encode() + b'}'
+
+
+def _block(obj):
+    data = json.dumps(obj).encode()
+    return struct.pack('<I', len(data)) + data + b'\0' * (-len(data) % 4)
+
+
+def encode_binary(stream, header, chunk_bytes=1024 * 1024):
+    """Generate the binary response body, in chunks of about chunk_bytes"""
+    chunk = [BINARY_MAGIC, _block(header)]
+    size = 0
+    for fields, class_ids, boxes in stream:
+        parts = (_block(fields), struct.pack('<I', len(class_ids)),
+                 class_ids.astype('<i4').tobytes(), boxes.astype('<f4').tobytes())
+        chunk.extend(parts)
+        size += sum(len(part) for part in parts)
+        if size >= chunk_bytes:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+    chunk.extend((struct.pack('<I', 0), _block({'next_cursor': stream.next_cursor})))
+    yield b''.join(chunk)
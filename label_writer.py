@@ -0,0 +1,154 @@
+"""
+Write-behind persistence of edited labels.
+
+save() records the new contents of a label file and returns right away; a
+background thread writes the pending files in batches, flush_interval
+seconds after the first save of a batch. Saves of the same file within that
+window are coalesced into one write. A batch is written to temporary files,
+each fsynced, then renamed over the label files, so a label file is always
+either the previous or the new version, never a partial one.
+
+Until its batch is on disk, pending() returns a file's saved contents, so
+readers see edits immediately.
+"""
+
+import os
+import threading
+import time
+
+FLUSH_INTERVAL = 0.5  # seconds edits are collected before a batch is written
+TMP_SUFFIX = '.tmp'  # not a label extension, so the scanner and watcher ignore temp files
+
+
+class LabelWriter:
+    """Queue of label file writes flushed in batches by a background thread"""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, on_flushed=None):
+        self.flush_interval = flush_interval
+        # on_flushed(entries) is called after a batch is on disk, with the
+        # metadata passed to save() for every written file
+        self.on_flushed = on_flushed
+        self.stats = {'saves': 0, 'coalesced': 0, 'writes': 0, 'batches': 0, 'errors': 0}
+        self._pending = {}  # label path -> (text, metadata), waiting for the next batch
+        self._flushing = {}  # same, for the batch being written
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def save(self, label_path, text, **metadata):
+        """Queue the new contents of a label file; returns the number of files waiting to be written"""
+        label_path = os.path.abspath(label_path)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Label writer is closed')
+            self.stats['saves'] += 1
+            if label_path in self._pending:
+                self.stats['coalesced'] += 1
+            self._pending[label_path] = (text, metadata)
+            pending = len(self._pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='label-writer', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return pending
+
+    def pending(self, label_path):
+        """Saved contents of a label file not yet on disk, or None"""
+        label_path = os.path.abspath(label_path)
+        with self._lock:
+            entry = self._pending.get(label_path) or self._flushing.get(label_path)
+        return entry[0] if entry else None
+
+    def error_count(self):
+        """Failed writes so far; compare before and after a flush to see whether it failed"""
+        with self._lock:
+            return self.stats['errors']
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            if self._closed:
+                return
+            time.sleep(self.flush_interval)  # let more edits arrive (and coalesce)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing label writes: {e}")
+
+    def flush(self):
+        """Write all pending label files now; returns the number written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+            if not batch:
+                return 0
+            try:
+                written = self._write_batch(batch)
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+        if self.on_flushed and written:
+            try:
+                self.on_flushed([batch[path][1] for path in written])
+            except Exception as e:
+                print(f"Error after writing labels: {e}")
+        return len(written)
+
+    def _write_batch(self, batch):
+        tmp_files = {}
+        errors = 0
+        for label_path, (text, _) in batch.items():
+            tmp_file = label_path + TMP_SUFFIX
+            try:
+                os.makedirs(os.path.dirname(label_path), exist_ok=True)
+                with open(tmp_file, 'w', newline='\n') as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                tmp_files[label_path] = tmp_file
+            except OSError as e:
+                print(f"Error writing label file {label_path}: {e}")
+                errors += 1
+
+        written = []
+        for label_path, tmp_file in tmp_files.items():
+            try:
+                os.replace(tmp_file, label_path)
+                written.append(label_path)
+            except OSError as e:
+                print(f"Error replacing label file {label_path}: {e}")
+                errors += 1
+        # Make the renames durable too
+        _sync_directories({os.path.dirname(path) for path in written})
+
+        with self._lock:
+            self.stats['errors'] += errors
+            self.stats['writes'] += len(written)
+            self.stats['batches'] += 1
+        return written
+
+    def close(self):
+        """Write whatever is pending and stop the background thread (called at exit)"""
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        self.flush()
+
+
+def _sync_directories(directories):
+    if os.name != 'posix':
+        return
+    for directory in directories:
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"Error syncing directory {directory}: {e}")
@@ -0,0 +1,98 @@
+"""
+Compact storage for large sorted file name listings.
+
+A split with a million images would otherwise keep a million str objects
+(plus a list of pointers to them) in every dataset_info. ImageNameList packs
+the names into one UTF-8 buffer with an array of 64-bit offsets, which takes
+roughly the size of the names themselves, and answers membership tests with
+a binary search.
+"""
+
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+
+def _encode(name):
+    return name.encode('utf-8', 'surrogateescape')
+
+
+def _decode(data):
+    return data.decode('utf-8', 'surrogateescape')
+
+
+class ImageNameList:
+    """Immutable, sorted sequence of file names backed by a single bytes buffer"""
+
+    __slots__ = ('_data', '_offsets')
+
+    def __init__(self, names=()):
+        encoded = sorted(_encode(name) for name in names)  # UTF-8 byte order == code point order
+        self._data = b''.join(encoded)
+        self._offsets = array('q', accumulate((len(e) for e in encoded), initial=0))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _raw(self, i):
+        return self._data[self._offsets[i]:self._offsets[i + 1]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [_decode(self._raw(j)) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('ImageNameList index out of range')
+        return _decode(self._raw(i))
+
+    def __iter__(self):
+        data, offsets = self._data, self._offsets
+        for start, end in zip(offsets, offsets[1:]):
+            yield _decode(data[start:end])
+
+    def _search(self, key):
+        return bisect_left(range(len(self)), key, key=self._raw)
+
+    def __contains__(self, name):
+        if not isinstance(name, str):
+            return False
+        key = _encode(name)
+        i = self._search(key)
+        return i < len(self) and self._raw(i) == key
+
+    def index(self, name):
+        key = _encode(name)
+        i = self._search(key)
+        if i < len(self) and self._raw(i) == key:
+            return i
+        raise ValueError(f"{name!r} is not in list")
+
+    def with_changes(self, added=(), removed=()):
+        """New list with names added and removed"""
+        names = set(self)
+        names.update(added)
+        names.difference_update(removed)
+        return ImageNameList(names)
+
+    @property
+    def nbytes(self):
+        return len(self._data) + self._offsets.itemsize * len(self._offsets)
+
+    def __eq__(self, other):
+        if isinstance(other, ImageNameList):
+            return self._data == other._data and self._offsets == other._offsets
+        if isinstance(other, (list, tuple)):
+            return len(other) == len(self) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self._data, self._offsets
+
+    def __setstate__(self, state):
+        self._data, self._offsets = state
+
+    def __repr__(self):
+        return f'ImageNameList({len(self)} names, {self.nbytes} bytes)'
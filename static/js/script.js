@@ -23,6 +23,15 @@
   let currentDataset = null;
   let currentSplit = null;
 
+  // Dataset paging state: images are listed page by page and their blobs/labels fetched on demand
+  const DATASET_PAGE_SIZE = 100;
+  const PREFETCH_THRESHOLD = 10; // Fetch the next page when this close to the end of the loaded list
+  const LOADED_IMAGE_WINDOW = 20; // Object URLs kept around the current image
+  let datasetPaging = { cursor: null, total: 0, loading: false, done: true, filterLabeled: "", prefix: "" };
+
+  // Dataset images are saved to the server shortly after each edit (the server batches the disk writes)
+  const ANNOTATION_SAVE_DELAY_MS = 300;
+
   // Interaction State
   let currentTool = "draw"; // 'draw' or 'edit'
   let isDrawing = false;
@@ -61,8 +70,13 @@
   const datasetSelect = document.getElementById("dataset-select");
   const splitSelect = document.getElementById("split-select");
   const loadDatasetBtn = document.getElementById("load-dataset-btn");
+  const labeledFilterSelect = document.getElementById("labeled-filter-select");
+  const namePrefixInput = document.getElementById("name-prefix-input");
+  const classFilterSelect = document.getElementById("class-filter-select");
   const saveBtn = document.getElementById("save-btn"); // Export JSON
   const exportYoloBtn = document.getElementById("export-yolo-btn");
+  const exportVocBtn = document.getElementById("export-voc-btn");
+  const exportImagesCheckbox = document.getElementById("export-images-checkbox");
   const drawBoxBtn = document.getElementById("draw-box-btn");
   const editBoxBtn = document.getElementById("edit-box-btn");
   const addLabelBtn = document.getElementById("add-label-btn");
@@ -126,6 +140,7 @@
   });
   saveBtn.addEventListener("click", saveJsonAnnotations); // Export JSON
   exportYoloBtn.addEventListener("click", exportYoloAnnotations);
+  exportVocBtn.addEventListener("click", () => exportDataset("voc"));
   deleteImageBtn.addEventListener("click", deleteCurrentImage);
 
   // Model Button Listeners
@@ -138,12 +153,12 @@
   document.addEventListener("keydown", handleKeyDown);
 
   // --- Dataset Management Functions ---
-  async function loadAvailableDatasets() {
+  async function loadAvailableDatasets(useInitialConfig = true) {
     try {
       console.log('Loading available datasets...');
       
-      // First, try to use datasets passed from backend on page load
-      if (window.LAIBEL_CONFIG && window.LAIBEL_CONFIG.datasets) {
+      // First, try to use the dataset summaries passed from backend on page load
+      if (useInitialConfig && window.LAIBEL_CONFIG && window.LAIBEL_CONFIG.datasets) {
         console.log('Using datasets from initial page load:', window.LAIBEL_CONFIG.datasets);
         availableDatasets = window.LAIBEL_CONFIG.datasets;
         updateDatasetSelect();
@@ -180,11 +195,47 @@
     }
   }
 
+  // Poll indexing progress while the server is still analyzing datasets,
+  // reloading the dropdown whenever more datasets become available
+  const INDEX_STATUS_POLL_MS = 1500;
+  let indexingStatus = null;
+  let indexedGeneration = null;
+
+  async function watchIndexingProgress() {
+    try {
+      const response = await fetch('/api/datasets/status');
+      if (!response.ok) return;
+      const status = await response.json();
+      const wasRunning = indexingStatus && indexingStatus.running;
+      indexingStatus = status;
+      if (indexedGeneration !== null && status.generation !== indexedGeneration) {
+        await loadAvailableDatasets(false);
+      } else if (status.running || wasRunning) {
+        updateDatasetSelect(); // Refresh the progress line
+      }
+      indexedGeneration = status.generation;
+      if (status.running) {
+        setTimeout(watchIndexingProgress, INDEX_STATUS_POLL_MS);
+      }
+    } catch (error) {
+      console.error('Error fetching indexing status:', error);
+    }
+  }
+
   function updateDatasetSelect() {
     console.log('Updating dataset dropdown with', availableDatasets.length, 'datasets');
     
+    const selectedName = datasetSelect.value;
     datasetSelect.innerHTML = '<option value="">Select a dataset...</option>';
     
+    if (indexingStatus && indexingStatus.running) {
+      const indexingOption = document.createElement('option');
+      indexingOption.value = '';
+      indexingOption.textContent = `Indexing datasets... (${indexingStatus.datasets_done}/${indexingStatus.datasets_total})`;
+      indexingOption.disabled = true;
+      datasetSelect.appendChild(indexingOption);
+    }
+    
     if (availableDatasets.length === 0) {
       const noDatasetOption = document.createElement('option');
       noDatasetOption.value = '';
@@ -202,10 +253,26 @@
       option.textContent = `${dataset.name} (${dataset.total_images} images, ${dataset.classes.length} classes)`;
       datasetSelect.appendChild(option);
     });
+    if (selectedName) {
+      datasetSelect.value = selectedName;
+    }
     
     console.log('Dataset dropdown updated successfully');
   }
 
+  function updateClassFilterSelect() {
+    if (!classFilterSelect) return;
+    classFilterSelect.innerHTML = '<option value="">Any class</option>';
+    if (currentDataset && currentDataset.classes) {
+      currentDataset.classes.forEach((className, classId) => {
+        const option = document.createElement('option');
+        option.value = classId;
+        option.textContent = `Contains: ${className}`;
+        classFilterSelect.appendChild(option);
+      });
+    }
+  }
+
   function updateSplitSelect() {
     splitSelect.innerHTML = '<option value="">All splits</option>';
     
@@ -245,7 +312,7 @@
 
       if (result.success) {
         alert(`Dataset uploaded successfully: ${result.message}`);
-        await loadAvailableDatasets();
+        await loadAvailableDatasets(false);
         
         datasetSelect.value = result.dataset.name;
         handleDatasetChange();
@@ -268,6 +335,7 @@
     currentSplit = null;
     
     updateSplitSelect();
+    updateClassFilterSelect();
     updateNavigationUI();
 
     if (currentDataset && currentDataset.classes.length > 0) {
@@ -302,125 +370,33 @@
       loadDatasetBtn.disabled = true;
       loadDatasetBtn.textContent = 'Loading...';
 
-      const url = `/api/datasets/${currentDataset.name}/images${currentSplit ? `?split=${currentSplit}` : ''}`;
-      console.log('Fetching dataset images from:', url);
-      
-      const response = await fetch(url);
-      const data = await response.json();
-
-      if (data.success) {
-        // Clear existing images
-        imageData = [];
-        currentImageIndex = -1;
-        clearCanvasAndState();
-
-        console.log(`Processing ${data.images.length} images from dataset`);
-
-        // Process dataset images
-        const imagePromises = data.images.map(async (imgInfo) => {
-          try {
-            console.log(`Loading image: ${imgInfo.name} from ${imgInfo.image_path}`);
-            
-            // Load image using the correct path
-            const imageUrl = `/api/datasets/${currentDataset.name}/image/${encodeURIComponent(imgInfo.image_path)}`;
-            console.log(`Fetching image from: ${imageUrl}`);
-            
-            const imageResponse = await fetch(imageUrl);
-            if (!imageResponse.ok) {
-              console.error(`Failed to fetch image ${imgInfo.name}: ${imageResponse.status} ${imageResponse.statusText}`);
-              throw new Error('Failed to load image');
-            }
-            
-            const imageBlob = await imageResponse.blob();
-            console.log(`Image blob size: ${imageBlob.size} bytes, type: ${imageBlob.type}`);
-            
-            const imageObjectUrl = URL.createObjectURL(imageBlob);
-            console.log(`Created object URL: ${imageObjectUrl}`);
-            
-            // Load labels
-            const labelsResponse = await fetch(`/api/datasets/${currentDataset.name}/labels/${encodeURIComponent(imgInfo.name)}`);
-            const labelsData = labelsResponse.ok ? await labelsResponse.json() : { boxes: [] };
-            
-            return new Promise((resolve, reject) => {
-              const img = new Image();
-              
-              img.onload = function() {
-                console.log(`Image loaded successfully: ${imgInfo.name}, size: ${img.width}x${img.height}`);
-                
-                let currentScaleRatio = 1;
-                const currentOriginalWidth = img.width;
-                const currentOriginalHeight = img.height;
-
-                if (currentOriginalWidth > MAX_WIDTH || currentOriginalHeight > MAX_HEIGHT) {
-                  const widthRatio = MAX_WIDTH / currentOriginalWidth;
-                  const heightRatio = MAX_HEIGHT / currentOriginalHeight;
-                  currentScaleRatio = Math.min(widthRatio, heightRatio);
-                }
-
-                console.log(`Scale ratio: ${currentScaleRatio}`);
-
-                // Convert YOLO boxes to canvas coordinates
-                const canvasBoxes = labelsData.boxes ? labelsData.boxes.map(box => ({
-                  x: box.x * currentScaleRatio,
-                  y: box.y * currentScaleRatio,
-                  width: box.width * currentScaleRatio,
-                  height: box.height * currentScaleRatio,
-                  label: box.label
-                })) : [];
-
-                const data = {
-                  src: imageObjectUrl, // Use the object URL
-                  filename: imgInfo.name,
-                  originalWidth: currentOriginalWidth,
-                  originalHeight: currentOriginalHeight,
-                  scaleRatio: currentScaleRatio,
-                  boxes: canvasBoxes,
-                  dataset: imgInfo.dataset,
-                  split: imgInfo.split
-                };
-                
-                console.log(`Image data prepared:`, data);
-                resolve(data);
-              };
-              
-              img.onerror = (error) => {
-                console.error(`Failed to load image object for ${imgInfo.name}:`, error);
-                console.error(`Image src was: ${imageObjectUrl}`);
-                reject(new Error(`Failed to load image: ${imgInfo.name}`));
-              };
-              
-              console.log(`Setting image src to: ${imageObjectUrl}`);
-              img.src = imageObjectUrl;
-            });
-          } catch (error) {
-            console.error(`Error processing image ${imgInfo.name}:`, error);
-            return null;
-          }
-        });
-
-        const results = await Promise.allSettled(imagePromises);
-        const validImages = results
-          .filter(result => result.status === 'fulfilled' && result.value)
-          .map(result => result.value);
-
-        console.log(`Processed ${validImages.length} valid images out of ${data.images.length} total`);
-        imageData = validImages;
+      // Clear existing images and start paging from the beginning
+      imageData.forEach(releaseImageSource);
+      imageData = [];
+      currentImageIndex = -1;
+      clearCanvasAndState();
+      datasetPaging = {
+        cursor: null,
+        total: 0,
+        loading: false,
+        done: false,
+        filterLabeled: labeledFilterSelect ? labeledFilterSelect.value : "",
+        prefix: namePrefixInput ? namePrefixInput.value.trim() : "",
+        classId: classFilterSelect ? classFilterSelect.value : "",
+      };
 
-        if (imageData.length > 0) {
-          console.log('Loading first image...');
-          loadImageData(0);
-          alert(`Loaded ${imageData.length} images from dataset "${currentDataset.name}"`);
-        } else {
-          alert('No valid images found in the selected dataset.');
-        }
+      const added = await fetchNextDatasetPage();
 
+      if (added > 0) {
+        console.log('Loading first image...');
+        loadImageData(0);
+        console.log(`Loaded first page of dataset "${currentDataset.name}" (${datasetPaging.total} images in total)`);
       } else {
-        console.error('Dataset loading failed:', data.error);
-        alert(`Failed to load dataset: ${data.error}`);
+        alert('No valid images found in the selected dataset.');
       }
     } catch (error) {
       console.error('Error loading dataset:', error);
-      alert('Failed to load dataset. Please try again.');
+      alert(`Failed to load dataset: ${error.message}`);
     } finally {
       loadDatasetBtn.disabled = false;
       loadDatasetBtn.textContent = 'Load Dataset';
@@ -428,6 +404,213 @@
     }
   }
 
+  // Fetch the next page of image entries (metadata only). Returns the number of entries added.
+  async function fetchNextDatasetPage() {
+    if (!currentDataset || datasetPaging.loading || datasetPaging.done) return 0;
+    datasetPaging.loading = true;
+
+    try {
+      const params = new URLSearchParams({ limit: DATASET_PAGE_SIZE });
+      if (currentSplit) params.set('split', currentSplit);
+      if (datasetPaging.cursor) params.set('after', datasetPaging.cursor);
+      if (datasetPaging.filterLabeled) params.set('labeled', datasetPaging.filterLabeled);
+      if (datasetPaging.prefix) params.set('prefix', datasetPaging.prefix);
+      if (datasetPaging.classId !== "") params.set('class', datasetPaging.classId);
+      // Image entries and their labels come in one binary response per page
+      params.set('format', 'binary');
+
+      const url = `/api/datasets/${encodeURIComponent(currentDataset.name)}/labels?${params}`;
+      console.log('Fetching dataset image page from:', url);
+
+      const response = await fetch(url);
+      if (!response.ok) {
+        const error = await response.json().catch(() => ({}));
+        throw new Error(error.error || `HTTP ${response.status}`);
+      }
+      const data = decodeLabelBatch(await response.arrayBuffer());
+
+      if (data.total !== undefined) {
+        datasetPaging.total = data.total;
+      }
+      datasetPaging.cursor = data.next_cursor;
+      datasetPaging.done = !data.next_cursor;
+
+      data.images.forEach((imgInfo) => {
+        imageData.push({
+          src: null,
+          filename: imgInfo.name,
+          imagePath: imgInfo.image_path,
+          originalWidth: 0,
+          originalHeight: 0,
+          scaleRatio: 1,
+          boxes: [],
+          labelsLoaded: false,
+          bulkLabels: { classIds: imgInfo.classIds, boxes: imgInfo.boxes, classes: data.classes },
+          version: imgInfo.version || 0,
+          dataset: imgInfo.dataset,
+          split: imgInfo.split
+        });
+      });
+
+      console.log(`Added ${data.images.length} image entries (${imageData.length}/${datasetPaging.total} listed)`);
+      return data.images.length;
+    } finally {
+      datasetPaging.loading = false;
+      updateNavigationUI();
+    }
+  }
+
+  // Parse a binary response of the bulk labels endpoint (layout documented in label_bulk.py)
+  function decodeLabelBatch(buffer) {
+    const view = new DataView(buffer);
+    const decoder = new TextDecoder();
+    let offset = 0;
+    const readJson = () => {
+      const length = view.getUint32(offset, true);
+      const value = JSON.parse(decoder.decode(new Uint8Array(buffer, offset + 4, length)));
+      offset += 4 + length + ((4 - (length % 4)) % 4);
+      return value;
+    };
+
+    if (decoder.decode(new Uint8Array(buffer, 0, 4)) !== 'LBL1') {
+      throw new Error('Unexpected label data format');
+    }
+    offset = 4;
+    const header = readJson();
+    const images = [];
+    while (view.getUint32(offset, true) !== 0) {
+      const image = readJson();
+      const count = view.getUint32(offset, true);
+      offset += 4;
+      // Views into the response buffer, no copies
+      image.classIds = new Int32Array(buffer, offset, count);
+      offset += count * 4;
+      image.boxes = new Float32Array(buffer, offset, count * 4);
+      offset += count * 16;
+      images.push(image);
+    }
+    offset += 4;
+    const trailer = readJson();
+    return { ...header, images, next_cursor: trailer.next_cursor };
+  }
+
+  // YOLO boxes from the bulk labels endpoint in image pixels, clamped like parse_yolo_label()
+  function bulkLabelsToBoxes(bulkLabels, imageWidth, imageHeight) {
+    const { classIds, boxes, classes } = bulkLabels;
+    const result = [];
+    for (let i = 0; i < classIds.length; i++) {
+      const [xCenter, yCenter, width, height] = boxes.subarray(i * 4, i * 4 + 4);
+      const x = (xCenter - width / 2) * imageWidth;
+      const y = (yCenter - height / 2) * imageHeight;
+      const classId = classIds[i];
+      result.push({
+        x: Math.max(0, x),
+        y: Math.max(0, y),
+        width: Math.min(width * imageWidth, imageWidth - x),
+        height: Math.min(height * imageHeight, imageHeight - y),
+        label: classId < classes.length ? classes[classId] : `class_${classId}`
+      });
+    }
+    return result;
+  }
+
+  // Download the display-sized image blob (and, the first time, its labels) for a dataset entry.
+  // The server scales the image down to MAX_WIDTH x MAX_HEIGHT and reports the original's size,
+  // which boxes are converted from and saved in.
+  async function ensureImageLoaded(entry) {
+    if (entry.src || !entry.imagePath) return entry;
+    if (entry.loadingPromise) return entry.loadingPromise;
+
+    entry.loadingPromise = (async () => {
+      const datasetName = encodeURIComponent(entry.dataset);
+      const imageUrl = `/api/datasets/${datasetName}/image/${encodeURIComponent(entry.imagePath)}?size=display`;
+      const imageResponse = await fetch(imageUrl);
+      if (!imageResponse.ok) {
+        throw new Error(`Failed to fetch image ${entry.filename}: ${imageResponse.status} ${imageResponse.statusText}`);
+      }
+      const headerWidth = parseInt(imageResponse.headers.get('X-Original-Width'), 10);
+      const headerHeight = parseInt(imageResponse.headers.get('X-Original-Height'), 10);
+      const imageObjectUrl = URL.createObjectURL(await imageResponse.blob());
+
+      const labelsData = entry.labelsLoaded || entry.bulkLabels
+        ? null
+        : await fetch(`/api/datasets/${datasetName}/labels/${encodeURIComponent(entry.filename)}`)
+            .then(r => (r.ok ? r.json() : { boxes: [] }))
+            .catch(() => ({ boxes: [] }));
+
+      const img = await new Promise((resolve, reject) => {
+        const img = new Image();
+        img.onload = () => resolve(img);
+        img.onerror = () => reject(new Error(`Failed to load image: ${entry.filename}`));
+        img.src = imageObjectUrl;
+      });
+
+      // Without the headers (size unreadable on the server) the response is the original
+      const imageWidth = headerWidth > 0 && headerHeight > 0 ? headerWidth : img.width;
+      const imageHeight = headerWidth > 0 && headerHeight > 0 ? headerHeight : img.height;
+      let currentScaleRatio = 1;
+      if (imageWidth > MAX_WIDTH || imageHeight > MAX_HEIGHT) {
+        currentScaleRatio = Math.min(MAX_WIDTH / imageWidth, MAX_HEIGHT / imageHeight);
+      }
+
+      entry.src = imageObjectUrl;
+      entry.originalWidth = imageWidth;
+      entry.originalHeight = imageHeight;
+      entry.scaleRatio = currentScaleRatio;
+
+      const pixelBoxes = entry.labelsLoaded ? null
+        : entry.bulkLabels ? bulkLabelsToBoxes(entry.bulkLabels, imageWidth, imageHeight)
+        : (labelsData.boxes || []);
+      if (pixelBoxes) {
+        // Convert YOLO boxes to canvas coordinates (edits made later are kept across reloads)
+        entry.boxes = pixelBoxes.map(box => ({
+          x: box.x * currentScaleRatio,
+          y: box.y * currentScaleRatio,
+          width: box.width * currentScaleRatio,
+          height: box.height * currentScaleRatio,
+          label: box.label
+        }));
+        setSyncedBoxes(entry, labelsData ? labelsData.version || 0 : entry.version || 0);
+        entry.labelsLoaded = true;
+        entry.bulkLabels = null;
+      }
+      return entry;
+    })();
+
+    try {
+      return await entry.loadingPromise;
+    } finally {
+      entry.loadingPromise = null;
+    }
+  }
+
+  // Free object URLs of dataset images far away from the current one
+  function releaseDistantImages() {
+    imageData.forEach((entry, index) => {
+      if (Math.abs(index - currentImageIndex) > LOADED_IMAGE_WINDOW) {
+        releaseImageSource(entry);
+      }
+    });
+  }
+
+  function releaseImageSource(entry) {
+    if (entry.imagePath && entry.src) {
+      URL.revokeObjectURL(entry.src);
+      entry.src = null;
+    }
+  }
+
+  // Keep the list ahead of the user and warm up the next image
+  function prefetchAround(index) {
+    if (!datasetPaging.done && imageData.length - index <= PREFETCH_THRESHOLD) {
+      fetchNextDatasetPage().catch(error => console.error('Error fetching next page:', error));
+    }
+    const next = imageData[index + 1];
+    if (next && next.imagePath && !next.src) {
+      ensureImageLoaded(next).catch(error => console.error('Error prefetching image:', error));
+    }
+  }
+
   // --- Tool Switching and State Reset ---
   function switchTool(tool) {
     currentTool = tool;
@@ -461,7 +644,9 @@
     const files = e.target.files;
     if (!files || files.length === 0) return;
 
+    imageData.forEach(releaseImageSource);
     imageData = [];
+    datasetPaging = { cursor: null, total: 0, loading: false, done: true, filterLabeled: "", prefix: "" };
     currentImageIndex = -1;
     clearCanvasAndState();
 
@@ -538,10 +723,27 @@
       return;
     }
 
+    const data = imageData[index];
+
+    // Dataset entries are fetched lazily the first time they're shown
+    if (data.imagePath && !data.src) {
+      imageInfoSpan.textContent = `Loading ${data.filename}...`;
+      ensureImageLoaded(data)
+        .then(() => loadImageData(index))
+        .catch((error) => {
+          console.error(`Error loading dataset image ${data.filename}:`, error);
+          alert(`Error loading image: ${data.filename}.`);
+        });
+      return;
+    }
+
     currentImageIndex = index;
-    const data = imageData[currentImageIndex];
 
     console.log(`Loading image data for index ${index}:`, data);
+    if (data.imagePath) {
+      releaseDistantImages();
+      prefetchAround(index);
+    }
 
     // Update global state from the selected image's data
     originalWidth = data.originalWidth;
@@ -664,7 +866,8 @@
       const displayFilename = imageData[currentImageIndex].filename.length > 25
         ? imageData[currentImageIndex].filename.substring(0, 22) + "..."
         : imageData[currentImageIndex].filename;
-      let infoText = `${currentImageIndex + 1} / ${imageData.length} (${displayFilename})`;
+      const totalImages = Math.max(imageData.length, datasetPaging.total || 0);
+      let infoText = `${currentImageIndex + 1} / ${totalImages} (${displayFilename})`;
       
       const currentImg = imageData[currentImageIndex];
       if (currentImg.dataset && currentImg.split) {
@@ -895,6 +1098,7 @@
         };
         imageData[currentImageIndex].boxes.push(newBox);
         updateAnnotationsList();
+        scheduleAnnotationSave(imageData[currentImageIndex]);
       } else {
         console.log("Box too small or no image, not added.");
       }
@@ -927,6 +1131,7 @@
       resetEditState();
       redrawCanvas();
       updateAnnotationsList();
+      scheduleAnnotationSave(imageData[currentImageIndex]);
       canvas.style.cursor = "default";
     }
   }
@@ -966,6 +1171,7 @@
       resetEditState();
       redrawCanvas();
       updateAnnotationsList();
+      scheduleAnnotationSave(imageData[currentImageIndex]);
       canvas.style.cursor = "default";
     } else if (currentTool === "edit") {
       canvas.style.cursor = "default";
@@ -1263,6 +1469,7 @@
         imageData[currentImageIndex].boxes[index].label = newLabel;
         console.log(`Box ${index} label changed to: ${newLabel}`);
         redrawCanvas(); // Redraw canvas to show new label color/text
+        scheduleAnnotationSave(imageData[currentImageIndex]);
       };
 
       const deleteBtn = document.createElement("button");
@@ -1300,6 +1507,158 @@
 
     updateAnnotationsList(); // Update the sidebar
     redrawCanvas(); // Redraw the canvas without the deleted box
+    scheduleAnnotationSave(imageData[currentImageIndex]);
+  }
+
+  // --- Saving Dataset Annotations ---
+  // Only deltas are sent: every box remembers its index in the server's box list (serverIndex), and
+  // entry.syncedBoxes holds the boxes as the server has them at entry.version.
+  function boxSnapshot(box) {
+    return { x: box.x, y: box.y, width: box.width, height: box.height, label: box.label };
+  }
+
+  // Canvas coordinates back to image pixels
+  function toImagePixels(box, scale) {
+    return {
+      x: box.x / scale,
+      y: box.y / scale,
+      width: box.width / scale,
+      height: box.height / scale,
+      label: box.label
+    };
+  }
+
+  // Mark an entry's boxes as what the server has at `version`
+  function setSyncedBoxes(entry, version) {
+    entry.boxes.forEach((box, index) => {
+      box.serverIndex = index;
+    });
+    entry.syncedBoxes = entry.boxes.map(boxSnapshot);
+    entry.version = version;
+  }
+
+  // Added, changed and removed boxes since the last sync; kept boxes are in server order
+  function annotationDelta(entry) {
+    const synced = entry.syncedBoxes || [];
+    const kept = [];
+    const added = [];
+    const changed = [];
+    const seen = new Set();
+    entry.boxes.forEach(box => {
+      const index = box.serverIndex;
+      if (index === undefined || index >= synced.length || seen.has(index)) {
+        added.push(box);
+        return;
+      }
+      seen.add(index);
+      kept.push(box);
+      const before = synced[index];
+      if (box.x !== before.x || box.y !== before.y || box.width !== before.width ||
+          box.height !== before.height || box.label !== before.label) {
+        changed.push(box);
+      }
+    });
+    const removed = [];
+    for (let index = 0; index < synced.length; index++) {
+      if (!seen.has(index)) removed.push(index);
+    }
+    kept.sort((a, b) => a.serverIndex - b.serverIndex);
+    return { kept, added, changed, removed };
+  }
+
+  // Send an entry's changes to the server after a short pause, so a burst of edits becomes one request
+  function scheduleAnnotationSave(entry) {
+    if (!entry || !entry.dataset || !entry.labelsLoaded) return;
+    clearTimeout(entry.saveTimer);
+    entry.saveTimer = setTimeout(() => saveAnnotation(entry), ANNOTATION_SAVE_DELAY_MS);
+  }
+
+  async function saveAnnotation(entry) {
+    entry.saveTimer = null;
+    if (entry.saving) {
+      // One request per image at a time, so each one is based on the version the previous one returned
+      entry.saveAgain = true;
+      return;
+    }
+    const { kept, added, changed, removed } = annotationDelta(entry);
+    if (!added.length && !changed.length && !removed.length) return;
+
+    const scale = entry.scaleRatio || 1;
+    // The server's boxes once it accepts the delta: kept boxes in order, then the added ones
+    const sentBoxes = kept.concat(added);
+    const sentSnapshots = sentBoxes.map(boxSnapshot);
+    const payload = {
+      split: entry.split,
+      version: entry.version || 0,
+      width: entry.originalWidth,
+      height: entry.originalHeight,
+      added: added.map(box => toImagePixels(box, scale)),
+      changed: changed.map(box => ({ index: box.serverIndex, ...toImagePixels(box, scale) })),
+      removed
+    };
+    entry.saving = true;
+    try {
+      const url = `/api/datasets/${encodeURIComponent(entry.dataset)}/labels/${encodeURIComponent(entry.filename)}`;
+      const response = await fetch(url, {
+        method: 'PATCH',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
+      });
+      const data = await response.json();
+      if (data.success) {
+        sentBoxes.forEach((box, index) => {
+          box.serverIndex = index;
+        });
+        // Edits made while the request was out differ from these snapshots and go with the next delta
+        entry.syncedBoxes = sentSnapshots;
+        entry.version = data.version;
+      } else if (data.conflict) {
+        resolveAnnotationConflict(entry, data);
+      } else {
+        console.warn(`Annotations of ${entry.filename} not saved: ${data.error}`);
+      }
+    } catch (error) {
+      console.error(`Error saving annotations of ${entry.filename}:`, error);
+    } finally {
+      entry.saving = false;
+      if (entry.saveAgain) {
+        entry.saveAgain = false;
+        scheduleAnnotationSave(entry);
+      }
+    }
+  }
+
+  // The image was changed elsewhere (e.g. in another tab) since our last sync: let the user pick a side
+  function resolveAnnotationConflict(entry, data) {
+    const scale = entry.scaleRatio || 1;
+    const serverBoxes = data.boxes.map(box => ({
+      x: box.x * scale,
+      y: box.y * scale,
+      width: box.width * scale,
+      height: box.height * scale,
+      label: box.label
+    }));
+    const loadTheirs = confirm(
+      `The annotations of ${entry.filename} were changed elsewhere (another tab or user).\n` +
+      `OK: load that version and drop your changes here.\nCancel: keep your version and overwrite theirs.`
+    );
+    if (loadTheirs) {
+      entry.boxes.splice(0, entry.boxes.length, ...serverBoxes); // same array: 'boxes' may reference it
+      setSyncedBoxes(entry, data.version);
+      if (entry === imageData[currentImageIndex]) {
+        selectedBoxIndex = -1;
+        updateAnnotationsList();
+        redrawCanvas();
+      }
+      return;
+    }
+    // Base our boxes on their version: all of theirs are removed and ours added
+    entry.syncedBoxes = serverBoxes.map(boxSnapshot);
+    entry.version = data.version;
+    entry.boxes.forEach(box => {
+      delete box.serverIndex;
+    });
+    entry.saveAgain = true;
   }
 
   // --- Utilities ---
@@ -1384,13 +1743,27 @@
   }
 
   function saveJsonAnnotations() {
-    // Placeholder for JSON export
-    console.log('JSON export requested');
+    exportDataset("coco");
   }
 
   function exportYoloAnnotations() {
-    // Placeholder for YOLO export
-    console.log('YOLO export requested');
+    exportDataset("yolo");
+  }
+
+  // The server builds the archive and streams it, so the browser just downloads it
+  function exportDataset(format) {
+    if (!currentDataset) {
+      alert('Please select a dataset to export first.');
+      return;
+    }
+    const params = new URLSearchParams({ format });
+    if (currentSplit) params.set('split', currentSplit);
+    if (exportImagesCheckbox && exportImagesCheckbox.checked) params.set('images', 'true');
+    const link = document.createElement('a');
+    link.href = `/api/datasets/${encodeURIComponent(currentDataset.name)}/export?${params}`;
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
   }
 
   function deleteCurrentImage() {
@@ -1410,6 +1783,7 @@
     updateAnnotationsList();
     initializeModelButtons(); // Sets up initial button states based on config
     loadAvailableDatasets(); // Load available datasets
+    watchIndexingProgress(); // Pick up datasets still being indexed on the server
     switchTool("draw");
     redrawCanvas(); // Draw initial placeholder
     console.log("Initialization complete.");
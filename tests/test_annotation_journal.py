@@ -0,0 +1,179 @@
+import os
+import time
+
+import pytest
+
+import annotation_journal
+from annotation_journal import AnnotationJournal, AnnotationJournals, VersionConflict, diff_boxes, apply_op, read_label_boxes
+from label_writer import LabelWriter
+
+
+@pytest.fixture
+def label_writer():
+    writer = LabelWriter(flush_interval=0.01)
+    yield writer
+    writer.close()
+
+
+def label_path(tmp_path, split, image):
+    return str(tmp_path / 'labels' / split / (os.path.splitext(image)[0] + '.txt'))
+
+
+def open_journal(tmp_path, label_writer):
+    return AnnotationJournal(tmp_path / 'journal', 'ds', lambda split, image: label_path(tmp_path, split, image),
+                             label_writer)
+
+
+def write_label(tmp_path, split, stem, text):
+    path = tmp_path / 'labels' / split / f'{stem}.txt'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+def test_diff_boxes_applies_back():
+    old = [[0, 0.1, 0.1, 0.1, 0.1], [1, 0.2, 0.2, 0.2, 0.2], [2, 0.3, 0.3, 0.3, 0.3]]
+    new = [[0, 0.1, 0.1, 0.1, 0.1], [3, 0.25, 0.2, 0.2, 0.2]]
+    boxes = [list(box) for box in old]
+    for op in diff_boxes(old, new):
+        apply_op(boxes, op)
+    assert boxes == new
+
+
+def test_edits_are_replayed_after_reopening(tmp_path, label_writer):
+    write_label(tmp_path, 'train', 'a', '0 0.5 0.5 0.2 0.2\n')
+    journal = open_journal(tmp_path, label_writer)
+    version, boxes = journal.apply('train', 'a.jpg', [
+        {'op': 'add', 'class': 1, 'box': [0.1, 0.1, 0.05, 0.05]},
+        {'op': 'move', 'index': 0, 'box': [0.4, 0.4, 0.2, 0.2]},
+        {'op': 'relabel', 'index': 1, 'class': 2},
+    ])
+    assert boxes == [[0, 0.4, 0.4, 0.2, 0.2], [2, 0.1, 0.1, 0.05, 0.05]]
+    journal.sync()
+    journal._file.close()  # as after a crash: no compaction
+
+    reopened = open_journal(tmp_path, label_writer)
+    assert reopened.boxes('train', 'a.jpg') == (version, boxes)
+    assert [record['op'] for record in reopened.history('train', 'a.jpg')] == ['relabel', 'move', 'add']
+    assert reopened.boxes_at('train', 'a.jpg', version - 3) == [[0, 0.5, 0.5, 0.2, 0.2]]
+
+
+def test_torn_record_is_skipped(tmp_path, label_writer):
+    journal = open_journal(tmp_path, label_writer)
+    version, boxes = journal.apply('train', 'a.jpg', [{'op': 'add', 'class': 0, 'box': [0.5, 0.5, 0.1, 0.1]}])
+    journal.sync()
+    journal._file.write('{"seq": 99, "split": "train", "ima')  # crash mid-write
+    journal._file.close()
+
+    reopened = open_journal(tmp_path, label_writer)
+    assert reopened.boxes('train', 'a.jpg') == (version, boxes)
+    # New records go after the torn line and replay fine
+    version, boxes = reopened.apply('train', 'a.jpg', [{'op': 'delete', 'index': 0}])
+    reopened.sync()
+    reopened._file.close()
+    assert open_journal(tmp_path, label_writer).boxes('train', 'a.jpg') == (version, [])
+
+
+def test_compaction_writes_label_files(tmp_path, label_writer):
+    journal = open_journal(tmp_path, label_writer)
+    version, boxes = journal.replace('val', 'b.png', [[1, 0.25, 0.5, 0.125, 0.0625]])
+    assert journal.compact() == 1
+
+    label_path = tmp_path / 'labels' / 'val' / 'b.txt'
+    assert read_label_boxes(label_path) == boxes
+    assert journal.boxes('val', 'b.png') == (version, None)  # served from the label file again
+    assert journal.compact() == 0  # nothing new
+    journal.close()
+
+    reopened = open_journal(tmp_path, label_writer)
+    assert reopened.version('val', 'b.png') == version
+    assert reopened.boxes('val', 'b.png') == (version, None)
+
+
+def test_discard_removes_the_journal(tmp_path, label_writer):
+    journal = open_journal(tmp_path, label_writer)
+    journal.apply('train', 'a.jpg', [{'op': 'add', 'class': 0, 'box': [0.5, 0.5, 0.1, 0.1]}])
+    journal.discard()
+    assert not (tmp_path / 'journal').exists()
+    assert open_journal(tmp_path, label_writer).boxes('train', 'a.jpg') == (0, None)
+
+
+def test_failing_compaction_backs_off(tmp_path, label_writer):
+    splits = {'train'}
+
+    def split_label_path(split, image):
+        if split not in splits:
+            raise ValueError(f"Unknown split {split}")
+        return label_path(tmp_path, split, image)
+
+    journal = AnnotationJournal(tmp_path / 'journal', 'ds', split_label_path, label_writer)
+    journal.apply('train', 'a.jpg', [{'op': 'add', 'class': 0, 'box': [0.5, 0.5, 0.1, 0.1]}])
+    splits.clear()  # the split went away before the edit was compacted
+    journal.tail_started -= annotation_journal.COMPACT_AGE
+    assert journal.needs_compaction()
+
+    for failures in (1, 2):
+        with pytest.raises(ValueError):
+            journal.compact()
+        assert journal.failures == failures
+        assert not journal.needs_compaction()
+    assert journal.retry_at - time.time() > 3 * annotation_journal.COMPACT_AGE  # doubled after the second failure
+    assert journal.tail_records  # the edit is still journaled
+
+    splits.add('train')
+    assert journal.compact() == 1
+    assert journal.failures == 0 and journal.retry_at is None
+    assert read_label_boxes(label_path(tmp_path, 'train', 'a.jpg')) == [[0, 0.5, 0.5, 0.1, 0.1]]
+
+
+def test_drop_discards_the_open_journal(tmp_path, label_writer):
+    journals = AnnotationJournals(tmp_path / 'journal', lambda dataset, split, image: label_path(tmp_path, split, image),
+                                  label_writer)
+    journal = journals.get('ds')
+    journal.apply('train', 'a.jpg', [{'op': 'add', 'class': 0, 'box': [0.5, 0.5, 0.1, 0.1]}])
+    journals.drop('ds')
+    assert not (tmp_path / 'journal' / 'ds').exists()
+
+    # A request still holding the old journal can't write to it any more
+    with pytest.raises(ValueError):
+        journal.apply('train', 'a.jpg', [{'op': 'delete', 'index': 0}])
+    assert not (tmp_path / 'journal' / 'ds').exists()
+
+    # The replacing dataset starts with a fresh journal
+    assert journals.get('ds') is not journal
+    assert journals.get('ds').boxes('train', 'a.jpg') == (0, None)
+    journals.close()
+
+
+def test_patch_detects_conflicts(tmp_path, label_writer):
+    write_label(tmp_path, 'train', 'a', '0 0.5 0.5 0.2 0.2\n1 0.1 0.1 0.1 0.1\n')
+    journal = open_journal(tmp_path, label_writer)
+    assert journal.version('train', 'a.jpg') == 0
+
+    version, boxes = journal.patch('train', 'a.jpg', 0, added=[[2, 0.9, 0.9, 0.1, 0.1]],
+                                   changed={0: [3, 0.5, 0.5, 0.2, 0.2]}, removed=[1])
+    assert boxes == [[3, 0.5, 0.5, 0.2, 0.2], [2, 0.9, 0.9, 0.1, 0.1]]
+
+    # A second tab still at version 0
+    with pytest.raises(VersionConflict) as conflict:
+        journal.patch('train', 'a.jpg', 0, removed=[0])
+    assert conflict.value.version == version
+    assert journal.boxes('train', 'a.jpg') == (version, boxes)
+
+    with pytest.raises(ValueError):
+        journal.patch('train', 'a.jpg', version, changed={5: [0, 0.1, 0.1, 0.1, 0.1]})
+    with pytest.raises(ValueError):
+        journal.apply('train', 'a.jpg', [{'op': 'add', 'class': -1, 'box': [0.1, 0.1, 0.1, 0.1]}])
+    assert journal.version('train', 'a.jpg') == version
+
+
+def test_versions_survive_compaction_and_restart(tmp_path, label_writer):
+    journal = open_journal(tmp_path, label_writer)
+    version, _ = journal.patch('val', 'b.png', 0, added=[[1, 0.5, 0.5, 0.1, 0.1]])
+    journal.close()
+
+    reopened = open_journal(tmp_path, label_writer)
+    with pytest.raises(VersionConflict):
+        reopened.patch('val', 'b.png', 0, removed=[0])
+    version, boxes = reopened.patch('val', 'b.png', version, removed=[0])
+    assert boxes == [] and reopened.version('val', 'b.png') == version
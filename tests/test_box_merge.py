@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from box_merge import iou_matrix, match_boxes, merge_predictions
+
+
+def test_iou_matrix():
+    a = [[0, 0, 10, 10], [20, 20, 30, 30]]
+    b = [[0, 0, 10, 10], [5, 0, 15, 10], [100, 100, 100, 100]]
+    iou = iou_matrix(a, b)
+    assert iou.shape == (2, 3)
+    np.testing.assert_allclose(iou[0], [1.0, 50 / 150, 0.0])
+    np.testing.assert_allclose(iou[1], [0.0, 0.0, 0.0])  # including the zero-area box
+    assert iou_matrix(np.zeros((0, 4)), b).shape == (0, 3)
+
+
+def test_iou_matrix_matches_pairwise():
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(0, 100, (40, 2, 2))
+    boxes = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+    iou = iou_matrix(boxes[:15], boxes[15:])
+    for i, (ax0, ay0, ax1, ay1) in enumerate(boxes[:15]):
+        for j, (bx0, by0, bx1, by1) in enumerate(boxes[15:]):
+            inter = max(0, min(ax1, bx1) - max(ax0, bx0)) * max(0, min(ay1, by1) - max(ay0, by0))
+            union = (ax1 - ax0) * (ay1 - ay0) + (bx1 - bx0) * (by1 - by0) - inter
+            assert iou[i, j] == pytest.approx(inter / union)
+
+
+@pytest.mark.parametrize('assignment', ['greedy', 'hungarian'])
+def test_match_boxes_takes_each_box_once(assignment):
+    iou = np.array([[0.9, 0.6], [0.8, 0.1], [0.0, 0.4]])
+    rows, cols = match_boxes(iou, 0.5, assignment)
+    pairs = set(zip(rows.tolist(), cols.tolist()))
+    assert len({r for r, _ in pairs}) == len(pairs) == len({c for _, c in pairs})
+    assert all(iou[r, c] >= 0.5 for r, c in pairs)
+    if assignment == 'greedy':
+        assert pairs == {(0, 0)}  # row 1 loses column 0, column 1 is below threshold for it
+
+
+def test_merge_predictions():
+    existing = [[0, 0, 10, 10], [20, 20, 30, 30], [50, 50, 60, 60]]
+    existing_labels = ['cat', 'dog', 'cat']
+    predicted = [[0, 0, 10, 10],  # same box, same label: nothing to do
+                 [20.5, 20, 30.5, 30],  # dog, slightly off but aligned (IoU 0.9)
+                 [50, 50, 60, 63],  # loosely aligned cat
+                 [80, 80, 90, 90]]  # new object
+    predicted_labels = ['cat', 'dog', 'cat', 'bird']
+    new, corrections = merge_predictions(predicted, predicted_labels, existing, existing_labels, aligned_iou=0.85)
+    assert new == [3]
+    assert [(existing_index, prediction) for existing_index, prediction, _ in corrections] == [(2, 2)]
+
+
+def test_merge_predictions_flags_wrong_labels():
+    new, corrections = merge_predictions([[0, 0, 10, 10]], ['dog'], [[0, 0, 10, 10]], ['cat'])
+    assert new == []
+    assert corrections == [(0, 0, 1.0)]
+
+
+def test_merge_predictions_without_existing_boxes():
+    new, corrections = merge_predictions([[0, 0, 1, 1], [2, 2, 3, 3]], ['a', 'b'], np.zeros((0, 4)), [])
+    assert new == [0, 1] and corrections == []
+    with pytest.raises(ValueError):
+        merge_predictions([], [], [], [], assignment='random')
+
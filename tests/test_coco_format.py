@@ -0,0 +1,124 @@
+import io
+import json
+from pathlib import Path
+
+import pytest
+import yaml
+
+from coco_format import CocoWriter, convert_coco_dataset, coco_split_name, iter_coco
+import coco_format
+from dataset_analysis import analyze_dataset
+
+
+def write_coco(path, images, annotations, categories, compress=False):
+    buffer = io.BytesIO()
+    writer = CocoWriter(buffer, categories, info={'description': 'test'}, compress=compress)
+    writer.write_images(images[:1])
+    writer.write_images(images[1:])
+    first = writer.reserve_annotation_ids(len(annotations))
+    writer.write_annotations([dict(annotation, id=first + i) for i, annotation in enumerate(annotations)])
+    writer.close()
+    path.write_bytes(buffer.getvalue())
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_writer_output_reads_back(tmp_path, compress, monkeypatch):
+    monkeypatch.setattr(coco_format, 'READ_CHUNK', 7)  # values split across reads
+    images = [{'id': 10, 'file_name': 'a.jpg', 'width': 100, 'height': 50},
+              {'id': 11, 'file_name': 'b.jpg', 'width': 1e2, 'height': 200}]
+    annotations = [{'image_id': 10, 'category_id': 3, 'bbox': [10, 5, 20, 10.5]}]
+    path = tmp_path / ('annotations.json.gz' if compress else 'annotations.json')
+    write_coco(path, images, annotations, [{'id': 3, 'name': 'cat'}], compress)
+
+    items = list(iter_coco(path))
+    assert [item for section, item in items if section == 'images' and item] == images
+    assert [item for section, item in items if section == 'annotations' and item] == [dict(annotations[0], id=1)]
+    assert ('categories', None) in items
+    if not compress:
+        assert json.loads(path.read_text())['info'] == {'description': 'test'}
+
+
+def test_writer_rejects_images_after_annotations():
+    writer = CocoWriter(io.BytesIO(), [])
+    writer.write_annotations([])
+    with pytest.raises(ValueError):
+        writer.write_images([{'id': 1}])
+
+
+def test_iter_coco_empty_and_other_keys(tmp_path):
+    path = tmp_path / 'a.json'
+    path.write_text('{"info": {"x": [1, 2]}, "images": [], "extra": "v"}')
+    assert list(iter_coco(path)) == [('images', None)]
+    path.write_text('{}')
+    assert list(iter_coco(path)) == []
+
+
+def test_split_names():
+    assert coco_split_name(Path('coco/annotations/instances_val2017.json')) == 'val'
+    assert coco_split_name(Path('export/test/_annotations.coco.json')) == 'test'
+    assert coco_split_name(Path('export/whatever.json')) == 'train'
+
+
+def test_convert_coco_dataset(tmp_path):
+    images_dir = tmp_path / 'train'
+    images_dir.mkdir()
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        (images_dir / name).write_bytes(b'')
+    images = [{'id': 1, 'file_name': 'a.jpg', 'width': 200, 'height': 100},
+              {'id': 2, 'file_name': 'b.jpg', 'width': 100, 'height': 100},
+              {'id': 3, 'file_name': 'c.jpg', 'width': 100, 'height': 100}]
+    annotations = [{'image_id': 1, 'category_id': 7, 'bbox': [50, 25, 100, 50]},
+                   {'image_id': 2, 'category_id': 5, 'bbox': [0, 0, 10, 10]},
+                   {'image_id': 1, 'category_id': 5, 'bbox': [-10, 0, 20, 200]},  # clipped to the image
+                   {'image_id': 2, 'category_id': 5, 'bbox': [0, 0, 10, 10], 'iscrowd': 1},
+                   {'image_id': 2, 'category_id': 5, 'bbox': [0, 0, 0, 10]},
+                   {'image_id': 99, 'category_id': 5, 'bbox': [0, 0, 10, 10]}]
+    write_coco(images_dir / '_annotations.coco.json', images, annotations,
+               [{'id': 7, 'name': 'dog'}, {'id': 5, 'name': 'cat'}])
+
+    assert convert_coco_dataset(tmp_path)
+    data = yaml.safe_load((tmp_path / 'data.yaml').read_text())
+    assert data['names'] == ['cat', 'dog']  # in category id order
+    assert data['train'] == 'train'
+
+    def rows(name):
+        return [[float(v) for v in line.split()] for line in (images_dir / 'labels' / name).read_text().splitlines()]
+    assert rows('a.txt') == [[1, 0.5, 0.5, 0.5, 0.5], [0, 0.0, 1.0, 0.1, 1.0]]
+    assert rows('b.txt') == [[0, 0.05, 0.05, 0.1, 0.1]]
+    assert not (images_dir / 'labels' / 'c.txt').exists()
+
+    # Already converted: data.yaml exists
+    assert not convert_coco_dataset(tmp_path)
+
+
+def test_convert_streams_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(coco_format, 'FLUSH_LINES', 2)
+    images_dir = tmp_path / 'valid'
+    images_dir.mkdir()
+    (images_dir / 'a.jpg').write_bytes(b'')
+    annotations = [{'image_id': 1, 'category_id': 1, 'bbox': [i, i, 1, 1]} for i in range(5)]
+    write_coco(images_dir / 'instances_valid.json', [{'id': 1, 'file_name': 'a.jpg', 'width': 10, 'height': 10}],
+               annotations, [{'id': 1, 'name': 'x'}])
+    assert convert_coco_dataset(tmp_path)
+    assert len((images_dir / 'labels' / 'a.txt').read_text().splitlines()) == 5
+
+
+def test_converted_dataset_analyzes_with_its_labels(tmp_path):
+    tmp_path = tmp_path / 'ds'  # the split name must not come from pytest's test_* directory
+    # <ds>/images/*.jpg with <ds>/annotations.json, as many COCO exports ship
+    (tmp_path / 'images').mkdir(parents=True)
+    for name in ('a.jpg', 'b.jpg'):
+        (tmp_path / 'images' / name).write_bytes(b'')
+    images = [{'id': 1, 'file_name': 'a.jpg', 'width': 10, 'height': 10},
+              {'id': 2, 'file_name': 'b.jpg', 'width': 10, 'height': 10}]
+    annotations = [{'image_id': 1, 'category_id': 1, 'bbox': [0, 0, 5, 5]},
+                   {'image_id': 2, 'category_id': 2, 'bbox': [5, 5, 5, 5]}]
+    write_coco(tmp_path / 'annotations.json', images, annotations, [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}])
+    assert convert_coco_dataset(tmp_path)
+
+    dataset = analyze_dataset(tmp_path)
+    split = dataset['splits']['train']
+    assert dataset['classes'] == ['a', 'b']
+    assert split['image_count'] == 2
+    assert split['label_count'] == 2
+    assert Path(split['labels_dir']) == tmp_path / 'labels'
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+import yaml
+
+from dataset_analysis import (AnalysisPool, analyze_dataset, class_inference_tasks, count_class_ids,
+                              parse_class_column, refine_classes)
+from dataset_scan import labels_dir_for
+
+
+def make_dataset(root, splits, names=('cat', 'dog')):
+    """data.yaml plus empty images; `splits` maps split -> (YAML path, images dir, image names)"""
+    root.mkdir(exist_ok=True)
+    data = {'names': list(names)}
+    for split, (yaml_path, images_dir, images) in splits.items():
+        data[split] = yaml_path
+        (root / images_dir).mkdir(parents=True, exist_ok=True)
+        for name in images:
+            (root / images_dir / name).write_bytes(b'')
+    (root / 'data.yaml').write_text(yaml.safe_dump(data))
+    return root
+
+
+def test_labels_dir_for(tmp_path):
+    assert labels_dir_for(tmp_path / 'train' / 'images') == tmp_path / 'train' / 'labels'
+    assert labels_dir_for(tmp_path / 'train') == tmp_path / 'train' / 'labels'
+    # Existing images/labels directories are kept
+    (tmp_path / 'images' / 'labels').mkdir(parents=True)
+    assert labels_dir_for(tmp_path / 'images') == tmp_path / 'images' / 'labels'
+    (tmp_path / 'labels').mkdir()
+    assert labels_dir_for(tmp_path / 'images') == tmp_path / 'labels'
+
+
+def test_labels_written_to_an_unlabeled_split_are_found(tmp_path):
+    for yaml_path, images_dir in (('images', 'images'), ('train/images', 'train/images'), ('flat', 'flat')):
+        root = make_dataset(tmp_path / images_dir.replace('/', '_'),
+                            {'train': (yaml_path, images_dir, ['a.jpg', 'b.jpg'])})
+        split = analyze_dataset(root)['splits']['train']
+        assert split['labels_dir'] is None
+
+        # Where the save endpoint puts a new label file
+        labels_dir = labels_dir_for(split['images_dir'])
+        labels_dir.mkdir()
+        (labels_dir / 'a.txt').write_text('0 0.5 0.5 0.1 0.1\n')
+
+        split = analyze_dataset(root)['splits']['train']
+        assert split['labels_dir'] == str(labels_dir)
+        assert split['label_count'] == 1
+
+
+def make_yaml_free_dataset(root, class_ids):
+    """train/images + train/labels without data.yaml, so classes must be inferred"""
+    (root / 'train' / 'images').mkdir(parents=True)
+    (root / 'train' / 'labels').mkdir(parents=True)
+    for i, class_id in enumerate(class_ids):
+        (root / 'train' / 'images' / f'{i}.jpg').write_bytes(b'')
+        (root / 'train' / 'labels' / f'{i}.txt').write_text(f'{class_id} 0.5 0.5 0.1 0.1\n')
+    return root
+
+
+@pytest.fixture
+def pool():
+    pool = AnalysisPool(workers=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_matches_analyze_dataset(tmp_path, pool):
+    paths = [
+        make_dataset(tmp_path / 'yaml', {'train': ('train/images', 'train/images', ['a.jpg', 'b.png']),
+                                         'val': ('val/images', 'val/images', ['c.jpg'])}),
+        make_yaml_free_dataset(tmp_path / 'inferred', [0, 2, 2]),
+        tmp_path / 'empty',
+    ]
+    paths[2].mkdir()
+    results, progress = {}, []
+    pool.analyze([str(path) for path in paths], lambda path, info: results.__setitem__(path, info),
+                 on_progress=lambda done, total: progress.append((done, total)))
+
+    assert sorted(results) == sorted(str(path) for path in paths)
+    for path in paths:
+        assert results[str(path)] == analyze_dataset(str(path))
+    assert results[str(tmp_path / 'empty')] is None
+    assert results[str(tmp_path / 'inferred')]['classes'] == ['class_0', 'class_1', 'class_2']
+    assert progress and progress[-1][0] == progress[-1][1]
+
+
+def test_parse_class_column_matches_line_parser():
+    data = (b'0 0.5 0.5 0.1 0.1\n'
+            b'12\t0.5 0.5 0.1 0.1\n'
+            b'  3 0.5 0.5 0.1 0.1\n'  # indented
+            b'1234567890123 0.5 0.5 0.1 0.1\n'  # too many digits for the vector path
+            b'-1 0.5 0.5 0.1 0.1\n'
+            b'2.0 0.5 0.5 0.1 0.1\n'
+            b'x 1\n'
+            b'\n'
+            b'7\r\n')
+    expected = [int(line.split()[0]) for line in data.splitlines() if line.split() and line.split()[0].isdigit()]
+    assert sorted(parse_class_column(data).tolist()) == sorted(expected) == [0, 3, 7, 12, 1234567890123]
+    assert parse_class_column(b'').tolist() == []
+
+
+def test_count_class_ids_across_read_buffers(tmp_path):
+    for i in range(10):
+        (tmp_path / f'{i}.txt').write_text(f'{i % 3} 0.5 0.5 0.1 0.1\n{i % 3} 0.5 0.5 0.1 0.1')  # no final newline
+    (tmp_path / 'huge.txt').write_text('200000 0.5 0.5 0.1 0.1\n')  # corrupt id
+    names = [f'{i}.txt' for i in range(10)] + ['huge.txt', 'missing.txt']
+    for read_bytes in (1, 64, 1 << 20):
+        counts = count_class_ids(str(tmp_path), names, read_bytes=read_bytes)
+        assert counts.tolist() == [8, 6, 6]
+
+
+def test_sampled_inference_is_refined(tmp_path):
+    root = make_yaml_free_dataset(tmp_path / 'ds', [0] * 9 + [4])
+    info = analyze_dataset(str(root))
+    label_files = {'train': sorted(f'{i}.txt' for i in range(10))}
+
+    tasks, sampled = class_inference_tasks(info, label_files, sample_size=3, chunk_size=2)
+    assert sampled
+    assert [len(names) for _, names in tasks] == [2, 1]
+    tasks, sampled = class_inference_tasks(info, label_files, sample_size=None, chunk_size=4)
+    assert not sampled and [len(names) for _, names in tasks] == [4, 4, 2]
+
+    assert info['class_inference'] == 'exact'
+    assert info['class_counts'] == [9, 0, 0, 0, 1]
+    refined = refine_classes(info)
+    assert refined == {'class_inference': 'exact', 'classes': info['classes'], 'class_counts': [9, 0, 0, 0, 1]}
+    assert np.array_equal(count_class_ids(str(root / 'train' / 'labels'), label_files['train']), [9, 0, 0, 0, 1])
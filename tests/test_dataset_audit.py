@@ -0,0 +1,153 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+import dataset_audit
+from dataset_audit import AuditJobs, compare_image
+
+
+def test_compare_image():
+    labels = [[0, 0, 10, 10], [20, 20, 30, 30], [40, 40, 50, 50], [70, 70, 80, 80]]
+    label_names = ['cat', 'dog', 'cat', 'cat']
+    predicted = [[0, 0, 10, 10],  # agrees
+                 [20, 20, 30, 30],  # matches, wrong class
+                 [40, 40, 50, 55],  # sloppy
+                 [90, 90, 99, 99],  # missed object
+                 [0, 90, 5, 99]]  # low-confidence extra: ignored
+    result = compare_image(predicted, ['cat', 'cat', 'cat', 'cat', 'dog'], [0.9, 0.8, 0.9, 0.7, 0.3],
+                           labels, label_names)
+    assert result['counts'] == {'missed': 1, 'wrong_class': 1, 'sloppy': 1, 'unconfirmed': 1}
+    by_type = {issue['type']: issue for issue in result['issues']}
+    assert by_type['wrong_class']['label_index'] == 1 and by_type['wrong_class']['predicted'] == 'cat'
+    assert by_type['sloppy']['label_index'] == 2
+    assert by_type['unconfirmed']['label_index'] == 3
+    assert by_type['missed']['box'] == [90, 90, 99, 99]
+    assert result['score'] == pytest.approx(sum(issue['weight'] for issue in result['issues']), abs=1e-3)
+    weights = [issue['weight'] for issue in result['issues']]
+    assert weights == sorted(weights, reverse=True)
+
+
+def test_compare_image_agreement():
+    boxes = [[0, 0, 10, 10], [20, 20, 30, 30]]
+    result = compare_image(boxes, ['a', 'b'], [0.9, 0.9], boxes, ['a', 'b'])
+    assert result['score'] == 0 and result['issues'] == []
+    empty = compare_image(np.zeros((0, 4)), [], [], np.zeros((0, 4)), [])
+    assert empty['score'] == 0 and empty['labels'] == empty['predictions'] == 0
+
+
+class Array:
+    """Stands in for a torch tensor in ultralytics results"""
+
+    def __init__(self, values):
+        self.values = np.asarray(values)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+
+class Boxes:
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy, self.cls, self.conf = Array(xyxy), Array(cls), Array(conf)
+
+    def __len__(self):
+        return len(self.xyxy.values)
+
+
+class Result:
+    names = {0: 'cat', 1: 'dog'}
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class FakeModel:
+    """Predicts one cat at (0, 0, 10, 10); fails on images whose file starts with b'bad'"""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, image_paths, conf, verbose):
+        self.calls.append(list(image_paths))
+        for path in image_paths:
+            with open(path, 'rb') as f:
+                if f.read().startswith(b'bad'):
+                    raise ValueError(f"cannot decode {path}")
+        return [Result(Boxes([[0, 0, 10, 10]], [0], [0.9])) for _ in image_paths]
+
+
+def run_audit(jobs, images, model, model_path):
+    def read_labels(row):
+        return [{'x': 0, 'y': 0, 'width': 10, 'height': 10, 'label': 'cat'}] if row['label_path'] else []
+
+    job = jobs.start('ds', 'train', images, model, model_path, read_labels)
+    deadline = time.time() + 10
+    while job['status'] == 'running' and time.time() < deadline:
+        time.sleep(0.01)
+    assert job['status'] == 'done', job['error']
+    return job['report']
+
+
+@pytest.fixture
+def split(tmp_path):
+    model_path = tmp_path / 'model.pt'
+    model_path.write_bytes(b'weights')
+    images = []
+    for name in ('a', 'b', 'c'):
+        image_path = tmp_path / f'{name}.jpg'
+        image_path.write_bytes(b'jpeg')
+        label_path = tmp_path / f'{name}.txt'
+        label_path.write_text('0 0.5 0.5 1 1\n')
+        images.append({'name': f'{name}.jpg', 'image_path': str(image_path), 'label_path': str(label_path)})
+    images[2]['label_path'] = None  # c has no labels: its prediction is a missed object
+    return tmp_path, model_path, images
+
+
+def test_audit_ranks_and_caches(split, monkeypatch):
+    tmp_path, model_path, images = split
+    monkeypatch.setattr(dataset_audit, 'AUDIT_BATCH', 2)
+    jobs = AuditJobs(tmp_path / 'audit')
+    model = FakeModel()
+
+    report = run_audit(jobs, images, model, model_path)
+    assert report['summary']['computed'] == 3 and report['summary']['failed'] == 0
+    assert report['images'][0]['name'] == 'c.jpg'
+    assert report['images'][0]['counts']['missed'] == 1
+    assert report['summary']['images_with_issues'] == 1
+
+    # Nothing changed: every image comes from the cache, also for a new AuditJobs
+    model.calls.clear()
+    report = run_audit(AuditJobs(tmp_path / 'audit'), images, model, model_path)
+    assert model.calls == [] and report['summary']['cached'] == 3
+
+    # A replaced image is run through the model again, even with its label file untouched
+    image_path = tmp_path / 'a.jpg'
+    image_path.write_bytes(b'other jpeg')
+    os.utime(image_path, ns=(1, 1))
+    report = run_audit(jobs, images, model, model_path)
+    assert model.calls == [[str(image_path)]]
+    assert report['summary']['computed'] == 1
+
+
+def test_audit_records_images_the_model_fails_on(split):
+    tmp_path, model_path, images = split
+    (tmp_path / 'b.jpg').write_bytes(b'bad jpeg')
+    jobs = AuditJobs(tmp_path / 'audit')
+    model = FakeModel()
+
+    report = run_audit(jobs, images, model, model_path)
+    assert [item['name'] for item in report['images']] == ['c.jpg', 'a.jpg']
+    assert report['summary']['failed'] == 1
+    assert report['errors'][0]['name'] == 'b.jpg' and 'cannot decode' in report['errors'][0]['error']
+
+    # Failures aren't cached: the next audit tries the image again
+    model.calls.clear()
+    (tmp_path / 'b.jpg').write_bytes(b'jpeg')
+    report = run_audit(jobs, images, model, model_path)
+    assert model.calls == [[str(tmp_path / 'b.jpg')]]
+    assert report['summary']['failed'] == 0 and len(report['images']) == 3
+    assert jobs.get('ds', 'train')['report']['summary']['images'] == 3
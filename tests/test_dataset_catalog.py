@@ -0,0 +1,178 @@
+import numpy as np
+import pytest
+import yaml
+
+from dataset_analysis import analyze_dataset
+from dataset_catalog import DatasetCatalog, decode_cursor, encode_cursor, summarize_label_file
+from label_arrays import SplitLabels
+
+
+def make_dataset(root, labels, unlabeled=()):
+    """YOLO dataset with one train split; `labels` maps image stem -> label file text"""
+    (root / 'train' / 'images').mkdir(parents=True)
+    (root / 'train' / 'labels').mkdir(parents=True)
+    for stem, text in labels.items():
+        (root / 'train' / 'images' / f'{stem}.jpg').write_bytes(b'')
+        (root / 'train' / 'labels' / f'{stem}.txt').write_text(text)
+    for stem in unlabeled:
+        (root / 'train' / 'images' / f'{stem}.jpg').write_bytes(b'')
+    (root / 'data.yaml').write_text(yaml.safe_dump({'train': 'train/images', 'names': ['a', 'b', 'c', 'd']}))
+    return analyze_dataset(root)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return DatasetCatalog(tmp_path / 'catalog.db')
+
+
+def test_label_summary_matches_the_label_parser(tmp_path):
+    label_file = tmp_path / 'a.txt'
+    label_file.write_text('3.0 0.5 0.5 0.1 0.1\n'  # integral float class: a box
+                          '3 0.5 0.5 0.1 0.1\n'
+                          '1 0.5 0.5 0.1 nan\n'  # not a box
+                          '1.5 0.5 0.5 0.1 0.1\n'  # not a box
+                          '0 0.1 0.1 0.1 0.1 0.7\n')
+    box_count, class_counts = summarize_label_file(label_file)
+    assert (box_count, class_counts) == (3, {0: 1, 3: 2})
+
+    labels = SplitLabels.load(str(tmp_path), ['a.txt'])
+    ids, counts = np.unique(labels.class_ids, return_counts=True)
+    assert dict(zip(ids.tolist(), counts.tolist())) == class_counts
+    assert summarize_label_file(tmp_path / 'missing.txt') == (0, {})
+
+
+def test_class_and_box_count_filters(tmp_path, catalog):
+    box = ' 0.5 0.5 0.1 0.1\n'
+    dataset = make_dataset(tmp_path / 'ds', {
+        'one_a': '0' + box,
+        'two_a': ('0' + box) * 2,
+        'a_and_b': '0' + box + '1' + box,
+        'three_b': ('1.0' + box) * 3,
+        'empty': '',
+    }, unlabeled=['none'])
+    catalog.sync_dataset(dataset)
+
+    def names(**filters):
+        images, _ = catalog.page_images('ds', limit=100, **filters)
+        assert catalog.count_images('ds', **filters) == len(images)
+        return [image['name'] for image in images]
+
+    assert names(classes=[0]) == ['a_and_b.jpg', 'one_a.jpg', 'two_a.jpg']
+    assert names(classes=[0, 1]) == ['a_and_b.jpg', 'one_a.jpg', 'three_b.jpg', 'two_a.jpg']
+    assert names(classes=[0, 1], match='all') == ['a_and_b.jpg']
+    assert names(classes=[0], min_class_boxes=2) == ['two_a.jpg']
+    assert names(classes=[1], min_class_boxes=3) == ['three_b.jpg']
+    assert names(min_boxes=2, max_boxes=2) == ['a_and_b.jpg', 'two_a.jpg']
+    assert names(max_boxes=0) == ['empty.jpg', 'none.jpg']
+    assert names(labeled=False) == ['none.jpg']
+    assert names(labeled=True, max_boxes=0) == ['empty.jpg']
+    with pytest.raises(ValueError):
+        names(classes=[0], match='most')
+
+    images, _ = catalog.page_images('ds', prefix='three')
+    assert images[0]['class_ids'] == [1] and images[0]['box_count'] == 3
+
+
+def test_sync_tracks_file_changes(tmp_path, catalog):
+    box = ' 0.5 0.5 0.1 0.1\n'
+    root = tmp_path / 'ds'
+    dataset = make_dataset(root, {'a': '0' + box, 'b': '1' + box}, unlabeled=['c'])
+    catalog.on_dataset_changed('ds', dataset)
+    rows = {row['name']: row for row in catalog.list_images('ds')}
+    assert sorted(rows) == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert rows['c.jpg']['label_path'] is None
+    assert catalog.find_image('ds', 'a.jpg')['class_ids'] == '0'
+
+    # A label written by the save endpoint
+    (root / 'train' / 'labels' / 'c.txt').write_text(('2' + box) * 2)
+    assert catalog.refresh_label('ds', 'c.jpg', 'train')
+    assert catalog.find_image('ds', 'c.jpg')['box_count'] == 2
+
+    # Watcher changes: b's image deleted, a's label rewritten, d added
+    (root / 'train' / 'images' / 'b.jpg').unlink()
+    (root / 'train' / 'labels' / 'a.txt').write_text('3' + box)
+    (root / 'train' / 'images' / 'd.jpg').write_bytes(b'')
+    catalog.on_dataset_changed('ds', dataset, changes={
+        'train': {'images': {'b.jpg': False, 'd.jpg': True}, 'labels': {'a.txt': True}}})
+    rows = {row['name']: row for row in catalog.list_images('ds')}
+    assert sorted(rows) == ['a.jpg', 'c.jpg', 'd.jpg']
+    assert catalog.find_image('ds', 'a.jpg')['class_ids'] == '3'
+    assert catalog.count_images('ds', classes=[1]) == 0
+
+    catalog.on_dataset_changed('ds', None)
+    assert catalog.list_images('ds') == []
+    assert catalog.connection().execute('SELECT COUNT(*) FROM image_classes').fetchone()[0] == 0
+
+
+def test_sync_index_adds_and_removes_datasets(tmp_path, catalog):
+    class Index:
+        def __init__(self, entries):
+            self.entries = entries
+
+        def snapshot_entries(self):
+            return self.entries
+
+    one = make_dataset(tmp_path / 'one', {'a': ''})
+    two = make_dataset(tmp_path / 'two', {'b': ''})
+    catalog.sync_index(Index({'one': {'info': one, 'signature': {'x': 1}},
+                              'two': {'info': two, 'signature': {'x': 1}}}))
+    assert [row['name'] for row in catalog.list_images('two')] == ['b.jpg']
+
+    # 'one' is unchanged (same signature), 'two' is gone
+    synced = []
+    catalog.sync_dataset = lambda info, signature=None: synced.append(info['name'])
+    catalog.sync_index(Index({'one': {'info': one, 'signature': {'x': 1}}}))
+    assert synced == []
+    assert catalog.list_images('two') == []
+    assert len(catalog.list_images('one')) == 1
+
+
+def test_metadata_worker_fills_sizes_and_hashes(tmp_path, catalog):
+    from PIL import Image
+    dataset = make_dataset(tmp_path / 'ds', {'a': ''})
+    Image.new('RGB', (64, 48), 'red').save(tmp_path / 'ds' / 'train' / 'images' / 'a.jpg')
+    catalog.sync_dataset(dataset)
+    assert catalog.find_image('ds', 'a.jpg')['width'] is None
+    assert catalog.fill_image_metadata() == 1
+    row = catalog.find_image('ds', 'a.jpg')
+    assert (row['width'], row['height'], row['orientation']) == (64, 48, 1)
+    assert catalog.count_unhashed_images() == 0
+    assert catalog.fill_image_metadata() == 0
+
+
+def test_keyset_pages_cover_every_image_once(tmp_path, catalog):
+    box = '0 0.5 0.5 0.1 0.1\n'
+    labels = {f'img{i:02d}': box * (i % 3) for i in range(25)}
+    catalog.sync_dataset(make_dataset(tmp_path / 'ds', labels, unlabeled=['zzz']))
+
+    def walk(**options):
+        names, cursor, pages = [], None, 0
+        while True:
+            images, cursor = catalog.page_images('ds', after=cursor, limit=4, **options)
+            names.extend(image['name'] for image in images)
+            pages += 1
+            if cursor is None:
+                return names, pages
+
+    names, pages = walk()
+    assert names == sorted(f'{stem}.jpg' for stem in list(labels) + ['zzz'])
+    assert pages == 7
+    assert walk(descending=True)[0] == names[::-1]
+
+    # Many images share a box count; the image id breaks the ties
+    by_boxes, _ = walk(sort='boxes')
+    assert sorted(by_boxes) == names
+    counts = [labels.get(name[:-4], '').count('\n') for name in by_boxes]
+    assert counts == sorted(counts)
+    assert walk(sort='boxes', descending=True)[0] == by_boxes[::-1]
+    assert walk(sort='boxes', min_boxes=2)[0] == [name for name, count in zip(by_boxes, counts) if count == 2]
+
+
+def test_invalid_page_requests(tmp_path, catalog):
+    catalog.sync_dataset(make_dataset(tmp_path / 'ds', {'a': ''}))
+    with pytest.raises(ValueError):
+        catalog.page_images('ds', sort='size')
+    with pytest.raises(ValueError):
+        catalog.page_images('ds', after='not a cursor')
+    assert decode_cursor(encode_cursor('b.jpg', 7)) == ('b.jpg', 7)
+    assert catalog.page_images('missing') == ([], None)
@@ -0,0 +1,92 @@
+import concurrent.futures
+import gzip
+import io
+import json
+import zipfile
+
+import pytest
+import yaml
+from PIL import Image
+
+import dataset_export
+from dataset_analysis import analyze_dataset
+from dataset_catalog import DatasetCatalog
+from dataset_export import DatasetExport
+from label_arrays import LabelCache
+
+LABELS = {
+    'a': '0 0.5 0.5 0.5 0.5\n1 0.25 0.25 0.5 0.5\n',
+    'b': '2 0.5 0.5 1.0 1.0\n',  # class id beyond the data.yaml names
+    'c': '',
+}
+
+
+@pytest.fixture
+def export(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_export, 'EXPORT_CHUNK', 2)
+    root = tmp_path / 'ds'
+    (root / 'train' / 'images').mkdir(parents=True)
+    (root / 'train' / 'labels').mkdir(parents=True)
+    for stem in ('a', 'b', 'c', 'd'):
+        Image.new('RGB', (200, 100)).save(root / 'train' / 'images' / f'{stem}.jpg')
+    for stem, text in LABELS.items():
+        (root / 'train' / 'labels' / f'{stem}.txt').write_text(text)
+    (root / 'data.yaml').write_text(yaml.safe_dump({'train': 'train/images', 'names': ['cat', 'dog']}))
+    info = analyze_dataset(str(root))
+    catalog = DatasetCatalog(tmp_path / 'catalog.db')
+    catalog.sync_dataset(info)
+    catalog.fill_image_metadata(batch_size=1)  # one size from the catalog, the others probed
+    label_cache = LabelCache(tmp_path / 'labels')
+
+    def export(fmt, **options):
+        return DatasetExport(info, catalog, label_cache, fmt, **options)
+    return export
+
+
+def read_zip(chunks):
+    return zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+
+def test_yolo_export(export):
+    zf = read_zip(export('yolo', include_images=True).export_zip())
+    assert sorted(zf.namelist()) == ['data.yaml', 'train/images/a.jpg', 'train/images/b.jpg', 'train/images/c.jpg',
+                                     'train/images/d.jpg', 'train/labels/a.txt', 'train/labels/b.txt',
+                                     'train/labels/c.txt']
+    assert yaml.safe_load(zf.read('data.yaml')) == {'path': '.', 'nc': 3, 'names': ['cat', 'dog', 'class_2'],
+                                                    'train': 'train/images'}
+    assert zf.read('train/labels/a.txt').decode() == LABELS['a']
+    assert zf.getinfo('train/images/a.jpg').compress_type == zipfile.ZIP_STORED
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_coco_export(export, parallel):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        zf = read_zip(export('coco', executor=executor if parallel else None, window=1).export_zip())
+    coco = json.loads(zf.read('annotations/instances_train.json'))
+    assert [c['name'] for c in coco['categories']] == ['cat', 'dog', 'class_2']
+    assert [(image['file_name'], image['width'], image['height']) for image in coco['images']] == [
+        (name, 200, 100) for name in ('a.jpg', 'b.jpg', 'c.jpg', 'd.jpg')]
+    annotations = coco['annotations']
+    assert [a['id'] for a in annotations] == sorted({a['id'] for a in annotations})
+    assert [(a['category_id'], a['bbox']) for a in annotations] == [
+        (1, [50.0, 25.0, 100.0, 50.0]), (2, [0.0, 0.0, 100.0, 50.0]), (3, [0.0, 0.0, 200.0, 100.0])]
+    image_ids = {image['file_name']: image['id'] for image in coco['images']}
+    assert [a['image_id'] for a in annotations] == [image_ids['a.jpg']] * 2 + [image_ids['b.jpg']]
+
+    compressed = gzip.decompress(b''.join(export('coco').coco_json('train', compress=True)))
+    assert json.loads(compressed) == coco
+
+
+def test_voc_export(export):
+    zf = read_zip(export('voc').export_zip())
+    assert zf.read('labels.txt') == b'cat\ndog\nclass_2\n'
+    assert zf.read('ImageSets/Main/train.txt') == b'a\nb\nc\nd\n'
+    xml = zf.read('train/Annotations/a.xml').decode()
+    assert '<width>200</width>' in xml and xml.count('<object>') == 2
+    assert '<xmin>50</xmin>' in xml and '<xmax>150</xmax>' in xml
+    assert '<name>class_2</name>' in zf.read('train/Annotations/b.xml').decode()
+
+
+def test_unknown_format(export):
+    with pytest.raises(ValueError):
+        export('csv')
@@ -0,0 +1,133 @@
+import json
+import os
+import shutil
+
+import pytest
+import yaml
+
+from dataset_analysis import analyze_dataset
+from dataset_index import DatasetIndex
+
+
+def make_dataset(root, images=('a.jpg', 'b.jpg')):
+    (root / 'train' / 'images').mkdir(parents=True)
+    (root / 'train' / 'labels').mkdir(parents=True)
+    for name in images:
+        (root / 'train' / 'images' / name).write_bytes(b'')
+    (root / 'train' / 'labels' / 'a.txt').write_text('0 0.5 0.5 0.1 0.1\n')
+    (root / 'data.yaml').write_text(yaml.safe_dump({'train': 'train/images', 'names': ['x']}))
+
+
+def bump_mtime(path):
+    """Give a directory a new mtime whatever the clock resolution"""
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+class CountingAnalyzer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, path):
+        self.calls.append(os.path.basename(path))
+        return analyze_dataset(path)
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    uploads = tmp_path / 'uploads'
+    make_dataset(uploads / 'one')
+    make_dataset(uploads / 'two')
+    (uploads / 'not_a_dataset').mkdir()
+    return uploads
+
+
+def open_index(tmp_path, uploads):
+    index = DatasetIndex(uploads, tmp_path / 'cache' / 'index.json', CountingAnalyzer())
+    index.load()
+    return index
+
+
+def test_index_is_persisted_and_reused(tmp_path, uploads):
+    index = open_index(tmp_path, uploads)
+    assert index.refresh()
+    assert sorted(index.analyze_fn.calls) == ['not_a_dataset', 'one', 'two']
+    assert [info['name'] for info in index.datasets()] == ['one', 'two']
+    assert index.get('not_a_dataset') is None
+    assert index.get('one')['splits']['train']['image_count'] == 2
+
+    # A restart loads the saved index; nothing changed, so nothing is analyzed
+    reopened = open_index(tmp_path, uploads)
+    assert not reopened.refresh()
+    assert reopened.analyze_fn.calls == []
+    assert list(reopened.get('one')['splits']['train']['images']) == ['a.jpg', 'b.jpg']
+
+
+def test_only_changed_datasets_are_analyzed_again(tmp_path, uploads):
+    index = open_index(tmp_path, uploads)
+    index.refresh()
+    index.analyze_fn.calls.clear()
+
+    (uploads / 'two' / 'train' / 'images' / 'c.jpg').write_bytes(b'')
+    bump_mtime(uploads / 'two' / 'train' / 'images')
+    assert index.refresh()
+    assert index.analyze_fn.calls == ['two']
+    assert index.get('two')['splits']['train']['image_count'] == 3
+
+    # An in-place YAML edit changes only the file's mtime
+    (uploads / 'one' / 'data.yaml').write_text(yaml.safe_dump({'train': 'train/images', 'names': ['renamed']}))
+    bump_mtime(uploads / 'one' / 'data.yaml')
+    index.analyze_fn.calls.clear()
+    index.refresh()
+    assert index.analyze_fn.calls == ['one']
+    assert index.get('one')['classes'] == ['renamed']
+
+
+def test_removed_datasets_are_dropped(tmp_path, uploads):
+    index = open_index(tmp_path, uploads)
+    changed, removed = [], []
+    index.listeners.append(lambda name, info, signature, changes: changed.append((name, info is None)))
+    index.removal_listeners.append(removed.append)
+    index.refresh()
+
+    shutil.rmtree(uploads / 'one')
+    assert index.refresh()
+    assert index.get('one') is None
+    assert removed == ['one']
+    assert ('one', True) in changed
+    assert sorted(open_index(tmp_path, uploads).entries) == ['not_a_dataset', 'two']
+
+
+def test_outdated_index_file_is_ignored(tmp_path, uploads):
+    index = open_index(tmp_path, uploads)
+    index.refresh()
+    data = json.loads(index.index_file.read_text())
+    data['version'] = 0
+    index.index_file.write_text(json.dumps(data))
+
+    reopened = open_index(tmp_path, uploads)
+    assert reopened.entries == {}
+    reopened.refresh()
+    assert sorted(reopened.analyze_fn.calls) == ['not_a_dataset', 'one', 'two']
+
+
+def test_summaries_leave_out_image_names(tmp_path, uploads):
+    index = open_index(tmp_path, uploads)
+    index.refresh()
+    summaries, serialized = index.summaries()
+    assert [summary['name'] for summary in summaries] == ['one', 'two']
+    assert json.loads(serialized) == summaries
+    assert summaries[0]['splits'] == {'train': {'image_count': 2, 'label_count': 1}}
+    assert summaries[0]['total_images'] == 2 and summaries[0]['last_modified'] > 0
+    assert '"images"' not in serialized and 'a.jpg' not in serialized
+    assert index.summary('one') == summaries[0]
+    assert index.summary('not_a_dataset') is None
+
+    # Cached until the index changes
+    assert index.summaries()[1] is serialized
+    (uploads / 'one' / 'train' / 'images' / 'c.jpg').write_bytes(b'')
+    bump_mtime(uploads / 'one' / 'train' / 'images')
+    index.refresh()
+    summaries, serialized = index.summaries()
+    assert summaries[0]['total_images'] == 3
+    assert index.summaries()[1] is serialized
@@ -0,0 +1,46 @@
+import dataset_scan
+from dataset_scan import find_yaml_files, is_image_file, list_split_files, scan_directory
+
+
+def touch(directory, *names):
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        (directory / name).write_bytes(b'x' * len(name))
+
+
+def test_scan_directory_groups_by_lowercase_extension(tmp_path):
+    touch(tmp_path, 'b.JPG', 'a.jpg', 'c.Png', 'notes', 'd.txt')
+    (tmp_path / 'sub.jpg').mkdir()  # directories are skipped
+    listing = scan_directory(tmp_path)
+    assert list(listing['.jpg']) == ['a.jpg', 'b.JPG']
+    assert list(listing['.png']) == ['c.Png']
+    assert listing['']['notes'].size == 5
+    assert scan_directory(tmp_path / 'missing') == {}
+    assert scan_directory(tmp_path, stat=False)['.txt'] == {'d.txt': None}
+
+
+def test_list_split_files(tmp_path):
+    touch(tmp_path / 'images', 'b.jpeg', 'a.JPG', 'c.webp', 'readme.md')
+    touch(tmp_path / 'labels', 'a.txt', 'b.TXT', 'classes.json')
+    files = list_split_files(tmp_path / 'images', tmp_path / 'labels')
+    assert list(files.images) == ['a.JPG', 'b.jpeg', 'c.webp']
+    assert list(files.labels) == ['a.txt', 'b.TXT']
+    assert files.images['c.webp'].size == len('c.webp')
+    assert list_split_files(tmp_path / 'images').labels == {}
+
+
+def test_shared_directory_is_listed_once(tmp_path, monkeypatch):
+    touch(tmp_path, 'a.jpg', 'a.txt')
+    listed = []
+    original = dataset_scan.scan_directory
+    monkeypatch.setattr(dataset_scan, 'scan_directory', lambda path, stat=True: listed.append(path) or original(path, stat))
+    files = list_split_files(str(tmp_path), str(tmp_path) + '/', stat=False)
+    assert list(files.images) == ['a.jpg'] and list(files.labels) == ['a.txt']
+    assert listed == [str(tmp_path)]
+
+
+def test_find_yaml_files(tmp_path):
+    touch(tmp_path, 'data.yaml', 'other.YML', 'a.json')
+    touch(tmp_path / 'train', 'nested.yaml')
+    assert find_yaml_files(tmp_path) == [str(tmp_path / 'data.yaml'), str(tmp_path / 'other.YML')]
+    assert is_image_file('x.TIFF') and not is_image_file('x.gif')
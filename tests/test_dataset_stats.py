@@ -0,0 +1,84 @@
+import os
+
+import yaml
+
+from dataset_analysis import analyze_dataset
+from dataset_stats import DatasetStats, compute_split_stats
+from label_arrays import LabelCache, SplitLabels
+from name_list import ImageNameList
+
+
+def write_labels(labels_dir, files):
+    os.makedirs(labels_dir, exist_ok=True)
+    for name, text in files.items():
+        with open(os.path.join(labels_dir, name), 'w') as f:
+            f.write(text)
+
+
+def test_orphan_label_files_are_not_labeled_images(tmp_path):
+    labels_dir = str(tmp_path / 'labels')
+    write_labels(labels_dir, {
+        'a.txt': '0 0.5 0.5 0.2 0.2\n',
+        'b.txt': '1 0.5 0.5 0.2 0.2\n1 0.1 0.1 0.1 0.1\n',
+        'gone.txt': '0 0.5 0.5 0.2 0.2\n',  # its image was deleted
+        'classes.txt': '',
+    })
+    labels = SplitLabels.load(labels_dir, os.listdir(labels_dir))
+    stats = compute_split_stats(labels, ImageNameList(['a.jpg', 'b.png', 'c.jpg']), num_classes=2)
+
+    assert stats['image_count'] == 3
+    assert stats['labeled_images'] == 2
+    assert stats['orphan_label_files'] == 2
+    assert stats['box_count'] == 4  # boxes of every label file
+    assert stats['boxes_per_image']['histogram'][:3] == [1, 1, 1]  # c: 0, a: 1, b: 2
+
+    stats = compute_split_stats(labels, ImageNameList(['a.jpg']), num_classes=2)
+    assert stats['labeled_images'] == 1 <= stats['image_count']
+
+
+class CountingLabelCache(LabelCache):
+    def __init__(self, cache_dir):
+        super().__init__(cache_dir)
+        self.loads = []
+
+    def split_labels(self, dataset_name, split, *args, **kwargs):
+        self.loads.append(split)
+        return super().split_labels(dataset_name, split, *args, **kwargs)
+
+
+def make_dataset(root):
+    for split, labels in (('train', {'a.txt': '0 0.5 0.5 0.2 0.4\n1 0.5 0.5 0.1 0.1\n'}),
+                          ('val', {'v.txt': '1 0.5 0.5 0.2 0.2\n5 0.5 0.5 1.5 0.2\n'})):
+        os.makedirs(root / split / 'images')
+        for name in labels:
+            (root / split / 'images' / name.replace('.txt', '.jpg')).write_bytes(b'')
+        write_labels(root / split / 'labels', labels)
+    (root / 'data.yaml').write_text(yaml.safe_dump({'train': 'train/images', 'val': 'val/images',
+                                                    'names': ['a', 'b']}))
+    return analyze_dataset(str(root))
+
+
+def test_dataset_stats_are_cached_until_labels_change(tmp_path):
+    info = make_dataset(tmp_path / 'ds')
+    label_cache = CountingLabelCache(tmp_path / 'cache' / 'labels')
+    stats = DatasetStats(tmp_path / 'cache' / 'stats', label_cache)
+
+    result = stats.dataset_stats(info)
+    assert result['totals'] == {
+        'image_count': 2, 'labeled_images': 2, 'box_count': 4,
+        'class_counts': [1, 2, 0, 0, 0, 1], 'images_per_class': [1, 2, 0, 0, 0, 1],
+        'unknown_class_boxes': 1, 'out_of_range_boxes': 1,
+    }
+    assert result['splits']['train']['aspect']['count'] == 2
+    assert sorted(label_cache.loads) == ['train', 'val']
+
+    # In memory, then on disk for a new instance
+    assert stats.dataset_stats(info, ['val'])['splits']['val'] == result['splits']['val']
+    reopened = DatasetStats(tmp_path / 'cache' / 'stats', label_cache)
+    assert reopened.dataset_stats(info) == result
+    assert sorted(label_cache.loads) == ['train', 'val']
+
+    write_labels(tmp_path / 'ds' / 'val' / 'labels', {'v.txt': '0 0.5 0.5 0.2 0.2\n'})
+    result = reopened.dataset_stats(info)
+    assert label_cache.loads[-1] == 'val' and len(label_cache.loads) == 3
+    assert result['totals']['class_counts'] == [2, 1]
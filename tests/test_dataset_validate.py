@@ -0,0 +1,80 @@
+import concurrent.futures
+import time
+
+import yaml
+
+from dataset_analysis import analyze_dataset
+from dataset_validate import ValidationJobs, validate_dataset, validate_label_chunk
+
+BOX = '0 0.5 0.5 0.2 0.2'
+
+
+def test_label_checks(tmp_path):
+    files = {
+        'ok.txt': f'{BOX}\n1 0.1 0.1 0.3 0.3 0.2 0.4\n',  # box and polygon
+        'tokens.txt': '0 0.5 0.5 0.2\n',
+        'text.txt': '0 0.5 abc 0.2 0.2\n',
+        'class.txt': '1.5 0.5 0.5 0.2 0.2\n-1 0.5 0.5 0.2 0.2\n7 0.5 0.5 0.2 0.2\n',
+        'coords.txt': '0 1.5 0.5 0.2 0.2\n0 0.5 0.5 0.0 0.2\n',
+        'dupes.txt': f'{BOX}\n{BOX}\n\n{BOX}\n',
+        'empty.txt': ' \n',
+    }
+    for name, text in files.items():
+        (tmp_path / name).write_text(text)
+    result = validate_label_chunk(str(tmp_path), list(files) + ['missing.txt'], num_classes=2)
+    issues = {issue: count for issue, count in result['issues'].items() if count}
+    assert issues == {
+        'unreadable_label_files': 1, 'bad_token_count': 1, 'non_numeric': 1, 'invalid_class_id': 2,
+        'class_out_of_range': 1, 'coords_out_of_range': 1, 'zero_area_box': 1, 'duplicate_lines': 2,
+        'empty_label_files': 1,
+    }
+    assert result['examples']['duplicate_lines'] == [{'file': 'dupes.txt', 'line': 2, 'text': BOX},
+                                                     {'file': 'dupes.txt', 'line': 4, 'text': BOX}]
+    assert result['examples']['class_out_of_range'][0]['line'] == 3
+    assert result['lines'] == 12
+
+
+def make_dataset(root, labels, images):
+    (root / 'train' / 'images').mkdir(parents=True)
+    (root / 'train' / 'labels').mkdir(parents=True)
+    for name in images:
+        (root / 'train' / 'images' / name).write_bytes(b'')
+    for name, text in labels.items():
+        (root / 'train' / 'labels' / name).write_text(text)
+    (root / 'data.yaml').write_text(yaml.safe_dump({'train': 'train/images', 'names': ['a']}))
+    return analyze_dataset(str(root))
+
+
+def test_chunked_and_parallel_reports_agree(tmp_path):
+    labels = {f'{i}.txt': f'{i % 2} 0.5 0.5 0.2 0.2\n' for i in range(9)}
+    labels['orphan.txt'] = f'{BOX}\n'
+    info = make_dataset(tmp_path / 'ds', labels, [f'{i}.jpg' for i in range(9)] + ['unlabeled.png'])
+
+    progress = []
+    inline = validate_dataset(info, chunk_size=4, on_progress=lambda done, total: progress.append((done, total)))
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    summary = inline['summary']
+    assert (summary['images'], summary['label_files'], summary['boxes']) == (10, 10, 10)
+    assert summary['issues']['class_out_of_range'] == 4
+    assert summary['issues']['orphan_labels'] == summary['issues']['images_without_labels'] == 1
+    assert (summary['errors'], summary['warnings'], inline['valid']) == (4, 2, False)
+    assert inline['splits']['train']['examples']['orphan_labels'] == [{'file': 'orphan.txt'}]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        parallel = validate_dataset(info, executor, chunk_size=2)
+    assert parallel['summary'] == summary
+
+
+def test_validation_jobs_save_reports(tmp_path):
+    info = make_dataset(tmp_path / 'ds', {'a.txt': f'{BOX}\n'}, ['a.jpg'])
+    jobs = ValidationJobs(tmp_path / 'reports')
+    job = jobs.start(info)
+    deadline = time.time() + 10
+    while job['status'] == 'running' and time.time() < deadline:
+        time.sleep(0.01)
+    assert job['status'] == 'done' and job['report']['valid']
+
+    saved = ValidationJobs(tmp_path / 'reports').get(info['name'])
+    assert saved['status'] == 'done'
+    assert saved['report']['summary'] == job['report']['summary']
+    assert ValidationJobs(tmp_path / 'reports').get('other') is None
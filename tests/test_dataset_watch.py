@@ -0,0 +1,88 @@
+import time
+
+import pytest
+import yaml
+
+from dataset_analysis import analyze_dataset
+from dataset_index import DatasetIndex
+from dataset_watch import DatasetWatcher
+
+
+def make_dataset(root, images=('a.jpg',)):
+    for split in ('train', 'val'):
+        (root / split / 'images').mkdir(parents=True)
+        (root / split / 'labels').mkdir(parents=True)
+    for name in images:
+        (root / 'train' / 'images' / name).write_bytes(b'')
+    (root / 'val' / 'images' / 'v.jpg').write_bytes(b'')
+    (root / 'data.yaml').write_text(yaml.safe_dump({'train': 'train/images', 'val': 'val/images', 'names': ['x']}))
+
+
+class CountingAnalyzer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, path):
+        self.calls.append(str(path))
+        return analyze_dataset(path)
+
+
+@pytest.fixture
+def index(tmp_path):
+    uploads = tmp_path / 'uploads'
+    make_dataset(uploads / 'ds')
+    index = DatasetIndex(uploads, tmp_path / 'index.json', CountingAnalyzer())
+    index.refresh()
+    return index
+
+
+@pytest.mark.parametrize('mode', ['poll', 'auto'])
+def test_start_doesnt_analyze_again(index, mode, monkeypatch):
+    refreshes = []
+    monkeypatch.setattr(index, 'refresh', lambda *args, **kwargs: refreshes.append(args))
+    watcher = DatasetWatcher(index, mode=mode, debounce=0.05, poll_interval=0.05)
+    assert watcher.start()
+    try:
+        assert refreshes == []
+        assert index.analyze_fn.calls == [str(index.uploads_path / 'ds')]
+        assert index.check_interval is None
+    finally:
+        watcher.stop()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.mark.parametrize('mode', ['poll', 'auto'])
+def test_file_changes_update_the_index_incrementally(index, mode):
+    changes = []
+    index.listeners.append(lambda name, info, signature, split_changes: changes.append(split_changes))
+    watcher = DatasetWatcher(index, mode=mode, debounce=0.05, poll_interval=0.05)
+    watcher.start()
+    try:
+        images_dir = index.uploads_path / 'ds' / 'train' / 'images'
+        for name in ('b.jpg', 'c.PNG'):
+            (images_dir / name).write_bytes(b'')
+        (images_dir / 'notes.md').write_text('ignored')
+        (images_dir / 'a.jpg').unlink()
+        assert wait_for(lambda: list(index.get('ds')['splits']['train']['images']) == ['b.jpg', 'c.PNG'])
+        assert index.get('ds')['splits']['train']['image_count'] == 2
+
+        (index.uploads_path / 'ds' / 'train' / 'labels' / 'b.txt').write_text('0 0.5 0.5 0.1 0.1\n')
+        assert wait_for(lambda: index.get('ds')['splits']['train']['label_count'] == 1)
+
+        # File events are applied in place, without analyzing the dataset again
+        assert index.analyze_fn.calls == [str(index.uploads_path / 'ds')]
+        assert any(change and 'train' in change for change in changes)
+
+        # A new dataset directory is analyzed
+        make_dataset(index.uploads_path / 'new')
+        assert wait_for(lambda: index.get('new') is not None)
+    finally:
+        watcher.stop()
@@ -0,0 +1,61 @@
+import numpy as np
+from PIL import Image
+
+import image_hash
+from image_hash import dhash, group_near_duplicates, hamming, image_fingerprint
+
+
+def brute_force_groups(hashes, max_distance):
+    """Transitive groups from comparing every pair"""
+    hashes = np.asarray(hashes, dtype=np.int64)
+    groups = [{i} for i in range(len(hashes))]
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            if hamming(hashes[i], hashes[j]) <= max_distance:
+                group_i = next(g for g in groups if i in g)
+                group_j = next(g for g in groups if j in g)
+                if group_i is not group_j:
+                    group_i |= group_j
+                    groups.remove(group_j)
+    return sorted(sorted(g) for g in groups if len(g) > 1)
+
+
+def flip_bits(value, bits):
+    value = int(value) & ((1 << 64) - 1)
+    for bit in bits:
+        value ^= 1 << int(bit)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def test_grouping_matches_brute_force(monkeypatch):
+    rng = np.random.default_rng(0)
+    base = [int(v) for v in rng.integers(0, 1 << 63, size=20)]
+    hashes = list(base)
+    for value in base[:10]:  # near copies, including chains of them
+        hashes.append(flip_bits(value, rng.choice(64, size=3, replace=False)))
+        hashes.append(flip_bits(hashes[-1], [63]))
+    hashes.append(base[0])  # exact duplicate
+    monkeypatch.setattr(image_hash, 'BLOCK_SIZE', 4)
+
+    for max_distance in (0, 2, 4, 10):
+        groups = sorted(sorted(group.tolist()) for group in group_near_duplicates(hashes, max_distance))
+        assert groups == brute_force_groups(hashes, max_distance)
+    assert group_near_duplicates(hashes[:1]) == []
+
+
+def test_dhash_of_near_copies(tmp_path):
+    gradient = np.tile(np.linspace(0, 255, 400, dtype=np.uint8), (300, 1))
+    pattern = (np.indices((300, 400)).sum(axis=0) // 37 % 2 * 255).astype(np.uint8)
+    Image.fromarray(gradient).convert('RGB').save(tmp_path / 'a.jpg', quality=95)
+    Image.fromarray(gradient).resize((200, 150)).save(tmp_path / 'a_small.png')
+    Image.fromarray(pattern).save(tmp_path / 'b.jpg')
+
+    a, a_small, b = (dhash(tmp_path / name) for name in ('a.jpg', 'a_small.png', 'b.jpg'))
+    assert hamming(a, a_small) <= 4
+    assert hamming(a, b) > 10
+    assert -(1 << 63) <= b < 1 << 63
+
+    (tmp_path / 'broken.jpg').write_bytes(b'not an image')
+    content_hash, perceptual = image_fingerprint(tmp_path / 'broken.jpg')
+    assert len(content_hash) == 32 and perceptual is None
+    assert image_fingerprint(tmp_path / 'missing.jpg') == ('', None)
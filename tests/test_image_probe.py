@@ -0,0 +1,38 @@
+import pytest
+from PIL import Image
+
+from image_probe import EXIF_ORIENTATION_TAG, oriented_size, probe_image
+
+
+@pytest.mark.parametrize('extension, options', [
+    ('jpg', {}),
+    ('jpg', {'progressive': True}),
+    ('png', {}),
+    ('gif', {}),
+    ('bmp', {}),
+    ('webp', {}),
+    ('webp', {'lossless': True}),
+    ('tiff', {}),
+])
+def test_header_dimensions_match_pil(tmp_path, extension, options):
+    path = tmp_path / f'image.{extension}'
+    Image.new('RGB', (123, 45), 'blue').save(path, **options)
+    assert probe_image(path) == (123, 45, 1)
+
+
+@pytest.mark.parametrize('extension', ['jpg', 'tiff'])
+def test_exif_orientation(tmp_path, extension):
+    path = tmp_path / f'image.{extension}'
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION_TAG] = 6
+    Image.new('RGB', (30, 20)).save(path, exif=exif)
+    assert probe_image(path) == (30, 20, 6)
+    assert oriented_size(30, 20, 6) == (20, 30)
+    assert oriented_size(30, 20, 3) == (30, 20)
+
+
+def test_truncated_header_is_an_error(tmp_path):
+    path = tmp_path / 'bad.png'
+    path.write_bytes(b'\x89PNG\r\n\x1a\n')
+    with pytest.raises(OSError):  # PIL fallback: UnidentifiedImageError
+        probe_image(path)
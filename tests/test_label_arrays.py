@@ -0,0 +1,121 @@
+import os
+import threading
+
+import numpy as np
+
+from label_arrays import (SplitLabels, parse_label_data, labels_key, read_label_cache, write_label_cache,
+                          LabelCache)
+from dataset_scan import list_split_files
+
+
+def test_parse_label_data():
+    data = (b'0 0.5 0.5 0.2 0.2\n'
+            b'\n'
+            b'3 0.1 0.2 0.3 0.4 0.9 0.9\n'  # extra columns ignored
+            b'1 0.1 0.2\n'  # too short
+            b'x 0.1 0.2 0.3 0.4\n'  # class isn't a number
+            b'-1 0.1 0.2 0.3 0.4\n'  # negative class
+            b'1.5 0.1 0.2 0.3 0.4\n'  # fractional class
+            b'2\t0.25  0.75 0.5 nan\n'  # NaN coordinate
+            b'7 1e-1 2E-1 .3 4.\n')
+    lines, class_ids, boxes = parse_label_data(data)
+    assert lines.tolist() == [0, 2, 8]
+    assert class_ids.tolist() == [0, 3, 7]
+    assert boxes.dtype == np.float32
+    np.testing.assert_allclose(boxes, [[0.5, 0.5, 0.2, 0.2], [0.1, 0.2, 0.3, 0.4], [0.1, 0.2, 0.3, 4.0]])
+
+
+def test_parse_label_data_empty():
+    lines, class_ids, boxes = parse_label_data(b'')
+    assert len(lines) == len(class_ids) == len(boxes) == 0
+
+
+def write_labels(labels_dir, files):
+    os.makedirs(labels_dir, exist_ok=True)
+    for name, text in files.items():
+        with open(os.path.join(labels_dir, name), 'w') as f:
+            f.write(text)
+
+
+def test_split_labels_load(tmp_path):
+    labels_dir = str(tmp_path / 'labels')
+    write_labels(labels_dir, {
+        'b.txt': '1 0.1 0.1 0.1 0.1\n2 0.2 0.2 0.2 0.2',  # no trailing newline
+        'a.txt': '0 0.5 0.5 0.5 0.5\n',
+        'empty.txt': '',
+    })
+    # A tiny read size spreads the files over several parse passes
+    labels = SplitLabels.load(labels_dir, ['b.txt', 'a.txt', 'empty.txt'], read_bytes=8)
+    assert list(labels.names) == ['a.txt', 'b.txt', 'empty.txt']
+    assert labels.offsets.tolist() == [0, 1, 3, 3]
+    class_ids, boxes = labels.file_labels('b.txt')
+    assert class_ids.tolist() == [1, 2]
+    np.testing.assert_allclose(boxes, [[0.1] * 4, [0.2] * 4])
+    assert len(labels.file_labels('empty.txt')[0]) == 0
+    assert len(labels.file_labels('missing.txt')[0]) == 0
+    assert labels.file_index.tolist() == [0, 1, 1]
+
+
+def test_label_cache_file_round_trip(tmp_path):
+    labels_dir = str(tmp_path / 'labels')
+    write_labels(labels_dir, {f'{i}.txt': f'{i % 3} 0.{i} 0.5 0.25 0.125\n' * i for i in range(10)})
+    labels = SplitLabels.load(labels_dir, os.listdir(labels_dir))
+    cache_file = tmp_path / 'cache' / 'train.bin'
+
+    write_label_cache(cache_file, 'key-1', labels)
+    cached = read_label_cache(cache_file, 'key-1')
+    assert cached.names == labels.names
+    assert cached.offsets.tolist() == labels.offsets.tolist()
+    assert cached.class_ids.tolist() == labels.class_ids.tolist()
+    np.testing.assert_array_equal(cached.boxes, labels.boxes)
+    for name in labels.names:
+        np.testing.assert_array_equal(cached.file_labels(name)[1], labels.file_labels(name)[1])
+
+    assert read_label_cache(cache_file, 'key-2') is None  # stale
+    assert read_label_cache(tmp_path / 'missing.bin', 'key-1') is None
+    cache_file.write_bytes(b'garbage')
+    assert read_label_cache(cache_file, 'key-1') is None
+
+
+def test_label_cache_follows_file_changes(tmp_path):
+    labels_dir = str(tmp_path / 'labels')
+    write_labels(labels_dir, {'a.txt': '0 0.5 0.5 0.5 0.5\n'})
+    cache = LabelCache(tmp_path / 'cache')
+    assert cache.split_labels('ds', 'train', labels_dir).class_ids.tolist() == [0]
+
+    write_labels(labels_dir, {'a.txt': '1 0.5 0.5 0.5 0.5\n2 0.1 0.1 0.1 0.1\n'})
+    os.utime(os.path.join(labels_dir, 'a.txt'), ns=(1, 1))  # a different mtime whatever the clock resolution
+    assert cache.split_labels('ds', 'train', labels_dir).class_ids.tolist() == [1, 2]
+    # A new cache instance reads the file written by the first one
+    files = list_split_files(None, labels_dir).labels
+    assert read_label_cache(tmp_path / 'cache' / 'ds' / 'train.bin', labels_key(labels_dir, files)) is not None
+
+
+def test_concurrent_cache_writes_stay_readable(tmp_path):
+    cache_file = tmp_path / 'cache' / 'train.bin'
+    variants = []
+    for n in (1, 50, 200):
+        labels_dir = str(tmp_path / f'labels{n}')
+        write_labels(labels_dir, {f'{i}.txt': '0 0.5 0.5 0.1 0.1\n' * (i % 4) for i in range(n)})
+        variants.append(SplitLabels.load(labels_dir, os.listdir(labels_dir)))
+
+    errors = []
+
+    def write(labels):
+        try:
+            for _ in range(20):
+                write_label_cache(cache_file, 'key', labels)
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(variants[i % 3],)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    cached = read_label_cache(cache_file, 'key')
+    assert any(cached.names == labels.names and cached.class_ids.tolist() == labels.class_ids.tolist()
+               for labels in variants)
+    assert os.listdir(cache_file.parent) == ['train.bin']  # no temp files left behind
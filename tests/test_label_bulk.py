@@ -0,0 +1,116 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+import yaml
+
+import label_bulk
+from dataset_analysis import analyze_dataset
+from dataset_catalog import DatasetCatalog
+from label_arrays import LabelCache
+from label_bulk import LabelStream, encode_binary, encode_json
+
+LABELS = {
+    'a': '0 0.5 0.5 0.2 0.4\n1 0.25 0.75 0.1 0.1\n',
+    'b': '',
+    'c': '1 0.1 0.2 0.3 0.4\n',
+}
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    root = tmp_path / 'ds'
+    (root / 'train' / 'images').mkdir(parents=True)
+    (root / 'train' / 'labels').mkdir(parents=True)
+    for stem in ('a', 'b', 'c', 'd'):
+        (root / 'train' / 'images' / f'{stem}.jpg').write_bytes(b'')
+    for stem, text in LABELS.items():
+        (root / 'train' / 'labels' / f'{stem}.txt').write_text(text)
+    (root / 'data.yaml').write_text(yaml.safe_dump({'train': 'train/images', 'names': ['x', 'y']}))
+    info = analyze_dataset(str(root))
+    catalog = DatasetCatalog(tmp_path / 'catalog.db')
+    catalog.sync_dataset(info)
+    label_cache = LabelCache(tmp_path / 'labels')
+    split_info = info['splits']['train']
+
+    def stream(after=None, limit=None, whole_split=False, journal=None):
+        split_labels = ((lambda split: label_cache.split_labels('ds', split, split_info['labels_dir']))
+                        if whole_split else None)
+        return LabelStream(lambda after, limit: catalog.page_images('ds', after, limit), after, limit,
+                           split_labels, journal)
+    return stream
+
+
+def decode_binary(data):
+    assert data[:4] == b'LBL1'
+    offset = 4
+
+    def block():
+        nonlocal offset
+        length, = struct.unpack_from('<I', data, offset)
+        value = json.loads(data[offset + 4:offset + 4 + length])
+        offset += 4 + length + (-length % 4)
+        return value
+
+    header, images = block(), []
+    while struct.unpack_from('<I', data, offset)[0]:
+        fields = block()
+        count, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        fields['class_ids'] = np.frombuffer(data, '<i4', count, offset).tolist()
+        offset += 4 * count
+        fields['boxes'] = np.frombuffer(data, '<f4', 4 * count, offset).tolist()
+        offset += 16 * count
+        images.append(fields)
+    offset += 4
+    return header, images, block()
+
+
+def test_json_and_binary_encodings_agree(dataset):
+    body = json.loads(b''.join(encode_json(dataset(), {'dataset': 'ds'})))
+    assert body['success'] and body['next_cursor'] is None
+    images = {image['name']: image for image in body['images']}
+    assert sorted(images) == ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']
+    assert images['a.jpg']['class_ids'] == [0, 1]
+    assert images['a.jpg']['boxes'] == [0.5, 0.5, 0.2, 0.4, 0.25, 0.75, 0.1, 0.1]
+    assert images['b.jpg']['boxes'] == images['d.jpg']['boxes'] == []
+
+    chunks = list(encode_binary(dataset(), {'dataset': 'ds'}, chunk_bytes=1))
+    assert len(chunks) == 5
+    header, binary_images, trailer = decode_binary(b''.join(chunks))
+    assert header == {'dataset': 'ds'} and trailer == {'next_cursor': None}
+    for image in binary_images:
+        expected = images[image['name']]
+        assert image['class_ids'] == expected['class_ids']
+        assert np.allclose(image['boxes'], expected['boxes'])
+
+    # The memory-mapped split cache gives the same labels
+    assert json.loads(b''.join(encode_json(dataset(whole_split=True), {'dataset': 'ds'}))) == body
+
+
+def test_pages_and_batches(dataset, monkeypatch):
+    stream = dataset(limit=3)
+    assert [fields['name'] for fields, _, _ in stream] == ['a.jpg', 'b.jpg', 'c.jpg']
+    rest = dataset(after=stream.next_cursor, limit=3)
+    assert [fields['name'] for fields, _, _ in rest] == ['d.jpg']
+    assert rest.next_cursor is None
+
+    # A whole listing is read in batches and has no cursor
+    monkeypatch.setattr(label_bulk, 'BATCH_IMAGES', 2)
+    stream = dataset()
+    assert [len(class_ids) for _, class_ids, _ in stream] == [2, 0, 1, 0]
+    assert stream.next_cursor is None
+
+
+def test_journal_edits_replace_label_files(dataset):
+    class Journal:
+        def boxes(self, split, name):
+            if name == 'd.jpg':
+                return 3, [(1, 0.5, 0.5, 0.5, 0.5)]
+            return 0, None
+
+    items = {fields['name']: (fields, class_ids, boxes) for fields, class_ids, boxes in dataset(journal=Journal())}
+    fields, class_ids, boxes = items['d.jpg']
+    assert fields['version'] == 3 and class_ids.tolist() == [1] and boxes.shape == (1, 4)
+    assert items['a.jpg'][0]['version'] == 0 and len(items['a.jpg'][1]) == 2
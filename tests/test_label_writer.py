@@ -0,0 +1,52 @@
+import os
+import time
+
+import pytest
+
+from label_writer import TMP_SUFFIX, LabelWriter
+
+
+def test_saves_are_coalesced_and_visible_until_written(tmp_path):
+    flushed = []
+    writer = LabelWriter(flush_interval=60, on_flushed=flushed.append)
+    label = tmp_path / 'labels' / 'a.txt'
+    assert writer.save(label, '0 0.1 0.1 0.1 0.1\n', image='a.jpg') == 1
+    assert writer.save(label, '1 0.2 0.2 0.2 0.2\n', image='a.jpg', version=2) == 1
+    assert writer.save(tmp_path / 'labels' / 'b.txt', '', image='b.jpg') == 2
+    assert writer.pending(label) == '1 0.2 0.2 0.2 0.2\n'
+    assert not label.exists()
+
+    assert writer.flush() == 2
+    assert label.read_text() == '1 0.2 0.2 0.2 0.2\n'
+    assert writer.pending(label) is None
+    assert sorted(flushed[0], key=lambda entry: entry['image']) == [{'image': 'a.jpg', 'version': 2},
+                                                                     {'image': 'b.jpg'}]
+    assert writer.stats == {'saves': 3, 'coalesced': 1, 'writes': 2, 'batches': 1, 'errors': 0}
+    assert not [name for name in os.listdir(tmp_path / 'labels') if name.endswith(TMP_SUFFIX)]
+    assert writer.flush() == 0
+
+
+def test_background_flush(tmp_path):
+    writer = LabelWriter(flush_interval=0.01)
+    label = tmp_path / 'a.txt'
+    writer.save(label, 'text')
+    deadline = time.time() + 10
+    while not label.exists() and time.time() < deadline:
+        time.sleep(0.01)
+    assert label.read_text() == 'text'
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.save(label, 'more')
+
+
+def test_failed_writes_are_counted(tmp_path):
+    flushed = []
+    writer = LabelWriter(flush_interval=60, on_flushed=flushed.append)
+    (tmp_path / 'file').write_text('')
+    writer.save(tmp_path / 'file' / 'a.txt', 'text', image='a.jpg')  # parent is not a directory
+    writer.save(tmp_path / 'b.txt', 'text', image='b.jpg')
+    errors = writer.error_count()
+    assert writer.flush() == 1
+    assert writer.error_count() == errors + 1
+    assert flushed == [[{'image': 'b.jpg'}]]
+    writer.close()
@@ -0,0 +1,53 @@
+import pickle
+
+import pytest
+
+from name_list import ImageNameList
+
+
+def test_sorted_and_indexable():
+    names = ImageNameList(['b.jpg', 'a.jpg', 'é.png', 'c.JPG'])
+    assert list(names) == sorted(['b.jpg', 'a.jpg', 'é.png', 'c.JPG'])
+    assert len(names) == 4
+    assert names[0] == 'a.jpg'
+    assert names[-1] == 'é.png'
+    assert names[1:3] == ['b.jpg', 'c.JPG']
+    with pytest.raises(IndexError):
+        names[4]
+
+
+def test_lookups():
+    names = ImageNameList(f'img_{i:05d}.jpg' for i in range(1000))
+    assert 'img_00500.jpg' in names
+    assert 'img_01000.jpg' not in names
+    assert 'img_0050.jpg' not in names  # a prefix of a name isn't the name
+    assert 42 not in names
+    assert names.index('img_00731.jpg') == 731
+    with pytest.raises(ValueError):
+        names.index('missing.jpg')
+
+
+def test_empty():
+    names = ImageNameList()
+    assert len(names) == 0
+    assert 'a.jpg' not in names
+    assert list(names) == []
+
+
+def test_with_changes():
+    names = ImageNameList(['a.jpg', 'b.jpg'])
+    changed = names.with_changes(added=['c.jpg', 'a.jpg'], removed=['b.jpg', 'x.jpg'])
+    assert changed == ['a.jpg', 'c.jpg']
+    assert names == ['a.jpg', 'b.jpg']  # unchanged
+
+
+def test_undecodable_names_round_trip():
+    name = b'bad\xff.jpg'.decode('utf-8', 'surrogateescape')
+    names = ImageNameList([name, 'ok.jpg'])
+    assert name in names
+    assert names[names.index(name)] == name
+
+
+def test_pickle():
+    names = ImageNameList(['a.jpg', 'b.jpg'])
+    assert pickle.loads(pickle.dumps(names)) == names
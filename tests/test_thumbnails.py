@@ -0,0 +1,103 @@
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+import thumbnails
+from image_probe import EXIF_ORIENTATION_TAG, oriented_size, probe_image
+from thumbnails import THUMBNAIL_SIZES, ThumbnailCache, fallback_key
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (1600, 1200), 'green').save(path)
+    return path
+
+
+def test_one_decode_makes_every_variant(tmp_path, image, monkeypatch):
+    calls = []
+    original = thumbnails.make_thumbnails
+    monkeypatch.setattr(thumbnails, 'make_thumbnails', lambda path, targets: calls.append(targets) or
+                        original(path, targets))
+    cache = ThumbnailCache(tmp_path / 'thumbs')
+    key = fallback_key(image)
+
+    path = cache.get(str(image), key, 128)
+    assert Image.open(path).size == (128, 96)
+    assert len(calls) == 1 and len(calls[0]) == len(THUMBNAIL_SIZES)
+    for size in (512, 640):
+        assert Image.open(cache.get(str(image), key, size)).size == (size, size * 3 // 4)
+    assert len(calls) == 1
+    assert cache.stats == {'hits': 2, 'misses': 1, 'evictions': 0}
+
+    # A restart finds the files on disk
+    reopened = ThumbnailCache(tmp_path / 'thumbs')
+    assert reopened.get(str(image), key, 128) == path
+    assert reopened.stats['hits'] == 1 and len(calls) == 1
+
+
+def test_concurrent_requests_share_one_task(tmp_path, image, monkeypatch):
+    started, release, calls = threading.Event(), threading.Event(), []
+    original = thumbnails.make_thumbnails
+
+    def slow(path, targets):
+        calls.append(path)
+        started.set()
+        release.wait(10)
+        return original(path, targets)
+    monkeypatch.setattr(thumbnails, 'make_thumbnails', slow)
+    cache = ThumbnailCache(tmp_path / 'thumbs')
+    results = []
+    threads = [threading.Thread(target=lambda size=size: results.append(cache.get(str(image), 'k' * 32, size)))
+               for size in (128, 512, 128)]
+    threads[0].start()
+    started.wait(10)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert len(results) == 3 and calls == [str(image)]
+
+
+def test_least_recently_used_files_are_evicted(tmp_path, image, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'THUMBNAIL_SIZES', {128: (128, 128)})
+    cache = ThumbnailCache(tmp_path / 'thumbs', max_bytes=1)  # the newest file is always kept
+    first = cache.get(str(image), 'a' * 32, 128)
+    cache.max_bytes = 2 * os.path.getsize(first)  # same image under every key: room for two files
+
+    cache.get(str(image), 'b' * 32, 128)
+    cache.get(str(image), 'a' * 32, 128)  # used again: b is now the oldest
+    cache.get(str(image), 'c' * 32, 128)
+    assert cache.stats['evictions'] == 1
+    assert os.path.exists(first) and not os.path.exists(cache.path_for('b' * 32, 128))
+
+
+def test_unreadable_images_raise_for_every_waiter(tmp_path):
+    broken = tmp_path / 'broken.jpg'
+    broken.write_bytes(b'not an image')
+    cache = ThumbnailCache(tmp_path / 'thumbs')
+    for _ in range(2):
+        with pytest.raises(OSError):
+            cache.get(str(broken), fallback_key(broken), 128)
+
+
+@pytest.mark.parametrize('size, orientation, expected', [
+    ((1600, 1200), 1, (640, 480)),
+    ((1200, 1600), 1, (360, 480)),
+    ((1600, 1200), 6, (360, 480)),  # stored landscape, displayed portrait
+    ((300, 200), 1, (300, 200)),  # never scaled up
+])
+def test_display_variant_fits_the_canvas(tmp_path, size, orientation, expected):
+    path = tmp_path / 'photo.jpg'
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION_TAG] = orientation
+    Image.new('RGB', size, 'green').save(path, exif=exif)
+
+    variant = Image.open(ThumbnailCache(tmp_path / 'thumbs').get(str(path), fallback_key(path), 'display'))
+    assert variant.size == expected
+    # Same aspect as the displayed original, so normalized boxes line up on either
+    width, height = oriented_size(*probe_image(path))
+    assert abs(variant.size[0] / variant.size[1] - width / height) < 0.01
@@ -0,0 +1,165 @@
+"""
+Thumbnail cache for dataset images.
+
+Variants of an image are made at a few fixed sizes (THUMBNAIL_SIZES). On a
+miss, one worker task decodes the image once, in JPEG draft mode (the decoder
+scales by 1/2-1/8 while decoding, so a 12MP photo never gets decoded at full
+size), and writes every missing variant of it, each scaled down from the
+smallest variant already made whose box covers its own. Requests for the
+same image while that task runs wait for it instead of starting their own.
+
+Files are content addressed: named after the image's content hash (from the
+catalog) and the variant, so identical images share thumbnails and an edited
+image never gets a stale one. The cache is bounded in bytes and evicts the
+least recently used files. Use order is kept in memory and in file mtimes,
+which survive restarts.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+# Variant -> bounding box. display is the annotation canvas (MAX_WIDTH x MAX_HEIGHT in script.js).
+THUMBNAIL_SIZES = {128: (128, 128), 512: (512, 512), 640: (640, 640), 'display': (640, 480)}
+JPEG_QUALITY = 85
+MAX_CACHE_BYTES = 1024 * 1024 * 1024
+
+
+def make_thumbnails(source_path, targets, quality=JPEG_QUALITY):
+    """Write variants of one image; targets are (path, (max_width, max_height)), in any order.
+
+    Runs in worker processes. Returns the paths written.
+    """
+    targets = sorted(targets, key=lambda target: -target[1][0] * target[1][1])
+    written, made = [], []  # made: (box, image) of the variants so far
+    with Image.open(source_path) as img:
+        # The box may apply to the rotated image, so leave room for either orientation
+        largest = max(max(box) for _, box in targets)
+        img.draft('RGB', (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        for path, box in targets:
+            # Scale down the smallest variant made so far that still covers this box
+            source = next((image for made_box, image in reversed(made)
+                           if made_box[0] >= box[0] and made_box[1] >= box[1]), img)
+            variant = source.copy()
+            variant.thumbnail(box, Image.LANCZOS)
+            made.append((box, variant))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            variant.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+            os.replace(tmp_path, path)
+            written.append(path)
+    return written
+
+
+def fallback_key(path):
+    """Cache key for an image without a known content hash: its path, size and mtime"""
+    st = os.stat(path)
+    return hashlib.blake2b(f'{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}'.encode(),
+                           digest_size=16).hexdigest()
+
+
+class ThumbnailCache:
+    """Size-bounded LRU cache of image variants on disk"""
+
+    def __init__(self, cache_dir, max_bytes=MAX_CACHE_BYTES, executor=None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.executor = executor
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._files = None  # path -> size, least recently used first; loaded on first use
+        self._bytes = 0
+        self._inflight = {}  # cache key -> future of the task making its variants
+        self._lock = threading.Lock()
+
+    def _load(self):
+        files = []
+        if self.cache_dir.is_dir():
+            for path in self.cache_dir.rglob('*.jpg'):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime_ns, str(path), st.st_size))
+        files.sort()
+        self._files = OrderedDict((path, size) for _, path, size in files)
+        self._bytes = sum(self._files.values())
+
+    def path_for(self, key, size):
+        return str(self.cache_dir / key[:2] / f'{key}-{size}.jpg')
+
+    def get(self, source_path, key, size):
+        """Path of an image's variant, making it (and the image's other missing variants) if needed"""
+        path = self.path_for(key, size)
+        hit = owner = False
+        with self._lock:
+            if self._files is None:
+                self._load()
+            if path in self._files and os.path.exists(path):
+                self._files.move_to_end(path)
+                self.stats['hits'] += 1
+                hit = True
+            else:
+                self.stats['misses'] += 1
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = concurrent.futures.Future()
+                    owner = True
+                    targets = [(self.path_for(key, variant), box) for variant, box in THUMBNAIL_SIZES.items()
+                               if self.path_for(key, variant) not in self._files or variant == size]
+        if hit:
+            try:
+                os.utime(path)  # use order for the next start
+            except OSError:
+                pass
+            return path
+        if owner:
+            self._make(key, future, source_path, targets)
+        future.result()  # raises if the image couldn't be made
+        return path
+
+    def _make(self, key, future, source_path, targets):
+        try:
+            written = self._run(source_path, targets)
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._inflight.pop(key, None)
+            for path in written:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                self._bytes += size - self._files.get(path, 0)
+                self._files[path] = size
+                self._files.move_to_end(path)
+            self._evict()
+        future.set_result(written)
+
+    def _run(self, source_path, targets):
+        if self.executor is not None:
+            try:
+                return self.executor.submit(make_thumbnails, source_path, targets).result()
+            except RuntimeError:
+                pass  # pool shut down or broken: make them here
+        return make_thumbnails(source_path, targets)
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            path, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self.stats['evictions'] += 1
+            try:
+                os.unlink(path)
+            except OSError:
+                pass